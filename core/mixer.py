@@ -16,7 +16,11 @@ from PySide import QtCore
 
 from lib.buffer_utils import BufferUtils
 from lib.audio_emitter import AudioEmitter
-from lib.colors import blend_to_buffer
+from lib.modulation import ModulationEngine
+from lib.profiling import Profiler
+from lib.colors import blend_to_buffer, convert_color_space
+from lib.shard_renderer import ShardRenderer
+from lib.node_sync import Conductor, Follower
 
 log = logging.getLogger("firemix.core.mixer")
 
@@ -37,6 +41,7 @@ class Mixer(QtCore.QObject):
         self._running = False
         self._enable_rendering = True
         self._main_buffer = None
+        self._conversion_buffer = None
         self._tick_time_data = dict()
         self._num_frames = 0
         self._last_frame_time = 0.0
@@ -55,6 +60,16 @@ class Mixer(QtCore.QObject):
         self._last_tick_time = time.time()
         self._audio_emitters_by_group = {}
         self._layers = []
+        self.modulation = ModulationEngine()
+        self.profiler = Profiler(log_slow_frames=self._enable_profiling)
+        self._shards = None
+        self._conductor = None
+        self._follower = None
+        command_stream = self._app.settings.get('networking').get('command-stream', {})
+        # A command stream can't be limited to some strands, so --strands always sends frames
+        self._enable_command_stream = (command_stream.get('enabled', False) and
+                                       not self._app.args.strands)
+        self._command_stream_max_commands = command_stream.get('max-commands', 64)
 
         if self._app.args.yappi and USE_YAPPI:
             yappi.start()
@@ -71,8 +86,21 @@ class Mixer(QtCore.QObject):
             fh = self._scene.fixture_hierarchy()
 
             self._main_buffer = BufferUtils.create_buffer()
+            self._conversion_buffer = BufferUtils.create_buffer()
+
+            num_shards = self._app.settings.get('mixer').get('render-shards', 0)
+            if num_shards > 1:
+                self._shards = ShardRenderer(self._scene, num_shards, self._tick_rate)
+
+        if self._app.args.follower:
+            self._follower = Follower(self, self._app.args.follower)
+        elif self._app.args.conductor:
+            self._conductor = Conductor(self, self._app.settings.get('sync', {}))
 
     def save(self):
+        # A follower's parameters are set by its conductor, so its playlists are not saved
+        if self._follower is not None:
+            return
         for layer in self._layers:
             layer.save()
 
@@ -94,6 +122,9 @@ class Mixer(QtCore.QObject):
         self._tick_timer.cancel()
         self._stop_time = time.time()
 
+        if self._shards is not None:
+            self._shards.stop()
+
         if self._app.args.yappi and USE_YAPPI:
             yappi.print_stats(sort_type=yappi.SORTTYPE_TSUB, limit=15, thread_stats_on=False)
 
@@ -110,6 +141,7 @@ class Mixer(QtCore.QObject):
         if (t - self._last_onset_time) > self._onset_holdoff:
             self._last_onset_time = t
             self._onset = True
+            self.modulation.trigger()
 
     def audio_emitter(self, group):
         audio_emitter = self._audio_emitters_by_group.get(group, None)
@@ -135,12 +167,20 @@ class Mixer(QtCore.QObject):
         audio_emitter = self.audio_emitter(feature_group)
         audio_emitter.on_feature_update(feature_name, feature)
 
+        if self._shards is not None:
+            self._shards.feature_received(feature)
+        if self._conductor is not None:
+            self._conductor.feature_received(feature)
+
         # Maintain legacy onset behavior.
         if feature['feature'] == 'onset' and feature['value']:
             t = time.clock()
             if (t - self._last_onset_time) > self._onset_holdoff:
                 self._onset = True
                 self._last_onset_time = t
+                self.modulation.trigger()
+
+        self.modulation.feature_received(feature)
 
         for layer in self._layers:
             layer.feature_received(feature)
@@ -188,6 +228,16 @@ class Mixer(QtCore.QObject):
                 return layer
         return None
 
+    def tick_preset(self, preset, dt):
+        """
+        Ticks a preset.  Presets that support it are rendered on the shard processes when
+        sharding is enabled (see lib/shard_renderer.py).
+        """
+        if self._shards is not None and preset.shardable:
+            if self._shards.render(preset, dt, self.is_onset()):
+                return
+        preset.tick(dt)
+
     def get_tick_rate(self):
         return self._tick_rate
 
@@ -206,43 +256,71 @@ class Mixer(QtCore.QObject):
         dt = now - self._last_tick_time
         self._last_tick_time = now
 
-        if self._frozen:
+        if self._follower is not None:
+            # Draw the conductor's next frame, with its time step, or nothing
+            dt = self._follower.follow(1.0 / self._tick_rate)
+            if dt is None:
+                return
+        elif self._frozen:
             return
+        else:
+            dt *= self._global_speed
 
-        dt *= self._global_speed
+        # A follower's modulated parameters are set by its conductor
+        if self._follower is None:
+            self.modulation.tick(dt, [preset for layer in self._layers
+                                      for preset in layer.get_playing_presets()])
+        if self._conductor is not None:
+            self._conductor.publish(dt)
+        if self._shards is not None:
+            self._shards.advance(dt)
 
         # Draw every layer to the main buffer.
         output_buffer = self._main_buffer
 
         if len(self._layers) == 1:
             output_buffer = self._layers[0].draw(dt)
+            color_space = self._layers[0].get_color_space()
         else:
             # Clear the output buffer.
             output_buffer[:] = (0.0, 0.0, 0.0)
 
-            for layer in self._layers:
-                layer_buffer = layer.draw(dt)
-                output_buffer = blend_to_buffer(layer_buffer, output_buffer, 0.5, 'overwrite')
+            # Layers are blended in RGB if they are all RGB, and in HLS otherwise.
+            layer_buffers = [(layer.draw(dt), layer.get_color_space()) for layer in self._layers]
+            color_space = 'RGB' if all(space == 'RGB' for _, space in layer_buffers) else 'HLS'
+            for layer_buffer, layer_color_space in layer_buffers:
+                layer_buffer = convert_color_space(layer_buffer, layer_color_space, color_space,
+                                                   self._conversion_buffer)
+                output_buffer = blend_to_buffer(layer_buffer, output_buffer, 0.5, 'overwrite',
+                                                color_space)
 
         if self._enable_rendering:
             # Apply the global dimmer to output_buffer.
             if self._global_dimmer < 1.0:
-                output_buffer.T[1] *= self._global_dimmer
+                if color_space == 'RGB':
+                    output_buffer *= self._global_dimmer
+                else:
+                    output_buffer.T[1] *= self._global_dimmer
 
             # Mod hue by 1 (to allow wrap-around) and clamp lightness and
-            # saturation to [0, 1].
-            output_buffer.T[0] = np.mod(output_buffer.T[0], 1.0)
-            np.clip(output_buffer.T[1], 0.0, 1.0, output_buffer.T[1])
-            np.clip(output_buffer.T[2], 0.0, 1.0, output_buffer.T[2])
+            # saturation to [0, 1].  RGB is clamped when it is sent.
+            if color_space == 'HLS':
+                output_buffer.T[0] = np.mod(output_buffer.T[0], 1.0)
+                np.clip(output_buffer.T[1], 0.0, 1.0, output_buffer.T[1])
+                np.clip(output_buffer.T[2], 0.0, 1.0, output_buffer.T[2])
 
-            # Write this buffer to enabled clients.
+            # Write this buffer (or the equivalent command stream) to enabled clients.
             if self._net is not None:
-                self._net.write_buffer(output_buffer)
+                command_buffer = self.get_command_stream()
+                if command_buffer is not None:
+                    self._net.write_commands(command_buffer)
+                else:
+                    self._net.write_buffer(output_buffer, color_space)
         else:
             # TODO(rryan): Make this layer-aware.
             if self._net is not None:
                 self._net.write_commands(
-                    self.default_layer()._playlist.get_active_preset().get_commands_packed())
+                    self.default_layer()._playlist.get_active_preset().get_command_buffer())
 
         if self._reset_onset:
             self._onset = False
@@ -264,6 +342,31 @@ class Mixer(QtCore.QObject):
             control_updates.append(('%s,position_z' % group, z))
         self._app.osc_server.broadcast_mixxx_control_updates(control_updates)
 
+    def get_command_stream(self):
+        """
+        Returns the CommandBuffer to send in place of the rendered frame, or None if the
+        full frame must be sent.  The command stream is only used when it is enabled in the
+        networking settings, a single layer is playing a command-based preset outside of a
+        transition with the dimmer at full, and the preset issued no more than the
+        configured maximum number of commands.
+        """
+        if not self._enable_command_stream or len(self._layers) != 1 or self._global_dimmer < 1.0:
+            return None
+
+        layer = self._layers[0]
+        if layer._in_transition:
+            return None
+
+        preset = layer.playlist().get_active_preset()
+        if preset is None:
+            return None
+
+        command_buffer = preset.get_command_buffer()
+        if len(command_buffer) == 0 or len(command_buffer) > self._command_stream_max_commands:
+            return None
+
+        return command_buffer
+
     def scene(self):
         return self._scene
 
@@ -7,11 +7,15 @@ import time
 
 from profilehooks import profile
 
-from lib.colors import hls_to_rgb
+from lib.colors import to_rgb8
 from lib.buffer_utils import BufferUtils
 
 COMMAND_SET_BGR = 0x10
 COMMAND_SET_RGB = 0x20
+COMMAND_STREAM = 0x30
+
+# Largest command-stream payload sent in a single datagram
+MAX_COMMAND_STREAM_PAYLOAD = 1400
 
 class Networking:
 
@@ -20,24 +24,79 @@ class Networking:
         self._app = app
         self.open_socket()
         self._packet_cache = {}
+        self._rgb8_buffer = None
+        self._strands = None
 
     def open_socket(self):
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    def write_commands(self, commands):
-        """TODO implement"""
-        pass
+    def set_strands(self, first, last):
+        """
+        Limits write_buffer() to strands first up to (but not including) last
+        """
+        self._strands = (first, last)
+
+    def write_commands(self, command_buffer):
+        """
+        Sends a frame as a stream of commands rather than as pixel data.
+
+        The commands from a CommandBuffer are packed (see CommandBuffer.pack_stream) and
+        batched into datagrams of at most MAX_COMMAND_STREAM_PAYLOAD bytes, without splitting
+        a command across datagrams.  Each datagram has the same 4-byte header as a strand
+        write, except that the first byte is the index of the datagram within the frame
+        (so receivers can tell where a frame starts) and the command byte is COMMAND_STREAM.
+        """
+        clients = [client for client in self._app.settings['networking']['clients']
+                   if client["enabled"]]
+
+        if not clients or len(command_buffer) == 0:
+            return
+
+        datagrams = {}
+        for client in clients:
+            client_color_mode = client["color-mode"]
+            if client_color_mode not in ('RGB8', 'BGR8'):
+                raise NotImplementedError('Unknown color mode: %s' % client_color_mode)
+
+            if client_color_mode not in datagrams:
+                data, lengths = command_buffer.pack_stream(swap_order=(client_color_mode == 'BGR8'))
+                datagrams[client_color_mode] = self._split_command_stream(data, lengths)
+
+            for packet in datagrams[client_color_mode]:
+                try:
+                    self._socket.sendto(packet, (client["host"], client["port"]))
+                except IOError as (errno, strerror):
+                    print "I/O error({0}): {1}".format(errno, strerror)
+
+    def _split_command_stream(self, data, lengths):
+        """
+        Splits packed command data into a list of datagrams (see write_commands)
+        """
+        packets = []
+        ends = np.cumsum(lengths)
+        start = 0
+        while start < len(data):
+            # Last command boundary that fits in this datagram
+            end = ends[np.searchsorted(ends, start + MAX_COMMAND_STREAM_PAYLOAD, side='right') - 1]
+            length = end - start
+            header = [len(packets) & 0xFF, COMMAND_STREAM, length & 0x00FF, (length & 0xFF00) >> 8]
+            packets.append(array.array('B', header).tostring() + data[start:end].tostring())
+            start = end
+        return packets
 
     @profile
-    def write_buffer(self, buffer):
+    def write_buffer(self, buffer, color_space='HLS'):
         """
         Performs a bulk strand write.
-        Decodes the HLS-Float data according to client settings
+        Decodes the HLS-Float (or, if color_space is 'RGB', RGB-Float) data according to
+        client settings
         """
         strand_settings = self._app.scene.get_strand_settings()
 
         # Protect against presets or transitions that write float data.
-        buffer_rgb = np.int_(hls_to_rgb(buffer) * 255)
+        if self._rgb8_buffer is None or len(self._rgb8_buffer) != len(buffer):
+            self._rgb8_buffer = np.empty((len(buffer), 3), dtype=np.uint8)
+        buffer_rgb = to_rgb8(buffer, color_space, self._rgb8_buffer)
 
         def fill_packet(intbuffer, start, end, offset, packet, swap_order=False):
             for pixel_index, pixel in enumerate(intbuffer[start:end]):
@@ -60,6 +119,8 @@ class Networking:
         for strand in xrange(len(strand_settings)):
             if not strand_settings[strand]["enabled"]:
                 continue
+            if self._strands is not None and not self._strands[0] <= strand < self._strands[1]:
+                continue
             packet = array.array('B', [])
 
             color_mode = strand_settings[strand]["color-mode"]
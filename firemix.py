@@ -32,6 +32,9 @@ if __name__ == "__main__":
     parser.add_argument("--noaudio", action='store_const', const=True, default=False, help="Disable audio processing client")
     parser.add_argument("--osc_port", type=int, default=2447, help="OSC server port")
     parser.add_argument("--mixxx_osc_port", type=int, default=2448, help="Mixxx OSC server port")
+    parser.add_argument("--conductor", action='store_const', const=True, default=False, help="Drive the follower instances listed in the sync settings")
+    parser.add_argument("--follower", type=int, default=None, help="Follow a conductor, listening on this port")
+    parser.add_argument("--strands", type=str, default=None, help="Send only strands FIRST-LAST of the scene to the clients")
     parser.add_argument("--noosc", action='store_const', const=True, default=False, help="Disable OSC server")
 
     args = parser.parse_args()
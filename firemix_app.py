@@ -28,6 +28,11 @@ class FireMixApp(QtCore.QThread):
         self.net = Networking(self)
         BufferUtils.set_app(self)
         self.scene = Scene(self)
+        if self.args.strands:
+            # The whole scene is still rendered, so that transitions and presets make the
+            # same choices as on the other nodes; only the output is limited
+            first, last = [int(strand) for strand in self.args.strands.split('-')]
+            self.net.set_strands(first, last + 1)
         self.plugins = PluginLoader()
         self.mixer = Mixer(self)
 
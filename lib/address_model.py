@@ -0,0 +1,205 @@
+import unittest
+import numpy as np
+
+
+class AddressModel:
+    """
+    Translates between logical (strand, fixture, offset) pixel addresses and indices into
+    frame buffers.
+
+    Pixels are laid out strand by strand, and within a strand fixture by fixture in address
+    order, so an address maps to fixture_offsets[strand, fixture] + offset.  The offset
+    tables are prefix sums held in numpy arrays:
+
+        strand_offsets[s]           index of the first pixel of strand s (with one extra
+                                    entry holding the number of pixels)
+        fixture_offsets[s, f]       index of the first pixel of fixture f on strand s
+        fixture_pixel_counts[s, f]  pixels on that fixture (zero if it does not exist)
+
+    and pixel_fixture maps each buffer index back to its fixture, so lookups in either
+    direction are a few array reads and work on whole arrays of addresses.  Each scene has
+    its own model (see Scene.get_address_model()).
+    """
+
+    def __init__(self, fixtures):
+        self.fixture_strands = np.array([f.strand for f in fixtures], dtype=np.int_)
+        self.fixture_addresses = np.array([f.address for f in fixtures], dtype=np.int_)
+        self.fixture_pixels = np.array([f.pixels for f in fixtures], dtype=np.int_)
+
+        num_strands = self.fixture_strands.max() + 1 if len(fixtures) else 0
+        num_fixtures = self.fixture_addresses.max() + 1 if len(fixtures) else 0
+
+        # Position of each fixture in the fixture list, or -1
+        self.fixture_ids = np.full((num_strands, num_fixtures), -1, dtype=np.int_)
+        self.fixture_ids[self.fixture_strands, self.fixture_addresses] = np.arange(len(fixtures))
+
+        self.fixture_pixel_counts = np.zeros((num_strands, num_fixtures), dtype=np.int_)
+        self.fixture_pixel_counts[self.fixture_strands, self.fixture_addresses] = self.fixture_pixels
+
+        self.strand_offsets = np.zeros(num_strands + 1, dtype=np.int_)
+        np.cumsum(self.fixture_pixel_counts.sum(axis=1), out=self.strand_offsets[1:])
+        self.fixture_offsets = (self.strand_offsets[:-1, np.newaxis] +
+                                np.cumsum(self.fixture_pixel_counts, axis=1) - self.fixture_pixel_counts)
+        self.fixture_starts = self.fixture_offsets[self.fixture_strands, self.fixture_addresses]
+        self.num_pixels = self.strand_offsets[-1]
+
+        # Buffers are sized for the (strand, fixture, pixel) matrix of the scene, so they
+        # can be longer than the number of pixels
+        if len(fixtures):
+            self.buffer_length = (len(np.unique(self.fixture_strands)) *
+                                  np.bincount(self.fixture_strands).max() * self.fixture_pixels.max())
+        else:
+            self.buffer_length = 0
+        self.buffer_length = max(self.buffer_length, self.num_pixels)
+
+        self.pixel_fixture = np.full(self.buffer_length, -1, dtype=np.int32)
+        order = np.argsort(self.fixture_starts, kind='mergesort')
+        self.pixel_fixture[:self.num_pixels] = np.repeat(order, self.fixture_pixels[order])
+
+    def logical_to_index(self, strands, fixtures, offsets):
+        """
+        Returns the buffer indices of the given addresses (scalars or arrays).  The
+        addresses are not checked; see index() for a checked lookup.
+        """
+        return self.fixture_offsets[strands, fixtures] + offsets
+
+    def index_to_logical(self, indices):
+        """
+        Returns (strands, fixtures, offsets) for the given buffer indices (scalars or arrays),
+        which must be pixels of the scene
+        """
+        ids = self.pixel_fixture[indices]
+        return (self.fixture_strands[ids], self.fixture_addresses[ids],
+                indices - self.fixture_starts[ids])
+
+    def fixture_index(self, strand, address):
+        """
+        Returns the position of a fixture in the scene's fixture list, or -1 if there is none
+        """
+        if 0 <= strand < self.fixture_ids.shape[0] and 0 <= address < self.fixture_ids.shape[1]:
+            return int(self.fixture_ids[strand, address])
+        return -1
+
+    def index(self, strand, fixture, offset):
+        """
+        Returns the buffer index of a single address
+        """
+        if self.fixture_index(strand, fixture) < 0:
+            raise ValueError("No such fixture: %d:%d" % (strand, fixture))
+        return int(self.fixture_offsets[strand, fixture] + offset)
+
+    def logical(self, index):
+        """
+        Returns the (strand, fixture, offset) address of a single buffer index
+        """
+        if not 0 <= index < self.buffer_length or self.pixel_fixture[index] < 0:
+            raise ValueError("Index out of range: %s" % repr(index))
+        strand, fixture, offset = self.index_to_logical(index)
+        return (int(strand), int(fixture), int(offset))
+
+    def fixture_extents(self, strand, fixture):
+        """
+        Returns the (start, end) buffer indices of a fixture
+        """
+        if self.fixture_index(strand, fixture) < 0:
+            raise KeyError((strand, fixture))
+        start = int(self.fixture_offsets[strand, fixture])
+        return (start, start + int(self.fixture_pixel_counts[strand, fixture]))
+
+    def strand_extents(self, strand):
+        """
+        Returns the (start, end) buffer indices of a strand
+        """
+        return (int(self.strand_offsets[strand]), int(self.strand_offsets[strand + 1]))
+
+    def strand_view(self, buffer, strand):
+        """
+        Returns the part of a frame buffer holding a strand, as a view (not a copy)
+        """
+        start, end = self.strand_extents(strand)
+        return buffer[start:end]
+
+    def fixture_view(self, buffer, strand, fixture):
+        """
+        Returns the part of a frame buffer holding a fixture, as a view (not a copy)
+        """
+        start, end = self.fixture_extents(strand, fixture)
+        return buffer[start:end]
+
+
+class TestAddressModel(unittest.TestCase):
+
+    def make_model(self, pixels):
+        """
+        Returns a model for fixtures given as {(strand, address): pixels}
+        """
+        from lib.fixture import Fixture
+        return AddressModel([Fixture({"strand": strand, "address": address, "pixels": count})
+                             for (strand, address), count in sorted(pixels.items())])
+
+    def rectangular(self):
+        return self.make_model(dict(((strand, address), 4) for strand in xrange(3)
+                                    for address in xrange(5)))
+
+    def ragged(self):
+        # Strands of different lengths, fixtures of different lengths, and a missing address
+        return self.make_model({(0, 0): 4, (0, 1): 7, (0, 2): 1,
+                                (1, 0): 3, (1, 2): 5,
+                                (2, 0): 6})
+
+    def check_round_trip(self, model):
+        addresses = [(strand, address, offset)
+                     for strand, address, count in zip(model.fixture_strands, model.fixture_addresses,
+                                                       model.fixture_pixels)
+                     for offset in xrange(count)]
+        indices = [model.index(*address) for address in addresses]
+        self.assertEqual(sorted(indices), range(model.num_pixels))
+        for address, index in zip(addresses, indices):
+            self.assertEqual(model.logical(index), address)
+
+        strands, fixtures, offsets = np.array(addresses).T
+        np.testing.assert_array_equal(model.logical_to_index(strands, fixtures, offsets), indices)
+        for expected, actual in zip((strands, fixtures, offsets), model.index_to_logical(np.array(indices))):
+            np.testing.assert_array_equal(actual, expected)
+
+        for index in xrange(model.num_pixels, model.buffer_length):
+            self.assertRaises(ValueError, model.logical, index)
+
+    def check_views(self, model):
+        buffer = np.zeros((model.buffer_length, 3), dtype=np.float32)
+        for strand in np.unique(model.fixture_strands):
+            fixtures = sorted(model.fixture_addresses[model.fixture_strands == strand])
+            strand_view = model.strand_view(buffer, strand)
+            self.assertEqual(len(strand_view),
+                             sum(model.fixture_pixel_counts[strand, fixture] for fixture in fixtures))
+
+            # The fixtures of a strand tile its view in address order
+            position = model.strand_extents(strand)[0]
+            for fixture in fixtures:
+                start, end = model.fixture_extents(strand, fixture)
+                self.assertEqual(start, position)
+                self.assertEqual(end - start, model.fixture_pixel_counts[strand, fixture])
+                model.fixture_view(buffer, strand, fixture)[:] = (strand, fixture, 1)
+                position = end
+            self.assertEqual(position, model.strand_extents(strand)[1])
+            np.testing.assert_array_equal(strand_view[:, 0], strand)
+
+        self.assertTrue(buffer[:model.num_pixels, 2].all())
+        self.assertFalse(buffer[model.num_pixels:].any())
+
+    def test_rectangular(self):
+        model = self.rectangular()
+        self.assertEqual(model.num_pixels, 60)
+        self.assertEqual(model.buffer_length, 60)
+        self.check_round_trip(model)
+        self.check_views(model)
+
+    def test_ragged(self):
+        model = self.ragged()
+        self.assertEqual(model.num_pixels, 26)
+        self.assertEqual(model.buffer_length, 3 * 3 * 7)
+        self.check_round_trip(model)
+        self.check_views(model)
+        self.assertEqual(model.fixture_index(1, 1), -1)
+        self.assertRaises(ValueError, model.index, 1, 1, 0)
+        self.assertRaises(KeyError, model.fixture_extents, 1, 1)
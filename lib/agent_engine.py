@@ -0,0 +1,137 @@
+import numpy as np
+
+from lib.buffer_utils import BufferUtils
+
+
+class AgentEngine:
+    """
+    Agents that walk along the fixtures of a scene, for Dragons-style presets.
+
+    Walking is table-driven: next_pixel[0] holds the next buffer index moving forward
+    (towards the end of a fixture) and next_pixel[1] moving backward, with -1 where the
+    walk leaves the fixture.  Leaving the fixture at a pixel puts the agent at a junction,
+    whose branches (the endpoints of colliding fixtures, and the direction that leads into
+    each of them) are stored in CSR form: branch_pixels[branch_indptr[i]:branch_indptr[i + 1]].
+
+    Agents are slots in parallel numpy arrays (position, direction, state and birth time);
+    inactive slots are reused.
+    """
+
+    def __init__(self, scene, capacity=64):
+        self._scene = scene
+        self.random = np.random.RandomState()
+        self._build_tables(scene)
+        self._allocate(capacity)
+
+    def _build_tables(self, scene):
+        num_pixels = BufferUtils.get_buffer_size()
+        self.next_pixel = np.full((2, num_pixels), -1, dtype=np.int_)
+
+        sources = []
+        targets = []
+        directions = []
+        for f in scene.fixtures():
+            start, end = BufferUtils.get_fixture_extents(f.strand, f.address)
+            self.next_pixel[0, start:end - 1] = np.arange(start + 1, end)
+            self.next_pixel[1, start + 1:end] = np.arange(start, end - 1)
+
+            for index, loc in ((start, 'start'), (end - 1, 'end')):
+                for strand, address, pixel in scene.get_colliding_fixtures(f.strand, f.address, loc):
+                    if (strand, address) == (f.strand, f.address):
+                        continue
+                    sources.append(index)
+                    targets.append(BufferUtils.logical_to_index((strand, address, pixel)))
+                    directions.append(1 if pixel == 0 else -1)
+
+        sources = np.asarray(sources, dtype=np.int_)
+        order = np.argsort(sources, kind='mergesort')
+        self.branch_indptr = np.zeros(num_pixels + 1, dtype=np.int_)
+        np.cumsum(np.bincount(sources, minlength=num_pixels), out=self.branch_indptr[1:])
+        self.branch_pixels = np.asarray(targets, dtype=np.int_)[order]
+        self.branch_directions = np.asarray(directions, dtype=np.int8)[order]
+        self.num_pixels = num_pixels
+
+    def _allocate(self, capacity):
+        old_capacity = len(getattr(self, 'active', []))
+
+        def grow(name, dtype):
+            new = np.zeros(capacity, dtype=dtype)
+            if old_capacity > 0:
+                new[:old_capacity] = getattr(self, name)
+            setattr(self, name, new)
+
+        grow('active', bool)
+        grow('position', np.int_)
+        grow('direction', np.int8)
+        grow('state', np.int8)
+        grow('born', np.float64)
+        grow('accumulator', np.float64)
+
+    def reset(self):
+        self.active[:] = False
+
+    def __len__(self):
+        return np.count_nonzero(self.active)
+
+    def slots(self, state=None):
+        """
+        Returns the slots of the active agents (in the given state, if any)
+        """
+        if state is None:
+            return np.flatnonzero(self.active)
+        return np.flatnonzero(self.active & (self.state == state))
+
+    def spawn(self, positions, directions, state, time):
+        """
+        Creates one agent per position and returns their slots
+        """
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int_))
+        free = np.flatnonzero(~self.active)
+        if len(free) < len(positions):
+            self._allocate(max(2 * len(self.active), len(self.active) + len(positions)))
+            free = np.flatnonzero(~self.active)
+
+        slots = free[:len(positions)]
+        self.active[slots] = True
+        self.position[slots] = positions
+        self.direction[slots] = directions
+        self.state[slots] = state
+        self.born[slots] = time
+        self.accumulator[slots] = 0.0
+        return slots
+
+    def kill(self, slots):
+        self.active[slots] = False
+
+    def next_positions(self, slots):
+        """
+        Returns the pixel each agent would move to, or -1 for agents at a junction
+        """
+        return self.next_pixel[(self.direction[slots] < 0).astype(np.int_), self.position[slots]]
+
+    def branches(self, slots):
+        """
+        Returns (owners, pixels, directions) listing every branch out of each agent's current
+        pixel, where owners holds the agent slot each branch belongs to
+        """
+        positions = self.position[slots]
+        starts = self.branch_indptr[positions]
+        counts = self.branch_indptr[positions + 1] - starts
+        owners = np.repeat(slots, counts)
+        edges = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return owners, self.branch_pixels[edges], self.branch_directions[edges]
+
+    def occupancy(self):
+        """
+        Returns the number of active agents on each pixel
+        """
+        return np.bincount(self.position[self.active], minlength=self.num_pixels)
+
+    def occupied(self, positions):
+        return self.occupancy()[positions] > 0
+
+    def collisions(self, slots):
+        """
+        Returns a mask over slots that is set for agents sharing a pixel with another active agent
+        """
+        return self.occupancy()[self.position[slots]] > 1
@@ -1,4 +1,10 @@
+import numpy as np
+
 from lib.parameters import Parameter
+from lib.commands import OPCODE_SET_ALL, OPCODE_SET_STRAND, OPCODE_SET_FIXTURE, OPCODE_SET_PIXEL
+
+# Command opcode for a ticker light tuple, indexed by the length of the tuple
+LIGHT_OPCODES = (OPCODE_SET_ALL, OPCODE_SET_STRAND, OPCODE_SET_FIXTURE, OPCODE_SET_PIXEL)
 
 
 def constant(lights, color):
@@ -27,6 +33,7 @@ def fade(lights, colorfade, mod=1):
     def ret(ticks, elapsed_time):
         yield(lights, colorfade.get_color(elapsed_time * colorfade._steps % colorfade._steps))
 
+    ret.fade = (lights, colorfade)
     return ret
 
 def flash(light, color, p_on, p_off):
@@ -60,6 +67,7 @@ def offset(ticker, offset):
         for output in ticker(ticks, elapsed_time + o):
             yield(output)
 
+    ret.transform = ('offset', offset, ticker)
     return ret
 
 def speed(ticker, multiple):
@@ -75,6 +83,7 @@ def speed(ticker, multiple):
         for output in ticker(ticks, elapsed_time * m):
             yield(output)
 
+    ret.transform = ('speed', multiple, ticker)
     return ret
 
 def callback(fn, interval):
@@ -94,4 +103,130 @@ def callback(fn, interval):
 
     ret.last_time = 0.0
 
-    return ret
\ No newline at end of file
+    return ret
+
+
+def _unwrap_fade(ticker):
+    """
+    If ticker is a fade() wrapped in any number of offset() and speed() tickers, returns a
+    tuple of (transforms, lights, colorfade), where transforms is a list of (kind, value)
+    tuples ordered from the outermost wrapper inwards.  Otherwise returns None.
+    """
+    transforms = []
+    while hasattr(ticker, 'transform'):
+        kind, value, ticker = ticker.transform
+        transforms.append((kind, value))
+
+    if not hasattr(ticker, 'fade'):
+        return None
+
+    lights, colorfade = ticker.fade
+    return (transforms, lights, colorfade)
+
+
+class FadeGroup:
+    """
+    A run of fade() tickers that share a ColorFade, a priority and the same chain of
+    offset()/speed() wrappers.  Wrappers driven by a Parameter must use the same Parameter
+    in every ticker of the group; constant offsets and speeds may differ per ticker.
+
+    The whole group is evaluated at once: the time of every ticker is computed as an array,
+    indexed into the ColorFade cache, and appended to a CommandBuffer in one batch.
+    """
+
+    def __init__(self, colorfade, transforms, priority):
+        self.key = FadeGroup.make_key(colorfade, transforms, priority)
+        self._colorfade = colorfade
+        self._priority = priority
+        self._transforms = [(kind, value if isinstance(value, Parameter) else [])
+                            for kind, value in transforms]
+        self._num_tickers = 0
+        self._light_tickers = []
+        self._lights = []
+
+    @staticmethod
+    def make_key(colorfade, transforms, priority):
+        return (id(colorfade), priority,
+                tuple((kind, id(value) if isinstance(value, Parameter) else None)
+                      for kind, value in transforms))
+
+    def add(self, transforms, lights):
+        """
+        Adds a ticker to the group.  The ticker must have the same key as the group.
+        """
+        for (kind, values), (_, value) in zip(self._transforms, transforms):
+            if not isinstance(values, Parameter):
+                values.append(value)
+
+        if type(lights) == tuple:
+            lights = [lights]
+
+        for light in lights:
+            if len(light) <= 3:
+                self._light_tickers.append(self._num_tickers)
+                self._lights.append(tuple(light) + (-1,) * (3 - len(light)) + (len(light),))
+
+        self._num_tickers += 1
+
+    def finalize(self):
+        """
+        Converts the accumulated tickers to arrays.  Call once all tickers have been added.
+        """
+        self._transforms = [(kind, values if isinstance(values, Parameter) else np.asarray(values, dtype=np.float64))
+                            for kind, values in self._transforms]
+        self._light_tickers = np.asarray(self._light_tickers, dtype=np.int_)
+        lights = np.asarray(self._lights, dtype=np.int_).reshape(-1, 4)
+        self._strands, self._addresses, self._pixels = lights.T[0], lights.T[1], lights.T[2]
+        self._opcodes = np.asarray(LIGHT_OPCODES, dtype=np.int_)[lights.T[3]]
+
+    def emit(self, commands, elapsed_time):
+        """
+        Evaluates every ticker in the group and appends the resulting commands
+        """
+        if len(self._light_tickers) == 0:
+            return
+
+        times = np.repeat(float(elapsed_time), self._num_tickers)
+        for kind, value in self._transforms:
+            if isinstance(value, Parameter):
+                value = value.get()
+            if kind == 'speed':
+                times *= value
+            else:
+                times += value
+
+        steps = self._colorfade._steps
+        progress = np.mod(times * steps, steps)
+        indices = np.clip(progress.astype(np.int_), 0, steps)
+        colors = self._colorfade.color_cache[indices[self._light_tickers]]
+
+        commands.extend(self._opcodes, self._strands, self._addresses, self._pixels,
+                        colors, self._priority)
+
+
+def compile_tickers(tickers):
+    """
+    Given a priority-sorted list of (ticker, priority) tuples, returns an equivalent list
+    in which each run of compatible fade tickers (see FadeGroup) is replaced by a single
+    FadeGroup.  Other tickers are passed through unchanged, in order.
+    """
+    plan = []
+    group = None
+    for ticker, priority in tickers:
+        unwrapped = _unwrap_fade(ticker)
+        if unwrapped is None:
+            group = None
+            plan.append((ticker, priority))
+            continue
+
+        transforms, lights, colorfade = unwrapped
+        if group is None or group.key != FadeGroup.make_key(colorfade, transforms, priority):
+            group = FadeGroup(colorfade, transforms, priority)
+            plan.append(group)
+        group.add(transforms, lights)
+
+    for step in plan:
+        if isinstance(step, FadeGroup):
+            step.finalize()
+
+    return plan
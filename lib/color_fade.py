@@ -1,11 +1,35 @@
 import unittest
 import colorsys
 import numpy as np
+from collections import OrderedDict
 
 from lib.colors import clip
 
 class ColorFade:
-    """Represents the fade of one color to another"""
+    """
+    Represents the fade of one color to another.
+
+    Fades are immutable lookup tables, so presets should create them with ColorFade.get(),
+    which returns a shared instance for keyframes and steps that were used recently
+    instead of building a new table.
+    """
+
+    _cache = OrderedDict()
+    _cache_size = 64
+
+    @classmethod
+    def get(cls, keyframes, steps):
+        """
+        Returns a (possibly shared) ColorFade for the given keyframes and steps
+        """
+        key = (tuple(tuple(float(c) for c in frame) for frame in keyframes), int(steps))
+        fade = cls._cache.pop(key, None)
+        if fade is None:
+            fade = cls(keyframes, steps)
+            if len(cls._cache) >= cls._cache_size:
+                cls._cache.popitem(last=False)
+        cls._cache[key] = fade
+        return fade
 
     def __init__(self, keyframes, steps):
         """
@@ -14,28 +38,17 @@ class ColorFade:
 
         self._steps = steps
         self.keyframes = keyframes
-        self.color_cache = np.zeros((steps + 1, 3), dtype=np.float32)
-
-        # Warmup the cache
-        for i in xrange(steps + 1):
-            overall_progress = float(i) * (len(self.keyframes) - 1) / self._steps
-            stage = int(overall_progress)
-            stage_progress = overall_progress - stage # 0 to 1 float
 
-            # special case stage_progress=0, so if progress=1, we don't get
-            # an IndexError
-            if stage_progress == 0:
-                color = self.keyframes[stage]
-            else:
-                frame1 = self.keyframes[stage]
-                frame1_weight = 1 - stage_progress
+        # Each step's position along the keyframes, from 0 to len(keyframes) - 1
+        frames = np.asarray(keyframes, dtype=np.float64).reshape(-1, 3)
+        stops = np.arange(len(frames))
+        positions = np.arange(steps + 1) * (len(frames) - 1) / float(max(steps, 1))
 
-                frame2 = self.keyframes[stage + 1]
-                frame2_weight = stage_progress
-
-                color = tuple([c1 * frame1_weight + c2 * frame2_weight for c1, c2 in zip(frame1, frame2)])
-            self.color_cache[i] = color
-#            print progress, self.color_cache[progress]
+        self.color_cache = np.empty((steps + 1, 3), dtype=np.float32)
+        for channel in xrange(3):
+            self.color_cache[:, channel] = np.interp(positions, stops, frames[:, channel])
+        # Fades are shared, so the table must not be changed
+        self.color_cache.flags.writeable = False
 
     def get_color(self, progress):
         """
@@ -47,9 +60,20 @@ class ColorFade:
 
         return self.color_cache[progress]
 
+    def get_colors(self, progress_array):
+        """
+        Vectorized get_color: returns an (n, 3) array of colors for an array of progress values
+        """
+        progress = np.clip(np.asarray(progress_array).astype(np.int_), 0, self._steps)
+
+        return np.take(self.color_cache, progress, axis=0)
+
     def get_color_wrapped(self, progress):
         progress = progress % self._steps
         return self.get_color(progress)
 
+    def get_colors_wrapped(self, progress_array):
+        return self.get_colors(np.mod(progress_array, self._steps))
+
 
-Rainbow = ColorFade([(0, 0.5, 1), (1, 0.5, 1)], 256)
+Rainbow = ColorFade.get([(0, 0.5, 1), (1, 0.5, 1)], 256)
@@ -1,4 +1,5 @@
 import colorsys
+import threading
 import numpy as np
 
 def float_to_uint8(float_color):
@@ -23,12 +24,12 @@ def clip(low, input, high):
     return min(max(input, low), high)
 
 
-def blend_to_buffer(source, destination, progress, mode):
-    h1,l1,s1 = source.T
-    h2,l2,s2 = destination.T
-
+def blend_to_buffer(source, destination, progress, mode, color_space='HLS'):
     if mode == 'overwrite':
-        not_dark = l1 > 0.0
+        if color_space == 'RGB':
+            not_dark = source.max(1) > 0.0
+        else:
+            not_dark = source.T[1] > 0.0
         destination[not_dark] = source[not_dark]
     else:
         raise NotImplementedError
@@ -94,119 +95,189 @@ def hls_blend(start, end, output_buffer, progress, mode, fade_length=1.0, ease_p
 
     return frame
 
-def rgb_to_hls(arr):
-    """ fast rgb_to_hls using numpy array """
-
-    # adapted from Arnar Flatberg
-    # http://www.mail-archive.com/numpy-discussion@scipy.org/msg06147.html
-
-    arr = arr.astype("float32") / 255.0
-    out = np.empty_like(arr)
-
-    arr_max = arr.max(-1)
-    delta = arr.ptp(-1)
-    arr_min = arr.min(-1)
-    total = arr_max + arr_min
+# Per-thread scratch arrays for the conversion kernels, grown as needed and sliced to
+# the length of each call, so converting a frame does not allocate
+_scratch = threading.local()
 
-    l = total / 2.0
 
-    s = delta / total
-    idx = (l > 0.5)
-    s[idx] = delta[idx] / (2.0 - total[idx])
-
-    # red is max
-    idx = (arr[:,:,0] == arr_max)
-    out[idx, 0] = (arr[idx, 1] - arr[idx, 2]) / delta[idx]
-
-    # green is max
-    idx = (arr[:,:,1] == arr_max)
-    out[idx, 0] = 2. + (arr[idx, 2] - arr[idx, 0] ) / delta[idx]
+def _scratch_vectors(n):
+    """
+    Returns five float32 scratch vectors of length n
+    """
+    vectors = getattr(_scratch, 'vectors', None)
+    if vectors is None or vectors.shape[1] < n:
+        vectors = np.empty((5, n), dtype=np.float32)
+        _scratch.vectors = vectors
+    return vectors[:, :n]
 
-    # blue is max
-    idx = (arr[:,:,2] == arr_max)
-    out[idx, 0] = 4. + (arr[idx, 0] - arr[idx, 1] ) / delta[idx]
 
-    out[:,:,0] = (out[:,:,0]/6.0) % 1.0
-    out[:,:,1] = l
-    out[:,:,2] = s
+def _scratch_rgb(n):
+    """
+    Returns an (n, 3) float32 scratch array
+    """
+    rgb = getattr(_scratch, 'rgb', None)
+    if rgb is None or len(rgb) < n:
+        rgb = np.empty((n, 3), dtype=np.float32)
+        _scratch.rgb = rgb
+    return rgb[:n]
 
-    idx = (delta==0)
-    out[idx, 2] = 0.0
-    out[idx, 0] = 0.0
 
-    # remove NaN
-    out[np.isnan(out)] = 0
+def _scratch_channels(n):
+    """
+    Returns an integer scratch vector of length n
+    """
+    channels = getattr(_scratch, 'channels', None)
+    if channels is None or len(channels) < n:
+        channels = np.empty(n, dtype=np.intp)
+        _scratch.channels = channels
+    return channels[:n]
 
-    return out
 
-def hls_to_rgb(hls):
+def rgb_to_hls(arr, out=None, scale=255.0):
+    """
+    Converts an array of RGB colors in [0..scale] (of any shape, with the color channels on
+    the last axis) to HLS, as float32.  Writes to out (a float32 array of the same shape,
+    which may be arr itself) if it is given, and returns it.
+
+    The hue comes from the channel holding the maximum: it is 2c + (next - previous) / delta
+    sixths of a turn, where c is that channel and next and previous are the channels after
+    and before it (cyclically).  All three candidates are computed and the right one chosen
+    per color, so that only scratch buffers are needed.
     """
-    Converts HLS color array [[H,L,S]] to RGB array.
+    shape = np.shape(arr)
+    n = int(np.prod(shape[:-1]))
+    rgb = _scratch_rgb(n).reshape(shape)
+    np.multiply(arr, 1.0 / scale, out=rgb)
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    h, l, s = out[..., 0], out[..., 1], out[..., 2]
+    red, green, blue = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    a, b, c, delta, divisor = [v.reshape(shape[:-1]) for v in _scratch_vectors(n)]
+    channel = _scratch_channels(n).reshape(shape[:-1])
+
+    rgb.max(-1, out=a)
+    rgb.min(-1, out=b)
+    np.subtract(a, b, out=delta)
+    np.add(a, b, out=divisor)
+    np.multiply(divisor, 0.5, out=l)
+
+    # Grays have no saturation or hue; their delta is zero, so any nonzero divisor will do
+    np.subtract(2.0, divisor, out=a)
+    np.minimum(divisor, a, out=divisor)
+    np.maximum(divisor, 1e-12, out=divisor)
+    np.divide(delta, divisor, out=s)
+
+    rgb.argmax(-1, out=channel)
+    np.maximum(delta, 1e-12, out=delta)
+    np.subtract(green, blue, out=a)
+    a /= delta
+    np.subtract(blue, red, out=b)
+    b /= delta
+    b += 2.0
+    np.subtract(red, green, out=c)
+    c /= delta
+    c += 4.0
+    np.choose(channel, (a, b, c), out=h)
+    h /= 6.0
+    np.mod(h, 1.0, out=h)
 
-    http://en.wikipedia.org/wiki/HSL_and_HSV#From_HSL
+    return out
 
-    Returns [[R,G,B]] in [0..1]
 
-    Adapted from: http://stackoverflow.com/questions/4890373/detecting-thresholds-in-hsv-color-space-from-rgb-using-python-pil/4890878#4890878
+def hls_to_rgb(hls, out=None):
     """
+    Converts an (n, 3) array of HLS colors to RGB in [0..1], as float32.  Hues are taken
+    modulo 1.  Writes to out (an (n, 3) float32 array, which may be hls itself) if it is
+    given, and returns it.
 
-    H = hls[:, 0]
-    L = hls[:, 1]
-    S = hls[:, 2]
+    Rather than sorting pixels by hue sector, every channel is computed with the same
+    arithmetic (http://en.wikipedia.org/wiki/HSL_and_HSV#HSL_to_RGB_alternative):
 
-    C = (1 - np.absolute(2 * L - 1)) * S
+        f(n) = L - a * max(-1, min(k - 3, 9 - k, 1))
+        k = (n + 12 H) mod 12,  a = S min(L, 1 - L)
 
-    Hp = H * 6.0
-    i = Hp.astype(np.int)
-    #f = Hp - i  # |H' mod 2|  ?
-
-    X = C * (1 - np.absolute(np.mod(Hp, 2) - 1))
-    #X = C * (1 - f)
-
-    # initialize with zero
-    R = np.zeros(H.shape, float)
-    G = np.zeros(H.shape, float)
-    B = np.zeros(H.shape, float)
+    with n = 0, 8 and 4 for red, green and blue.  min(k - 3, 9 - k) is 3 - |k - 6|, and
+    with 12 H already reduced mod 12, k is only ever wrapped once, so the kernel uses
+    3 - min(|k - 6|, |k - 18|) instead of a second mod per channel.
+    """
+    n = len(hls)
+    if out is None:
+        out = np.empty((n, 3), dtype=np.float32)
+    a, h, k, t, lightness = _scratch_vectors(n)
+
+    # Everything read from hls is copied out before the first channel is written, so that
+    # out can be hls
+    np.copyto(lightness, hls[:, 1])
+    np.subtract(1.0, lightness, out=a)
+    np.minimum(a, lightness, out=a)
+    a *= hls[:, 2]
+    np.multiply(hls[:, 0], 12.0, out=h)
+    np.mod(h, 12.0, out=h)
+
+    for channel, offset in enumerate((0.0, 8.0, 4.0)):
+        np.add(h, offset - 6.0, out=k)
+        np.absolute(k, out=t)
+        k -= 12.0
+        np.absolute(k, out=k)
+        np.minimum(k, t, out=t)
+        np.subtract(3.0, t, out=t)
+        np.minimum(t, 1.0, out=t)
+        np.maximum(t, -1.0, out=t)
+        t *= a
+        np.subtract(lightness, t, out=out[:, channel])
 
-    # handle each case:
+    return out
 
-    #mask = (Hp >= 0) == ( Hp < 1)
-    mask = i % 6 == 0
-    R[mask] = C[mask]
-    G[mask] = X[mask]
 
-    #mask = (Hp >= 1) == ( Hp < 2)
-    mask = i == 1
-    R[mask] = X[mask]
-    G[mask] = C[mask]
+def hls_to_rgb8(hls, out=None):
+    """
+    Converts an (n, 3) array of HLS colors to 8-bit RGB (see hls_to_rgb).  Channels are
+    scaled by 255 and truncated.  Writes to out (an (n, 3) uint8 array) if it is given,
+    and returns it.
+    """
+    n = len(hls)
+    if out is None:
+        out = np.empty((n, 3), dtype=np.uint8)
+    rgb = hls_to_rgb(hls, _scratch_rgb(n))
+    rgb *= 255.0
+    np.clip(rgb, 0.0, 255.0, out=rgb)
+    np.copyto(out, rgb, casting='unsafe')
+    return out
 
-    #mask = (Hp >= 2) == ( Hp < 3)
-    mask = i == 2
-    G[mask] = C[mask]
-    B[mask] = X[mask]
 
-    #mask = (Hp >= 3) == ( Hp < 4)
-    mask = i == 3
-    G[mask] = X[mask]
-    B[mask] = C[mask]
+def rgb_to_rgb8(rgb, out=None):
+    """
+    Converts an (n, 3) array of RGB colors in [0..1] to 8-bit RGB, the same way as
+    hls_to_rgb8.  Writes to out (an (n, 3) uint8 array) if it is given, and returns it.
+    """
+    n = len(rgb)
+    if out is None:
+        out = np.empty((n, 3), dtype=np.uint8)
+    scaled = _scratch_rgb(n)
+    np.multiply(rgb, 255.0, out=scaled)
+    np.clip(scaled, 0.0, 255.0, out=scaled)
+    np.copyto(out, scaled, casting='unsafe')
+    return out
 
-    #mask = (Hp >= 4) == ( Hp < 5)
-    mask = i == 4
-    R[mask] = X[mask]
-    B[mask] = C[mask]
 
-    #mask = (Hp >= 5) == ( Hp < 6)
-    mask = i == 5
-    R[mask] = C[mask]
-    B[mask] = X[mask]
+def to_rgb8(buffer, color_space, out=None):
+    """
+    Converts a pixel buffer in color_space ('HLS' or 'RGB') to 8-bit RGB
+    """
+    if color_space == 'RGB':
+        return rgb_to_rgb8(buffer, out)
+    return hls_to_rgb8(buffer, out)
 
-    m = L - 0.5*C
-    R += m
-    G += m
-    B += m
 
-    rgb = np.empty_like(hls)
-    rgb[:, 0] = R
-    rgb[:, 1] = G
-    rgb[:, 2] = B
-    return rgb
+def convert_color_space(buffer, color_space, target, out=None):
+    """
+    Returns a pixel buffer in color_space ('HLS' for HLS colors, 'RGB' for RGB colors in
+    [0..1]) converted to the target color space.  The buffer itself is returned when it is
+    already in the target color space; otherwise the result is written to out if it is
+    given.
+    """
+    if color_space == target:
+        return buffer
+    if target == 'RGB':
+        return hls_to_rgb(buffer, out)
+    return rgb_to_hls(buffer, out, 1.0)
@@ -3,13 +3,31 @@ import numpy as np
 import logging
 
 from lib.buffer_utils import BufferUtils
+from lib.colors import hls_to_rgb8
 
 log = logging.getLogger('firemix.lib.command')
 
+# Command bytes, also used as opcodes by the array-based renderer
+OPCODE_NONE = 0x00
+OPCODE_SET_ALL = 0x21
+OPCODE_SET_STRAND = 0x22
+OPCODE_SET_FIXTURE = 0x23
+OPCODE_SET_PIXEL = 0x24
+
+# Which of the (command, 0x00, length, strand, address, pixel, c0, c1, c2) bytes
+# are present in the packed form of each command, indexed by opcode - OPCODE_SET_ALL
+_PACKED_FIELDS = np.array([[1, 1, 1, 0, 0, 0, 1, 1, 1],
+                           [1, 1, 1, 1, 0, 0, 1, 1, 1],
+                           [1, 1, 1, 1, 1, 0, 1, 1, 1],
+                           [1, 1, 1, 1, 1, 1, 1, 1, 1]], dtype=bool)
+
+
 class Command:
     """
     Base class for all commands
     """
+    opcode = OPCODE_NONE
+
     def __init__(self):
         self._color = (0, 0, 0)
         self._priority = 0
@@ -58,6 +76,7 @@ class SetAll(Command):
     """
     Sets all pixels to the same color
     """
+    opcode = OPCODE_SET_ALL
 
     def __init__(self, color, priority):
         Command.__init__(self)
@@ -83,6 +102,7 @@ class SetStrand(Command):
     """
     Sets all pixels in a strand to the same color
     """
+    opcode = OPCODE_SET_STRAND
 
     def __init__(self, strand, color, priority):
         Command.__init__(self)
@@ -109,6 +129,7 @@ class SetFixture(Command):
     """
     Sets all pixels in a fixture to the same color
     """
+    opcode = OPCODE_SET_FIXTURE
 
     def __init__(self, strand, address, color, priority):
         Command.__init__(self)
@@ -137,6 +158,7 @@ class SetPixel(Command):
     """
     Sets all pixels in a fixture to the same color
     """
+    opcode = OPCODE_SET_PIXEL
 
     def __init__(self, strand, address, pixel, color, priority):
         Command.__init__(self)
@@ -163,6 +185,160 @@ class SetPixel(Command):
         return (self._strand, self._address, self._pixel, self._color)
 
 
+class CommandBuffer:
+    """
+    Preallocated, growable storage for a preset's commands.
+
+    Commands are stored as parallel arrays (opcode, strand, address, pixel, priority and color)
+    rather than as Command objects, so that clearing the buffer each tick only resets a length
+    counter and nothing is left for the garbage collector.
+    """
+
+    def __init__(self, capacity=64):
+        self._length = 0
+        self._opcodes = np.zeros(capacity, dtype=np.int_)
+        self._strands = np.zeros(capacity, dtype=np.int_)
+        self._addresses = np.zeros(capacity, dtype=np.int_)
+        self._pixels = np.zeros(capacity, dtype=np.int_)
+        self._priorities = np.zeros(capacity, dtype=np.int_)
+        self._colors = np.zeros((capacity, 3), dtype=np.float32)
+
+    def __len__(self):
+        return self._length
+
+    def _reserve(self, count):
+        """
+        Grows the arrays (by doubling) so that count more commands will fit
+        """
+        required = self._length + count
+        capacity = len(self._opcodes)
+        if required <= capacity:
+            return
+
+        while capacity < required:
+            capacity *= 2
+
+        for name in ('_opcodes', '_strands', '_addresses', '_pixels', '_priorities', '_colors'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._length] = old[:self._length]
+            setattr(self, name, new)
+
+    def clear(self):
+        self._length = 0
+
+    def append(self, opcode, strand, address, pixel, color, priority):
+        """
+        Appends a single command
+        """
+        self._reserve(1)
+        i = self._length
+        self._opcodes[i] = opcode
+        self._strands[i] = strand
+        self._addresses[i] = address
+        self._pixels[i] = pixel
+        self._priorities[i] = priority
+        self._colors[i] = color
+        self._length += 1
+
+    def extend(self, opcodes, strands, addresses, pixels, colors, priorities):
+        """
+        Appends a batch of commands.  Each argument is an array with one entry per command,
+        or a scalar (a single color for colors) that is shared by the whole batch.
+        """
+        count = len(opcodes) if np.ndim(opcodes) > 0 else len(strands)
+        self._reserve(count)
+        start, end = self._length, self._length + count
+        self._opcodes[start:end] = opcodes
+        self._strands[start:end] = strands
+        self._addresses[start:end] = addresses
+        self._pixels[start:end] = pixels
+        self._priorities[start:end] = priorities
+        self._colors[start:end] = colors
+        self._length = end
+
+    def add_command(self, command):
+        """
+        Appends a Command object
+        """
+        self.append(command.opcode, command._strand, command._address, command._pixel,
+                    command.get_color(), command._priority)
+
+    def get_arrays(self):
+        """
+        Returns views of the (opcodes, strands, addresses, pixels, priorities, colors) arrays
+        """
+        n = self._length
+        return (self._opcodes[:n], self._strands[:n], self._addresses[:n],
+                self._pixels[:n], self._priorities[:n], self._colors[:n])
+
+    def get_commands(self):
+        """
+        Returns the buffer contents as a list of Command objects
+        """
+        commands = []
+        for i in xrange(self._length):
+            opcode = self._opcodes[i]
+            color = tuple(self._colors[i])
+            priority = self._priorities[i]
+            if opcode == OPCODE_SET_ALL:
+                commands.append(SetAll(color, priority))
+            elif opcode == OPCODE_SET_STRAND:
+                commands.append(SetStrand(self._strands[i], color, priority))
+            elif opcode == OPCODE_SET_FIXTURE:
+                commands.append(SetFixture(self._strands[i], self._addresses[i], color, priority))
+            elif opcode == OPCODE_SET_PIXEL:
+                commands.append(SetPixel(self._strands[i], self._addresses[i], self._pixels[i],
+                                         color, priority))
+        return commands
+
+    def pack(self):
+        """
+        Returns a list of serialized commands, as Command.pack() would
+        """
+        return [command.pack() for command in self.get_commands()]
+
+    def pack_stream(self, swap_order=False):
+        """
+        Serializes the buffered commands for the command-stream output mode.
+
+        Commands are put in render order with occluded commands culled, and colors are
+        converted from HLS to 8-bit RGB (BGR if swap_order is True).  Returns a tuple of
+        (data, lengths): a uint8 array holding the packed commands back to back, in the same
+        byte layout as Command.pack(), and an array with the packed length of each command.
+        """
+        opcodes, strands, addresses, pixels, priorities, colors = self.get_arrays()
+        order = np.argsort(priorities, kind='mergesort')
+        if BufferUtils.get_strand_offsets() is not None:
+            order = order[cull_occluded_commands(opcodes[order], strands[order],
+                                                 addresses[order], pixels[order])]
+        opcodes = opcodes[order]
+
+        rgb = hls_to_rgb8(colors[order])
+        if swap_order:
+            rgb = rgb[:, ::-1]
+
+        fields = _PACKED_FIELDS[opcodes - OPCODE_SET_ALL]
+        records = np.zeros((len(order), 9), dtype=np.uint8)
+        records[:, 0] = opcodes
+        records[:, 2] = fields.sum(axis=1) - 3
+        records[:, 3] = strands[order]
+        records[:, 4] = addresses[order]
+        records[:, 5] = pixels[order]
+        records[:, 6:] = rgb
+
+        return (records[fields], fields.sum(axis=1))
+
+    def render(self, buffer):
+        """
+        Renders the buffered commands to the output buffer (see render_command_list).
+        Returns the number of occluded commands that were culled.
+        """
+        if self._length == 0:
+            return 0
+        return render_command_arrays(*(self.get_arrays() + (buffer,)))
+
+
 def commands_overlap(first, second):
     """
     Returns True if the two given commands overlap in their output targets (regardless of color)
@@ -205,39 +381,253 @@ def blend_commands(first, second, amount):
 def render_command_list(scene, list, buffer):
     """
     Renders the output of a command list to the output buffer.
-    Commands are rendered in FIFO overlap style.  Run the list through
-    filter_and_sort_commands() beforehand.
-    If the output buffer is not zero (black) at a command's target,
-    the output will be additively blended according to the blend_state
-    (0.0 = 100% original, 1.0 = 100% new)
-    """
-
-    for command in list:
-        color = command.get_color()
-        if isinstance(command, SetAll):
-            buffer[:,:] = color
-
-        elif isinstance(command, SetStrand):
-            strand = command.get_strand()
-            start, end = BufferUtils.get_strand_extents(strand)
-            buffer[start:end] = color
-
-        elif isinstance(command, SetFixture):
-            strand = command.get_strand()
-            address = command.get_address()
-            fixture = scene.fixture(strand, address)
-
-            if fixture is None:
-                log.error("SetFixture command setting invalid fixture: %s", (strand,address))
-                continue
-
-            start = BufferUtils.logical_to_index((strand, address, 0))
-            end = start + fixture.pixels
-            buffer[start:end] = color
-
-        elif isinstance(command, SetPixel):
-            strand = command.get_strand()
-            address = command.get_address()
-            offset = command.get_pixel()
-            pixel = BufferUtils.logical_to_index((strand, address, offset))
-            buffer[pixel] = color
+    Commands are rendered in priority order; commands with equal priority are
+    rendered in FIFO overlap style, so later commands overwrite earlier ones.
+    Returns the number of occluded commands that were culled.
+    """
+    if len(list) == 0:
+        return 0
+
+    count = len(list)
+    opcodes = np.fromiter((command.opcode for command in list), dtype=np.int_, count=count)
+    strands = np.fromiter((command._strand for command in list), dtype=np.int_, count=count)
+    addresses = np.fromiter((command._address for command in list), dtype=np.int_, count=count)
+    pixels = np.fromiter((command._pixel for command in list), dtype=np.int_, count=count)
+    priorities = np.fromiter((command._priority for command in list), dtype=np.int_, count=count)
+    colors = np.asarray([command.get_color() for command in list], dtype=np.float32)
+
+    return render_command_arrays(opcodes, strands, addresses, pixels, priorities, colors, buffer)
+
+
+def cull_occluded_commands(opcodes, strands, addresses, pixels):
+    """
+    Given commands as parallel arrays in render order, returns a boolean mask of the commands
+    that are still visible.  A command is culled when a later command fully covers its target
+    (for example, everything before a SetAll, or a SetPixel on a fixture that a later
+    SetFixture overwrites), since rendering it would only be overwritten.
+    """
+    count = len(opcodes)
+    positions = np.arange(count)
+    covered_until = np.repeat(-1, count)
+
+    is_all = (opcodes == OPCODE_SET_ALL)
+    if is_all.any():
+        covered_until[:] = positions[is_all][-1]
+
+    fixture_offsets, fixture_pixel_counts = BufferUtils.get_fixture_offsets()
+    num_strands, num_fixtures = fixture_offsets.shape
+    valid_strand = (strands >= 0) & (strands < num_strands)
+    valid_fixture = valid_strand & (addresses >= 0) & (addresses < num_fixtures)
+
+    # Latest SetStrand on each strand covers every command on that strand
+    is_strand = (opcodes == OPCODE_SET_STRAND) & valid_strand
+    if is_strand.any():
+        last_strand = np.repeat(-1, num_strands)
+        np.maximum.at(last_strand, strands[is_strand], positions[is_strand])
+        has_strand = (opcodes != OPCODE_SET_ALL) & valid_strand
+        covered_until[has_strand] = np.maximum(covered_until[has_strand], last_strand[strands[has_strand]])
+
+    # Latest SetFixture on each fixture covers SetFixture and SetPixel commands on that fixture
+    is_fixture = (opcodes == OPCODE_SET_FIXTURE) & valid_fixture
+    if is_fixture.any():
+        fixture_ids = strands * num_fixtures + addresses
+        last_fixture = np.repeat(-1, num_strands * num_fixtures)
+        np.maximum.at(last_fixture, fixture_ids[is_fixture], positions[is_fixture])
+        has_fixture = ((opcodes == OPCODE_SET_FIXTURE) | (opcodes == OPCODE_SET_PIXEL)) & valid_fixture
+        covered_until[has_fixture] = np.maximum(covered_until[has_fixture], last_fixture[fixture_ids[has_fixture]])
+
+    visible = covered_until <= positions
+
+    # Only the last SetPixel on each pixel is visible.  Offsets outside the fixture are
+    # dropped when rendering, so they must not hide the pixel they would alias.
+    is_pixel = (opcodes == OPCODE_SET_PIXEL) & valid_fixture
+    is_pixel[is_pixel] = ((pixels[is_pixel] >= 0) &
+                          (pixels[is_pixel] < fixture_pixel_counts[strands[is_pixel], addresses[is_pixel]]))
+    if is_pixel.any():
+        pixel_positions = positions[is_pixel][::-1]
+        pixel_ids = (fixture_offsets[strands[is_pixel], addresses[is_pixel]] + pixels[is_pixel])[::-1]
+        _, last_write = np.unique(pixel_ids, return_index=True)
+        overwritten = np.ones(len(pixel_ids), dtype=bool)
+        overwritten[last_write] = False
+        visible[pixel_positions[overwritten]] = False
+
+    return visible
+
+
+def render_command_arrays(opcodes, strands, addresses, pixels, priorities, colors, buffer):
+    """
+    Renders commands given as parallel arrays (one entry per command) to the output buffer.
+
+    The commands are stably sorted by priority and occluded commands are culled (see
+    cull_occluded_commands).  A remaining SetAll fills the buffer, and the other commands
+    are expanded into pixel index ranges using the BufferUtils offset tables and written
+    with a single fancy-index assignment.
+
+    Returns the number of commands that were culled.
+    """
+    order = np.argsort(priorities, kind='mergesort')
+    visible = cull_occluded_commands(opcodes[order], strands[order], addresses[order], pixels[order])
+    culled = len(order) - np.count_nonzero(visible)
+    order = order[visible]
+
+    if len(order) > 0 and opcodes[order[0]] == OPCODE_SET_ALL:
+        buffer[:] = colors[order[0]]
+        order = order[1:]
+
+    if len(order) == 0:
+        return culled
+
+    opcodes = opcodes[order]
+    strands = strands[order]
+    addresses = addresses[order]
+    pixels = pixels[order]
+    colors = colors[order]
+
+    strand_offsets = BufferUtils.get_strand_offsets()
+    fixture_offsets, fixture_pixel_counts = BufferUtils.get_fixture_offsets()
+    num_strands, num_fixtures = fixture_offsets.shape
+
+    starts = np.zeros(len(order), dtype=np.int_)
+    lengths = np.zeros(len(order), dtype=np.int_)
+
+    is_strand = (opcodes == OPCODE_SET_STRAND) & (strands >= 0) & (strands < num_strands)
+    starts[is_strand] = strand_offsets[strands[is_strand]]
+    lengths[is_strand] = strand_offsets[strands[is_strand] + 1] - starts[is_strand]
+
+    is_fixture = (opcodes == OPCODE_SET_FIXTURE) | (opcodes == OPCODE_SET_PIXEL)
+    in_range = is_fixture & (strands >= 0) & (strands < num_strands) & (addresses >= 0) & (addresses < num_fixtures)
+    fixture_strands = strands[in_range]
+    fixture_addresses = addresses[in_range]
+    starts[in_range] = fixture_offsets[fixture_strands, fixture_addresses]
+    lengths[in_range] = fixture_pixel_counts[fixture_strands, fixture_addresses]
+
+    invalid = is_fixture & (lengths == 0)
+    if invalid.any():
+        for strand, address in zip(strands[invalid], addresses[invalid]):
+            log.error("Command setting invalid fixture: %s", (strand, address))
+
+    is_pixel = (opcodes == OPCODE_SET_PIXEL) & (lengths > 0)
+    invalid = is_pixel & ((pixels < 0) | (pixels >= lengths))
+    if invalid.any():
+        for strand, address, pixel in zip(strands[invalid], addresses[invalid], pixels[invalid]):
+            log.error("Command setting invalid pixel: %s", (strand, address, pixel))
+        lengths[invalid] = 0
+        is_pixel &= ~invalid
+
+    starts[is_pixel] += pixels[is_pixel]
+    lengths[is_pixel] = 1
+
+    total = lengths.sum()
+    if total == 0:
+        return culled
+
+    # Expand each (start, length) range into buffer indices
+    range_starts = np.cumsum(lengths) - lengths
+    indices = np.repeat(starts - range_starts, lengths) + np.arange(total)
+    pixel_colors = np.repeat(colors, lengths, axis=0)
+
+    # Later commands win, so keep only the last write to each pixel
+    indices = indices[::-1]
+    indices, last_write = np.unique(indices, return_index=True)
+    buffer[indices] = pixel_colors[::-1][last_write]
+
+    return culled
+
+
+class TestRenderCommands(unittest.TestCase):
+    """
+    Checks the array renderer against rendering commands one at a time, as
+    render_command_list did before it was vectorized
+    """
+
+    class _App:
+        class args:
+            scene = "demo"
+
+    @classmethod
+    def setUpClass(cls):
+        from lib.scene import Scene
+        cls.scene = Scene(cls._App())
+        BufferUtils.init(cls.scene)
+
+    def render_one_by_one(self, commands):
+        buffer = BufferUtils.create_buffer()
+        num_strands = len(BufferUtils.get_strand_offsets()) - 1
+        for command in sorted(commands, key=lambda command: command.get_priority()):
+            color = command.get_color()
+            if isinstance(command, SetAll):
+                buffer[:] = color
+            elif isinstance(command, SetStrand):
+                if 0 <= command.get_strand() < num_strands:
+                    start, end = BufferUtils.get_strand_extents(command.get_strand())
+                    buffer[start:end] = color
+            else:
+                fixture = self.scene.fixture(command.get_strand(), command.get_address())
+                if fixture is None:
+                    continue
+                start = BufferUtils.logical_to_index((fixture.strand, fixture.address, 0))
+                if isinstance(command, SetFixture):
+                    buffer[start:start + fixture.pixels] = color
+                elif 0 <= command.get_pixel() < fixture.pixels:
+                    buffer[start + command.get_pixel()] = color
+        return buffer
+
+    def random_commands(self, rng, count):
+        fixtures = self.scene.fixtures()
+        commands = []
+        for i in xrange(count):
+            color = tuple(rng.random_sample(3).tolist())
+            priority = int(rng.randint(0, 3))
+            kind = rng.random_sample()
+            f = fixtures[rng.randint(0, len(fixtures))]
+            if kind < 0.02:
+                commands.append(SetAll(color, priority))
+            elif kind < 0.06:
+                commands.append(SetStrand(f.strand, color, priority))
+            elif kind < 0.2:
+                commands.append(SetFixture(f.strand, f.address, color, priority))
+            else:
+                # Include offsets past the end of the fixture, which must be dropped
+                pixel = int(rng.randint(-1, f.pixels + 3))
+                commands.append(SetPixel(f.strand, f.address, pixel, color, priority))
+        return commands
+
+    def assertRendersLikeOneByOne(self, commands):
+        buffer = BufferUtils.create_buffer()
+        render_command_list(self.scene, commands, buffer)
+        np.testing.assert_array_equal(buffer, self.render_one_by_one(commands))
+
+    def test_random_commands(self):
+        rng = np.random.RandomState(0)
+        for i in xrange(50):
+            self.assertRendersLikeOneByOne(self.random_commands(rng, 200))
+
+    def test_out_of_range_pixels(self):
+        f = self.scene.fixtures()[0]
+        commands = [SetPixel(f.strand, f.address, f.pixels, (0.1, 0.2, 0.3), 0),
+                    SetPixel(f.strand, f.address, -1, (0.4, 0.5, 0.6), 0)]
+        buffer = BufferUtils.create_buffer()
+        render_command_list(self.scene, commands, buffer)
+        self.assertFalse(buffer.any())
+
+        # An out-of-range offset that lands on another fixture's pixel must not cull a
+        # command for that pixel
+        start, end = BufferUtils.get_fixture_extents(f.strand, f.address)
+        strand, address, pixel = BufferUtils.index_to_logical(end)
+        commands = [SetPixel(strand, address, pixel, (0.7, 0.8, 0.9), 0),
+                    SetPixel(f.strand, f.address, f.pixels, (0.1, 0.2, 0.3), 0)]
+        self.assertRendersLikeOneByOne(commands)
+
+    def test_first_set_all(self):
+        fixtures = self.scene.fixtures()
+        f = fixtures[0]
+        commands = [SetFixture(f.strand, f.address, (0.1, 0.1, 0.1), 0),
+                    SetAll((0.2, 0.2, 0.2), 1),
+                    SetPixel(f.strand, f.address, 3, (0.3, 0.3, 0.3), 1),
+                    SetAll((0.4, 0.4, 0.4), 1),
+                    SetStrand(fixtures[1].strand, (0.5, 0.5, 0.5), 2),
+                    SetAll((0.6, 0.6, 0.6), 0)]
+        buffer = BufferUtils.create_buffer()
+        culled = render_command_list(self.scene, commands, buffer)
+        self.assertEqual(culled, 4)
+        np.testing.assert_array_equal(buffer, self.render_one_by_one(commands))
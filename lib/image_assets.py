@@ -0,0 +1,353 @@
+import os
+import hashlib
+import logging
+import threading
+import Queue
+import numpy as np
+
+log = logging.getLogger("firemix.lib.image_assets")
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+
+# Bump this when the cached format changes, so that old cache files are ignored
+CACHE_VERSION = 2
+
+
+class ImageAsset:
+    """
+    An image in RGB (as float32 in [0..1]), as a mip pyramid: levels[0] is the
+    full-resolution image and each following level is half the size of the one before.
+    The levels are filled in by the ImageAssets worker; check ready before sampling.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.levels = []
+        self.width = 0
+        self.height = 0
+        self.error = None
+        self._loaded = threading.Event()
+
+    @property
+    def ready(self):
+        return self._loaded.is_set() and self.error is None
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the asset has been loaded (or has failed to load)
+        """
+        self._loaded.wait(timeout)
+        return self.ready
+
+    def level_for(self, footprint):
+        """
+        Returns the mip level to sample when each output pixel covers footprint texels
+        of the full-resolution image
+        """
+        if footprint <= 1.0:
+            return 0
+        return min(int(np.log2(footprint)), len(self.levels) - 1)
+
+    def level_shape(self, level):
+        return self.levels[level].shape[:2]
+
+    def texels(self, x, y, level=0, edge_mode="clamp"):
+        """
+        Returns the flat indices, into the given mip level, of the texels at the coordinates
+        (x, y) of the full-resolution image.  edge_mode is one of clamp, tile or mirror.
+        """
+        height, width = self.level_shape(level)
+        x = np.int_(x / (1 << level))
+        y = np.int_(y / (1 << level))
+
+        if edge_mode == "tile":
+            np.mod(np.abs(x), width, x)
+            np.mod(np.abs(y), height, y)
+        elif edge_mode == "mirror":
+            np.mod(np.abs(x), width * 2 - 1, x)
+            np.mod(np.abs(y), height * 2 - 1, y)
+            np.abs(x - (width - 1), x)
+            np.abs(y - (height - 1), y)
+        else:
+            if edge_mode != "clamp":
+                log.warn("Unknown image edge mode %s (clamp, tile, or mirror)" % edge_mode)
+            np.clip(x, 0, width - 1, x)
+            np.clip(y, 0, height - 1, y)
+
+        return y * width + x
+
+    def sample(self, x, y, level=0, edge_mode="clamp"):
+        """
+        Returns the RGB colors at the texel coordinates (x, y) of the full-resolution image,
+        read from the given mip level
+        """
+        return self.levels[level].reshape(-1, 3)[self.texels(x, y, level, edge_mode)]
+
+
+class ImageSequence(ImageAsset):
+    """
+    The frames of a directory of images, stored as 8-bit RGB in one uint8 array of shape
+    (frames, height, width, 3) that is memory-mapped from the cache.  There are no
+    mip levels.  A prefetch thread reads ahead of the frame being played, so that upcoming
+    frames are already in the page cache when they are sampled.
+    """
+
+    def __init__(self, path, read_ahead=4):
+        ImageAsset.__init__(self, path)
+        self.frames = None
+        self.num_frames = 0
+        self.read_ahead = read_ahead
+        self._wanted = 0
+        self._prefetch_event = threading.Event()
+
+    def level_for(self, footprint):
+        return 0
+
+    def level_shape(self, level):
+        return self.height, self.width
+
+    def sample_frame(self, index, texels):
+        """
+        Returns the RGB colors (as float32 in [0..1]) of the given flat texel indices (see
+        texels()) in frame index, and starts prefetching the frames after it
+        """
+        index %= self.num_frames
+        self._wanted = index + 1
+        self._prefetch_event.set()
+        return np.multiply(self.frames[index].reshape(-1, 3)[texels], 1.0 / 255.0, dtype=np.float32)
+
+    def sample(self, x, y, level=0, edge_mode="clamp"):
+        return self.sample_frame(0, self.texels(x, y, level, edge_mode))
+
+    def _start_prefetch(self):
+        prefetcher = threading.Thread(target=self._prefetch, name="ImageSequence")
+        prefetcher.daemon = True
+        prefetcher.start()
+
+    def _prefetch(self):
+        # Reading one value from every 4 KB page is enough to bring a frame into memory
+        stride = 4096 / self.frames.itemsize
+        while True:
+            self._prefetch_event.wait()
+            self._prefetch_event.clear()
+            start = self._wanted
+            for i in xrange(start, start + self.read_ahead):
+                self.frames[i % self.num_frames].reshape(-1)[::stride].sum()
+
+
+class ImageAssets:
+    """
+    Loads images for presets on a background thread.
+
+    Images are decoded and reduced to a mip pyramid off the tick thread, and the levels
+    are cached as .npy files under data/cache/images, keyed by a
+    hash of the image file, so each image is only converted once.  Names are looked up
+    as given and then in data/images, with or without an extension.
+
+    Image sequences (directories of frames) are converted once into a single array file
+    in the same cache, keyed by a hash of the frame names, sizes and modification times.
+    """
+
+    _assets = {}
+    _queue = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def image_dir(cls):
+        return os.path.join(os.getcwd(), "data", "images")
+
+    @classmethod
+    def cache_dir(cls):
+        return os.path.join(os.getcwd(), "data", "cache", "images")
+
+    @classmethod
+    def resolve(cls, name):
+        """
+        Returns the absolute path of the named image, or None if it can't be found
+        """
+        candidates = [name, os.path.join(cls.image_dir(), name)]
+        candidates += [c + ext for c in candidates for ext in IMAGE_EXTENSIONS]
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return os.path.abspath(candidate)
+        return None
+
+    @classmethod
+    def get(cls, name):
+        """
+        Returns the ImageAsset for the named image, queueing it for loading if needed.
+        The asset is returned immediately and becomes ready once the worker has loaded it.
+        """
+        return cls._get(cls.resolve(name) or name, ImageAsset, cls._load)
+
+    @classmethod
+    def get_sequence(cls, name):
+        """
+        Returns the ImageSequence for the named directory of frames, queueing it for
+        loading (and conversion, if it is not cached yet) if needed
+        """
+        path = name
+        for candidate in (name, os.path.join(cls.image_dir(), name)):
+            if os.path.isdir(candidate):
+                path = os.path.abspath(candidate)
+                break
+        return cls._get(path, ImageSequence, cls._load_sequence)
+
+    @classmethod
+    def _get(cls, path, asset_class, loader):
+        with cls._lock:
+            asset = cls._assets.get(path, None)
+            if asset is None:
+                asset = asset_class(path)
+                cls._assets[path] = asset
+                cls._start_worker()
+                cls._queue.put((loader, asset))
+        return asset
+
+    @classmethod
+    def _start_worker(cls):
+        if cls._queue is None:
+            cls._queue = Queue.Queue()
+            worker = threading.Thread(target=cls._worker, name="ImageAssets")
+            worker.daemon = True
+            worker.start()
+
+    @classmethod
+    def _worker(cls):
+        while True:
+            loader, asset = cls._queue.get()
+            try:
+                loader(asset)
+            except Exception as e:
+                log.error("Could not load image %s: %s" % (asset.path, e))
+                asset.error = e
+            asset._loaded.set()
+
+    @classmethod
+    def _load(cls, asset):
+        if not os.path.isfile(asset.path):
+            raise IOError("No such image")
+
+        with open(asset.path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        prefix = os.path.join(cls.cache_dir(), "%s-%d" % (digest, CACHE_VERSION))
+
+        levels = cls._load_cached(prefix)
+        if levels is None:
+            levels = cls._build_levels(cls._decode(asset.path))
+            cls._save_cached(prefix, levels)
+            log.info("Converted image %s: %dx%d, %d levels" % (
+                asset.path, levels[0].shape[1], levels[0].shape[0], len(levels)))
+
+        asset.height, asset.width = levels[0].shape[:2]
+        asset.levels = levels
+
+    @classmethod
+    def _load_sequence(cls, sequence):
+        if not os.path.isdir(sequence.path):
+            raise IOError("No such image sequence")
+
+        files = sorted(f for f in os.listdir(sequence.path)
+                       if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+        if not files:
+            raise IOError("No frames found")
+        files = [os.path.join(sequence.path, f) for f in files]
+
+        # Hashing every frame would take as long as converting them
+        digest = hashlib.sha1()
+        for f in files:
+            st = os.stat(f)
+            digest.update("%s:%d:%d;" % (os.path.basename(f), st.st_size, st.st_mtime))
+        path = os.path.join(cls.cache_dir(), "seq-%s-%d.npy" % (digest.hexdigest(), CACHE_VERSION))
+
+        if not os.path.exists(path):
+            cls._convert_sequence(files, path)
+            log.info("Converted image sequence %s: %d frames" % (sequence.path, len(files)))
+
+        sequence.frames = np.load(path, mmap_mode='r')
+        sequence.num_frames, sequence.height, sequence.width = sequence.frames.shape[:3]
+        sequence._start_prefetch()
+
+    @classmethod
+    def _convert_sequence(cls, files, path):
+        if not os.path.exists(cls.cache_dir()):
+            os.makedirs(cls.cache_dir())
+
+        first = cls._decode(files[0])
+        temp_path = path + ".tmp"
+        frames = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.uint8,
+                                           shape=(len(files),) + first.shape)
+        try:
+            frames[0] = first
+            for i in xrange(1, len(files)):
+                frame = cls._decode(files[i])
+                if frame.shape != first.shape:
+                    raise IOError("Frame %s is not the same size as the first" % files[i])
+                frames[i] = frame
+            frames.flush()
+        except:
+            del frames
+            os.remove(temp_path)
+            raise
+        del frames
+        os.rename(temp_path, path)
+
+    @classmethod
+    def _decode(cls, path):
+        """
+        Returns the image at path as an RGB uint8 array of shape (height, width, 3)
+        """
+        # QImage (unlike QPixmap) can be used outside the GUI thread
+        from PySide.QtGui import QImage
+
+        image = QImage(path)
+        if image.isNull():
+            raise IOError("Unsupported image format")
+        image = image.convertToFormat(QImage.Format_RGB32)
+
+        # Rows may be padded; each pixel is stored as B, G, R, A bytes
+        data = np.frombuffer(image.bits(), dtype=np.uint8)
+        data = data.reshape(image.height(), image.bytesPerLine())[:, :image.width() * 4]
+        data = data.reshape(image.height(), image.width(), 4)
+        return np.array(data[:, :, 2::-1])
+
+    @classmethod
+    def _build_levels(cls, rgb):
+        """
+        Returns the mip pyramid of an RGB uint8 image
+        """
+        rgb = np.multiply(rgb, 1.0 / 255.0, dtype=np.float32)
+        levels = [rgb]
+        while max(rgb.shape[:2]) > 1:
+            # Odd sizes repeat their last row or column, so every 2x2 block is complete
+            if rgb.shape[0] % 2:
+                rgb = np.concatenate((rgb, rgb[-1:]), axis=0)
+            if rgb.shape[1] % 2:
+                rgb = np.concatenate((rgb, rgb[:, -1:]), axis=1)
+            rgb = 0.25 * (rgb[0::2, 0::2] + rgb[1::2, 0::2] + rgb[0::2, 1::2] + rgb[1::2, 1::2])
+            levels.append(rgb)
+        return levels
+
+    @classmethod
+    def _load_cached(cls, prefix):
+        if not os.path.exists(prefix + "-0.npy"):
+            return None
+        levels = [np.load(prefix + "-0.npy")]
+        try:
+            while max(levels[-1].shape[:2]) > 1:
+                levels.append(np.load("%s-%d.npy" % (prefix, len(levels))))
+        except IOError:
+            return None
+        return levels
+
+    @classmethod
+    def _save_cached(cls, prefix, levels):
+        if not os.path.exists(cls.cache_dir()):
+            os.makedirs(cls.cache_dir())
+        # Level 0 is written last, so its presence means the whole pyramid is there
+        for i in reversed(xrange(len(levels))):
+            path = "%s-%d.npy" % (prefix, i)
+            temp_path = path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                np.save(f, levels[i])
+            os.rename(temp_path, path)
@@ -1,10 +1,13 @@
 import math
 import random
 import logging
+import numpy as np
 
 from PySide import QtCore
 
 from lib.buffer_utils import BufferUtils
+from lib.colors import convert_color_space
+from lib.profiling import SECTION_TICK, SECTION_DRAW, SECTION_FEATURE, SECTION_TRANSITION
 
 log = logging.getLogger("firemix.lib.layer")
 
@@ -16,12 +19,16 @@ class Layer(QtCore.QObject):
         super(Layer, self).__init__()
         self._app = app
         self._mixer = app.mixer
+        self._profiler = app.mixer.profiler
         self._enable_profiling = self._app.args.profile
         self.name = name
         self._playlist = None
         self._scene = app.scene
         self._main_buffer = None
         self._secondary_buffer = None
+        self._first_hls_buffer = None
+        self._second_hls_buffer = None
+        self.color_space = 'HLS'
         self._in_transition = False
         self._transition = None
         self.transition_progress = 0.0
@@ -31,6 +38,8 @@ class Layer(QtCore.QObject):
         self._transition_slop = self._app.settings.get('mixer')['transition-slop']
         self._elapsed = 0
         self._duration = self._app.settings.get('mixer')['preset-duration']
+        self._following = False
+        self._transition_seed = 0
 
         # Load transitions
         self.set_transition_mode(self._app.settings.get('mixer')['transition'])
@@ -40,6 +49,8 @@ class Layer(QtCore.QObject):
         else:
             self._main_buffer = BufferUtils.create_buffer()
             self._secondary_buffer = BufferUtils.create_buffer()
+            self._first_hls_buffer = BufferUtils.create_buffer()
+            self._second_hls_buffer = BufferUtils.create_buffer()
 
     def save(self):
         self._playlist.save()
@@ -47,6 +58,14 @@ class Layer(QtCore.QObject):
     def reset(self):
         self._main_buffer = BufferUtils.create_buffer()
         self._secondary_buffer = BufferUtils.create_buffer()
+        self._first_hls_buffer = BufferUtils.create_buffer()
+        self._second_hls_buffer = BufferUtils.create_buffer()
+
+    def get_color_space(self):
+        """
+        Returns the color space (see Preset.color_space) of the buffer last returned by draw()
+        """
+        return self.color_space
 
     def set_playlist(self, playlist):
         self._playlist = playlist
@@ -104,6 +123,9 @@ class Layer(QtCore.QObject):
         self._in_transition = True
         self._start_transition = True
         self._elapsed = 0.0
+        self._transition_seed = random.randint(0, 2 ** 31 - 1)
+        if self._app.settings.get('mixer')['transition'] == "Random":
+            self.get_next_transition()
         self.transition_starting.emit()
 
     def cancel_transition(self):
@@ -142,15 +164,33 @@ class Layer(QtCore.QObject):
         self._transition = self._transition_list.pop()(self._app)
         self._transition.setup()
 
+    def get_playing_presets(self):
+        """
+        Returns the presets that this layer draws: the active preset, the next preset while
+        in a transition, and any presets that those draw themselves
+        """
+        presets = [self._playlist.get_active_preset()]
+        if self._in_transition:
+            presets.append(self._playlist.get_next_preset())
+
+        playing = []
+        while presets:
+            preset = presets.pop()
+            if preset is not None and preset not in playing:
+                playing.append(preset)
+                presets.extend(preset.get_sub_presets())
+        return playing
+
     def feature_received(self, feature):
         # Notify active preset of feature.
         active_preset = self._playlist.get_active_preset()
         if active_preset:
-            active_preset.on_feature(feature)
+            self._profiler.run(active_preset, SECTION_FEATURE, active_preset.on_feature, feature)
 
     def draw(self, dt):
         if len(self._playlist) == 0:
             self._main_buffer *= (0.0, 0.0, 0.0)
+            self.color_space = 'HLS'
             return self._main_buffer
 
         self._elapsed += dt
@@ -162,18 +202,19 @@ class Layer(QtCore.QObject):
         next_index = self._playlist.get_next_index()
 
         active_preset.clear_commands()
-        active_preset.tick(dt)
+        self._profiler.run(active_preset, SECTION_TICK, self._mixer.tick_preset, active_preset, dt)
 
         # Handle transition by rendering both the active and the next preset,
         # and blending them together.
         if self._in_transition:
             if self._start_transition:
                 self._start_transition = False
-                if self._app.settings.get('mixer')['transition'] == "Random":
-                    self.get_next_transition()
                 if self._transition:
+                    # Transitions draw their random choices from numpy, so seeding it
+                    # makes followers (see set_sync_state()) choose the same
+                    np.random.seed(self._transition_seed)
                     self._transition.reset()
-                next_preset._reset()
+                next_preset._reset(self._transition_seed)
                 self._secondary_buffer = BufferUtils.create_buffer()
 
             if self._transition_duration > 0.0 and self._transition is not None:
@@ -183,7 +224,7 @@ class Layer(QtCore.QObject):
                 self.transition_progress = 1.0
 
             next_preset.clear_commands()
-            next_preset.tick(dt)
+            self._profiler.run(next_preset, SECTION_TICK, self._mixer.tick_preset, next_preset, dt)
 
             # Exit from transition state after the transition duration has
             # elapsed
@@ -210,13 +251,73 @@ class Layer(QtCore.QObject):
                 first_preset, self._main_buffer,
                 check_for_nan=self._enable_profiling)
 
-        if not self._mixer.is_paused() and (self._elapsed >= self._duration) and active_preset.can_transition() and not self._in_transition:
+        if not self._mixer.is_paused() and (self._elapsed >= self._duration) and active_preset.can_transition() and not self._in_transition and not self._following:
             if (self._elapsed >= (self._duration + self._transition_slop)) or self._mixer._onset:
                 self.start_transition()
                 self._elapsed = 0.0
 
         return mixed_buffer
 
+    def get_sync_state(self):
+        """
+        Returns the playlist position and transition state of the layer, for a Conductor to
+        send to its followers (see lib/node_sync.py)
+        """
+        active_preset = self._playlist.get_active_preset()
+        next_preset = self._playlist.get_next_preset()
+        return {
+            "active": active_preset.get_name() if active_preset is not None else None,
+            "active-seed": active_preset._seed if active_preset is not None else None,
+            "next": next_preset.get_name() if next_preset is not None else None,
+            "transition": str(self._transition) if self._transition is not None else None,
+            "transition-seed": self._transition_seed,
+            "in-transition": self._in_transition,
+            "start-transition": self._start_transition,
+            "progress": self.transition_progress,
+            "elapsed": self._elapsed,
+            "preset-duration": self._duration,
+            "transition-duration": self._transition_duration,
+        }
+
+    def set_sync_state(self, state):
+        """
+        Takes on the state of a conductor's layer (see get_sync_state()).  Once following,
+        the layer no longer starts or picks transitions by itself.
+        """
+        self._following = True
+
+        active_preset = self._playlist.get_active_preset()
+        if state["active"] is not None and (active_preset is None or active_preset.get_name() != state["active"]):
+            self._playlist.set_active_preset_by_name(state["active"])
+        # Presets started by a transition are seeded the same way on both ends, but those
+        # started from the playlist (or before this node joined) have to be started again
+        active_preset = self._playlist.get_active_preset()
+        if state["active-seed"] is not None and active_preset is not None and active_preset._seed != state["active-seed"]:
+            active_preset._reset(state["active-seed"])
+        next_preset = self._playlist.get_next_preset()
+        if state["next"] is not None and (next_preset is None or next_preset.get_name() != state["next"]):
+            self._playlist.set_next_preset_by_name(state["next"])
+
+        # If the frame that started a transition was missed, start it now
+        start_transition = state["start-transition"] or (state["in-transition"] and not self._in_transition)
+
+        transition = str(self._transition) if self._transition is not None else None
+        if transition != state["transition"]:
+            self._transition = self.get_transition_by_name(state["transition"])
+            if self._transition is not None:
+                self._transition.setup()
+                if state["in-transition"] and not start_transition:
+                    np.random.seed(state["transition-seed"])
+                    self._transition.reset()
+
+        self._transition_seed = state["transition-seed"]
+        self._start_transition = start_transition
+        self._in_transition = state["in-transition"]
+        self.transition_progress = state["progress"]
+        self._elapsed = state["elapsed"]
+        self._duration = state["preset-duration"]
+        self._transition_duration = state["transition-duration"]
+
     def render_presets(self, first_preset, first_buffer,
                        second_preset=None, second_buffer=None,
                        in_transition=False, transition=None,
@@ -225,26 +326,43 @@ class Layer(QtCore.QObject):
         Grabs the command output from a preset with the index given by first.
         If a second preset index is given, render_preset will use a Transition class to generate the output
         according to transition_progress (0.0 = 100% first, 1.0 = 100% second)
+
+        The presets are blended in their color space when they share one the transition
+        supports, and in HLS otherwise.  The color space of the result is kept in
+        self.color_space.
         """
-        first_buffer = first_preset.draw_to_buffer(first_buffer)
+        first_buffer = self._profiler.run(first_preset, SECTION_DRAW,
+                                          first_preset.draw_to_buffer, first_buffer)
+        color_space = first_preset.get_color_space()
         if check_for_nan:
             for item in first_buffer.flat:
                 if math.isnan(item):
                     raise ValueError
 
         if second_preset is not None:
-            second_buffer = second_preset.draw_to_buffer(second_buffer)
+            second_buffer = self._profiler.run(second_preset, SECTION_DRAW,
+                                               second_preset.draw_to_buffer, second_buffer)
+            second_color_space = second_preset.get_color_space()
             if check_for_nan:
                 for item in second_buffer.flat:
                     if math.isnan(item):
                         raise ValueError
 
             if in_transition and transition is not None:
-                first_buffer = transition.get(first_buffer, second_buffer,
-                                              transition_progress)
+                if color_space != second_color_space or color_space not in transition.color_spaces:
+                    first_buffer = convert_color_space(first_buffer, color_space, 'HLS',
+                                                       self._first_hls_buffer)
+                    second_buffer = convert_color_space(second_buffer, second_color_space, 'HLS',
+                                                        self._second_hls_buffer)
+                    color_space = 'HLS'
+
+                first_buffer = self._profiler.run(transition, SECTION_TRANSITION,
+                                                  transition.get, first_buffer,
+                                                  second_buffer, transition_progress)
                 if check_for_nan:
                     for item in first_buffer.flat:
                         if math.isnan(item):
                             raise ValueError
 
+        self.color_space = color_space
         return first_buffer
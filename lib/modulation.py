@@ -0,0 +1,232 @@
+import logging
+import numpy as np
+
+log = logging.getLogger("firemix.lib.modulation")
+
+MODULATOR_WIBBLER = 0
+MODULATOR_LFO = 1
+MODULATOR_ENVELOPE = 2
+MODULATOR_AUDIO = 3
+
+LFO_SHAPES = {'sine': 0, 'triangle': 1, 'saw': 2, 'square': 3}
+
+
+def parse_modulator(value):
+    """
+    Given the literal value of a parameter string, returns a modulator tuple of
+    (kind, min, max, rate, release, shape, group, feature), or None if the value does not
+    describe a modulator.  The supported forms are:
+
+        (min, max, accel)                               wibbler: wanders chaotically in range
+        ('lfo', min, max, period[, shape])              periodic sweep; shape is one of
+                                                        sine (default), triangle, saw, square
+        ('envelope', min, max, attack, release)         rises to max over attack seconds on
+                                                        each onset, then falls over release
+        ('audio', group, feature, min, max[, smooth])   follows an audio feature (for example
+                                                        '[Channel1]', 'vumeter'), with the
+                                                        feature's 0..1 range mapped to min..max
+    """
+    if not isinstance(value, (tuple, list)) or len(value) == 0:
+        return None
+
+    try:
+        if not isinstance(value[0], basestring):
+            if len(value) != 3:
+                return None
+            vmin, vmax, accel = value
+            return (MODULATOR_WIBBLER, float(vmin), float(vmax), float(accel), 0.0, 0, None, None)
+
+        kind = value[0]
+        if kind == 'lfo' and len(value) in (4, 5):
+            shape = value[4] if len(value) == 5 else 'sine'
+            if shape not in LFO_SHAPES:
+                return None
+            return (MODULATOR_LFO, float(value[1]), float(value[2]), float(value[3]), 0.0,
+                    LFO_SHAPES[shape], None, None)
+
+        if kind == 'envelope' and len(value) == 5:
+            return (MODULATOR_ENVELOPE, float(value[1]), float(value[2]), float(value[3]),
+                    float(value[4]), 0, None, None)
+
+        if kind == 'audio' and len(value) in (5, 6):
+            smoothing = float(value[5]) if len(value) == 6 else 0.0
+            return (MODULATOR_AUDIO, float(value[3]), float(value[4]), smoothing, 0.0, 0,
+                    str(value[1]), str(value[2]))
+    except (TypeError, ValueError):
+        return None
+
+    return None
+
+
+class ModulationEngine:
+    """
+    Steps every modulated parameter (wibblers, LFOs, envelopes and audio-feature bindings)
+    in one vectorized update per tick.
+
+    Modulator state is stored in parallel arrays indexed by slot.  Each slot belongs to one
+    Parameter, whose _value is written back after every update.  Only the parameters of
+    presets that are playing are stepped, so the others hold their values until they play
+    again.
+    """
+
+    def __init__(self, capacity=16):
+        self._parameters = []
+        self._slots = {}
+        self._feature_keys = {}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        old_capacity = len(self._parameters)
+        self._parameters += [None] * (capacity - old_capacity)
+
+        def grow(name, dtype):
+            new = np.zeros(capacity, dtype=dtype)
+            if old_capacity > 0:
+                new[:old_capacity] = getattr(self, name)
+            setattr(self, name, new)
+
+        grow('_active', bool)
+        grow('_kind', np.int_)
+        grow('_min', np.float64)
+        grow('_max', np.float64)
+        grow('_rate', np.float64)
+        grow('_release', np.float64)
+        grow('_shape', np.int_)
+        grow('_feature_key', np.int_)
+        grow('_owner', np.int_)
+        grow('_value', np.float64)
+        grow('_velocity', np.float64)
+        grow('_phase', np.float64)
+        grow('_level', np.float64)
+        grow('_input', np.float64)
+        grow('_gate', bool)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def add(self, parameter):
+        """
+        Registers (or re-registers) a parameter using its _modulator description
+        """
+        kind, vmin, vmax, rate, release, shape, group, feature = parameter._modulator
+
+        slot = self._slots.get(id(parameter), None)
+        if slot is None:
+            free = np.flatnonzero(~self._active)
+            if len(free) == 0:
+                self._allocate(2 * len(self._parameters))
+                free = np.flatnonzero(~self._active)
+            slot = free[0]
+            self._slots[id(parameter)] = slot
+
+        feature_key = -1
+        if group is not None:
+            feature_key = self._feature_keys.setdefault((group, feature), len(self._feature_keys))
+
+        self._parameters[slot] = parameter
+        self._active[slot] = True
+        self._kind[slot] = kind
+        self._min[slot] = vmin
+        self._max[slot] = vmax
+        self._rate[slot] = rate
+        self._release[slot] = release
+        self._shape[slot] = shape
+        self._feature_key[slot] = feature_key
+        self._owner[slot] = id(parameter._parent)
+        self._value[slot] = parameter._value
+        self._velocity[slot] = 0.0
+        self._phase[slot] = 0.0
+        self._level[slot] = 0.0
+        self._input[slot] = 0.0
+        self._gate[slot] = False
+
+    def remove(self, parameter):
+        slot = self._slots.pop(id(parameter), None)
+        if slot is not None:
+            self._active[slot] = False
+            self._parameters[slot] = None
+
+    def trigger(self):
+        """
+        Opens the gate of every envelope (called on onsets)
+        """
+        self._gate |= self._active & (self._kind == MODULATOR_ENVELOPE)
+
+    def feature_received(self, feature):
+        """
+        Updates the input of every audio binding that follows this feature
+        """
+        key = self._feature_keys.get((feature.get('group', None), feature.get('feature', None)), None)
+        if key is None:
+            return
+
+        try:
+            value = float(feature['value'])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        self._input[self._active & (self._feature_key == key)] = value
+
+    def tick(self, dt, presets=None):
+        """
+        Steps the modulators of the given presets (by default, of every preset)
+        """
+        if len(self._slots) == 0:
+            return
+
+        active = self._active
+        if presets is not None:
+            active = active & np.in1d(self._owner, [id(preset) for preset in presets])
+            # Onsets seen while a preset was not playing do not fire its envelopes later
+            self._gate &= active
+        kind = self._kind
+        span = self._max - self._min
+
+        # Wibblers: random acceleration, stopping dead at either end of the range
+        wibbler = active & (kind == MODULATOR_WIBBLER)
+        if wibbler.any():
+            noise = np.random.random(len(active)) - 0.5
+            self._velocity[wibbler] += noise[wibbler] * self._rate[wibbler] * dt
+            self._value[wibbler] += self._velocity[wibbler] * dt
+            clipped = wibbler & ((self._value > self._max) | (self._value < self._min))
+            self._velocity[clipped] = 0.0
+            self._value[wibbler] = np.clip(self._value[wibbler], self._min[wibbler], self._max[wibbler])
+
+        # LFOs
+        lfo = active & (kind == MODULATOR_LFO)
+        if lfo.any():
+            period = np.where(self._rate > 0.0, self._rate, 1.0)
+            self._phase[lfo] = np.mod(self._phase[lfo] + dt / period[lfo], 1.0)
+            phase = self._phase
+            shape = self._shape
+            wave = np.select([shape == LFO_SHAPES['sine'], shape == LFO_SHAPES['triangle'],
+                              shape == LFO_SHAPES['saw']],
+                             [0.5 - 0.5 * np.cos(2.0 * np.pi * phase), 1.0 - np.abs(2.0 * phase - 1.0),
+                              phase],
+                             np.float64(phase < 0.5))
+            self._value[lfo] = self._min[lfo] + span[lfo] * wave[lfo]
+
+        # Attack/release envelopes
+        envelope = active & (kind == MODULATOR_ENVELOPE)
+        if envelope.any():
+            attack = np.maximum(self._rate, 1e-6)
+            release = np.maximum(self._release, 1e-6)
+            rising = envelope & self._gate
+            falling = envelope & ~self._gate
+            self._level[rising] += dt / attack[rising]
+            self._level[falling] -= dt / release[falling]
+            np.clip(self._level, 0.0, 1.0, self._level)
+            self._gate[rising & (self._level >= 1.0)] = False
+            self._value[envelope] = self._min[envelope] + span[envelope] * self._level[envelope]
+
+        # Audio feature bindings, with optional one-pole smoothing
+        audio = active & (kind == MODULATOR_AUDIO)
+        if audio.any():
+            alpha = np.where(self._rate > 0.0, np.minimum(1.0, dt / np.maximum(self._rate, 1e-6)), 1.0)
+            self._level[audio] += (self._input[audio] - self._level[audio]) * alpha[audio]
+            self._value[audio] = self._min[audio] + span[audio] * np.clip(self._level[audio], 0.0, 1.0)
+
+        values = self._value
+        parameters = self._parameters
+        for slot in np.flatnonzero(active):
+            parameters[slot]._value = float(values[slot])
@@ -0,0 +1,405 @@
+import json
+import logging
+import os
+import select
+import socket
+import time
+import threading
+import unittest
+
+log = logging.getLogger("firemix.lib.node_sync")
+
+# Largest datagram read from the sync socket
+MAX_DATAGRAM = 65507
+
+
+def _to_json(value):
+    """
+    json.dumps() fallback for numpy values in parameters and features
+    """
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+class Conductor:
+    """
+    Drives follower FireMix instances (see Follower) from this one.
+
+    Once per tick, after the modulators have been stepped and before the layers are drawn,
+    the mixer publishes a frame to every enabled follower in the "sync" settings.  A frame
+    is a JSON datagram holding:
+
+        frame, time     the frame number and the conductor's wall clock when it was sent
+        clock, dt       the virtual clock and the (speed-scaled) time step of the frame
+        onset, dimmer, paused
+        features        the audio features received since the previous frame
+        layers          each layer's playlist position and transition state
+        parameters      parameter values of the presets playing on each layer; only the
+                        values that changed are sent, except in every keyframe
+        modulated       the same for parameters driven by modulators, which followers
+                        take as they are instead of running their own modulators
+
+    Followers answer each frame with a report, from which the conductor estimates each
+    follower's clock offset (as NTP does, from the send and receive times on both ends)
+    and how many frames it is behind.  Reports are read on a thread of their own, so that
+    they are timed as they arrive, and logged every report-interval seconds.
+    """
+
+    def __init__(self, mixer, settings):
+        self._mixer = mixer
+        self._followers = [(f["host"], f["port"]) for f in settings.get("followers", [])
+                           if f.get("enabled", True)]
+        self._report_interval = settings.get("report-interval", 10.0)
+        self._keyframe_interval = max(1, int(mixer.get_tick_rate()))
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._features = []
+        self._sent_parameters = {}
+        self._reports = {}
+        self._last_report_time = time.time()
+        self.frame_number = 0
+        self.clock = 0.0
+        log.info("Conducting %d followers: %s" % (len(self._followers), self._followers))
+
+        self._report_thread = threading.Thread(target=self._receive_reports, name="sync-reports")
+        self._report_thread.daemon = True
+        self._report_thread.start()
+
+    def feature_received(self, feature):
+        self._features.append(feature)
+
+    def publish(self, dt):
+        """
+        Sends the frame about to be drawn to the followers
+        """
+        self.frame_number += 1
+        self.clock += dt
+        keyframe = (self.frame_number % self._keyframe_interval) == 1
+        if keyframe:
+            self._sent_parameters = {}
+
+        layers = {}
+        parameters = {}
+        modulated = {}
+        for layer in self._mixer._layers:
+            layers[layer.name] = layer.get_sync_state()
+            for preset in (layer.playlist().get_active_preset(), layer.playlist().get_next_preset()):
+                if preset is None:
+                    continue
+                for key, parameter in preset.get_parameters().iteritems():
+                    value = parameter.get()
+                    sent_key = (layer.name, preset.get_name(), key)
+                    if self._sent_parameters.get(sent_key, None) != value:
+                        self._sent_parameters[sent_key] = value
+                        changed = modulated if parameter.is_animated() else parameters
+                        changed.setdefault(layer.name, {}).setdefault(preset.get_name(), {})[key] = value
+
+        frame = {
+            "frame": self.frame_number,
+            "time": time.time(),
+            "clock": self.clock,
+            "dt": dt,
+            "onset": self._mixer._onset,
+            "dimmer": self._mixer._global_dimmer,
+            "paused": self._mixer.is_paused(),
+            "features": self._features,
+            "layers": layers,
+            "parameters": parameters,
+            "modulated": modulated,
+        }
+        self._features = []
+
+        datagram = json.dumps(frame, default=_to_json)
+        for address in self._followers:
+            try:
+                self._socket.sendto(datagram, address)
+            except (IOError, OSError) as e:
+                log.warn("Could not send frame to %s:%d: %s" % (address + (e,)))
+
+        if time.time() - self._last_report_time >= self._report_interval:
+            self._last_report_time = time.time()
+            self.log_reports()
+
+    def _receive_reports(self):
+        while True:
+            try:
+                datagram, address = self._socket.recvfrom(MAX_DATAGRAM)
+            except (IOError, OSError):
+                # Sends to a follower that is not running yet can fail here; keep going
+                continue
+            received = time.time()
+            try:
+                report = json.loads(datagram)
+            except ValueError:
+                continue
+
+            # The follower received frame "frame" (sent at conductor time "sent") at its
+            # time "received", and sent this report at its time "replied"
+            round_trip = (received - report["sent"]) - (report["replied"] - report["received"])
+            offset = ((report["received"] - report["sent"]) + (report["replied"] - received)) / 2.0
+            self._reports[report["node"]] = {
+                "offset": offset,
+                "round-trip": round_trip,
+                "frames-behind": self.frame_number - report["frame"],
+                "dropped": report["dropped"],
+                "time": received,
+            }
+
+    def get_reports(self):
+        """
+        Returns the latest report of each follower, keyed by node name
+        """
+        return self._reports
+
+    def log_reports(self):
+        if not self._reports:
+            log.warn("No reports from followers")
+        for node, report in sorted(self._reports.iteritems()):
+            log.info("%s: clock offset %+.1f ms, round trip %.1f ms, %d frames behind, %d dropped" %
+                     (node, 1000.0 * report["offset"], 1000.0 * report["round-trip"],
+                      report["frames-behind"], report["dropped"]))
+
+
+class Follower:
+    """
+    Follows a Conductor: instead of keeping its own time, the mixer draws a frame whenever
+    one arrives from the conductor, after applying the conductor's clock, playlist position,
+    transition state, parameter values and features.  If several frames arrived since the
+    last tick, they are drawn as one (with their time steps added up) and the rest are
+    counted as dropped.
+
+    Parameters set on the conductor are set the same way here.  Modulated parameters keep
+    their modulators, but the mixer does not step them while following: their values are
+    written straight from the conductor's, as its ModulationEngine writes them, without
+    calling parameter_changed().
+    """
+
+    def __init__(self, mixer, port):
+        self._mixer = mixer
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(("", port))
+        self._socket.setblocking(False)
+        self.node_name = "%s:%d" % (socket.gethostname(), port)
+        self.frame_number = 0
+        self.clock = 0.0
+        self.dropped = 0
+        log.info("Following a conductor on port %d" % port)
+
+    def receive(self, timeout):
+        """
+        Waits up to timeout seconds for frames from the conductor, and returns them (oldest
+        first) with the address of the conductor
+        """
+        frames = []
+        address = None
+        ready, _, _ = select.select([self._socket], [], [], timeout)
+        while ready:
+            # Read until the socket is empty
+            try:
+                datagram, address = self._socket.recvfrom(MAX_DATAGRAM)
+            except (IOError, OSError):
+                break
+            received = time.time()
+            try:
+                frame = json.loads(datagram)
+            except ValueError:
+                log.warn("Ignoring a malformed frame from %s:%d" % address)
+                continue
+            if frame["frame"] <= self.frame_number:
+                # Out of order, or the conductor restarted
+                if frame["frame"] > 1:
+                    continue
+                self.frame_number = 0
+            frame["received"] = received
+            frames.append(frame)
+        return frames, address
+
+    def follow(self, timeout):
+        """
+        Applies the frames received from the conductor to the mixer and its layers.
+        Returns the time step to draw, or None if no frame arrived within timeout.
+        """
+        frames, address = self.receive(timeout)
+        if not frames:
+            return None
+
+        last = frames[-1]
+        if self.frame_number > 0:
+            # Frames that were lost or merged into this one
+            self.dropped += last["frame"] - self.frame_number - 1
+        self.frame_number = last["frame"]
+        self.clock = last["clock"]
+
+        mixer = self._mixer
+        for frame in frames:
+            for feature in frame["features"]:
+                mixer.feature_received(feature)
+        mixer._onset = any(frame["onset"] for frame in frames)
+        mixer._global_dimmer = last["dimmer"]
+        mixer._paused = last["paused"]
+
+        for layer in mixer._layers:
+            state = last["layers"].get(layer.name, None)
+            if state is not None:
+                layer.set_sync_state(state)
+            for frame in frames:
+                for name, values in frame["parameters"].get(layer.name, {}).iteritems():
+                    preset = layer.playlist().get_preset_by_name(name)
+                    if preset is not None:
+                        self._set_parameters(preset, values)
+                for name, values in frame["modulated"].get(layer.name, {}).iteritems():
+                    preset = layer.playlist().get_preset_by_name(name)
+                    if preset is not None:
+                        self._set_modulated_values(preset, values)
+
+        self._report(last, address)
+        return sum(frame["dt"] for frame in frames)
+
+    def _set_parameters(self, preset, values):
+        for key, value in values.iteritems():
+            parameter = preset.parameter(key)
+            if parameter is None:
+                continue
+            # JSON has no tuples
+            if isinstance(parameter.get(), tuple):
+                value = tuple(value)
+            if parameter.get() != value:
+                parameter.set(value)
+
+    def _set_modulated_values(self, preset, values):
+        for key, value in values.iteritems():
+            parameter = preset.parameter(key)
+            if parameter is None:
+                continue
+            parameter._value = value
+            preset.params.update(parameter)
+
+    def _report(self, frame, address):
+        report = {
+            "node": self.node_name,
+            "frame": frame["frame"],
+            "sent": frame["time"],
+            "received": frame["received"],
+            "replied": time.time(),
+            "dropped": self.dropped,
+        }
+        try:
+            self._socket.sendto(json.dumps(report), address)
+        except (IOError, OSError) as e:
+            log.warn("Could not send report to the conductor: %s" % e)
+
+
+class TestNodeSync(unittest.TestCase):
+    """
+    Runs a conductor and a follower sending strands 0-2 on localhost, through transitions
+    that make random choices between presets that do, and checks that the follower sends
+    the same strands as the conductor.
+    """
+
+    PLAYLIST = "test-node-sync"
+    PRESETS = ["Twinkle", "Fungus", "Dragons", "RadialGradient"]
+    TRANSITIONS = ["Fuzz", "Fixture Strobe", "Wipe", "Radial Wipe"]
+
+    class _Sent:
+        """
+        Stands in for the Networking socket, keeping the packets sent each frame
+        """
+        def __init__(self):
+            self.packets = []
+
+        def sendto(self, packet, address):
+            self.packets.append(packet.tostring())
+
+    class _OscServer:
+        def broadcast_mixxx_control_updates(self, updates):
+            pass
+
+    @classmethod
+    def setUpClass(cls):
+        from core.mixer import Mixer
+        from core.networking import Networking
+        from lib.buffer_utils import BufferUtils
+        from lib.json_dict import JSONDict
+        from lib.layer import Layer
+        from lib.playlist import Playlist
+        from lib.plugin_loader import PluginLoader
+        from lib.scene import Scene
+
+        cls.playlist_path = os.path.join(os.getcwd(), "data", "playlists", cls.PLAYLIST + ".json")
+        with open(cls.playlist_path, "w") as f:
+            json.dump({"file-type": "playlist",
+                       "playlist": [{"classname": name, "name": name, "params": {}}
+                                    for name in cls.PRESETS]}, f)
+
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe.bind(("", 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        class App:
+            pass
+
+        def make_app(conductor=False, follower=None, strands=None):
+            app = App()
+
+            class args:
+                scene = "demo"
+                profile = False
+                yappi = False
+            args.conductor = conductor
+            args.follower = follower
+            args.strands = strands
+            app.args = args
+
+            app.settings = JSONDict("settings", os.path.join(os.getcwd(), "data", "settings.json.example"), False)
+            app.settings["mixer"].update({"preset-duration": 1000.0, "transition-duration": 0.25,
+                                          "transition-slop": 0.0, "shuffle": False})
+            app.settings["sync"] = {"followers": [{"host": "127.0.0.1", "port": port}]}
+            app.net = Networking(app)
+            app.net._socket = cls._Sent()
+            app.osc_server = cls._OscServer()
+            return app
+
+        cls.conductor = make_app(conductor=True)
+        cls.follower = make_app(follower=port, strands="0-2")
+        cls.follower.net.set_strands(0, 3)
+
+        scene = Scene(cls.conductor)
+        BufferUtils.set_app(cls.conductor)
+        plugins = PluginLoader()
+        for app in (cls.conductor, cls.follower):
+            app.scene = scene
+            app.plugins = plugins
+            app.mixer = Mixer(app)
+            layer = Layer(app, "default")
+            layer.set_playlist(Playlist(app, cls.PLAYLIST, "last_playlist"))
+            app.mixer.add_layer(layer)
+        scene.warmup()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.playlist_path)
+
+    def tick(self):
+        """
+        Draws a frame on the conductor and then on the follower, and returns the packets
+        each of them sent
+        """
+        for app in (self.conductor, self.follower):
+            app.net._socket.packets = []
+            app.mixer.tick()
+        return self.conductor.net._socket.packets, self.follower.net._socket.packets
+
+    def test_transitions(self):
+        layer = self.conductor.mixer.default_layer()
+        for name in self.TRANSITIONS:
+            layer.set_transition_mode(name)
+            layer.start_transition()
+            frames = 0
+            while layer._in_transition or frames == 0:
+                conductor_packets, follower_packets = self.tick()
+                self.assertEqual([ord(packet[0]) for packet in follower_packets], [0, 1, 2])
+                self.assertEqual(follower_packets, conductor_packets[:3])
+                frames += 1
+            self.assertGreater(frames, 1)
+            self.assertEqual(str(self.follower.mixer.default_layer()._transition), name)
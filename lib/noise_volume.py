@@ -0,0 +1,114 @@
+import os
+import logging
+import numpy as np
+
+from lib.simplex import snoise3
+
+log = logging.getLogger("firemix.lib.noise_volume")
+
+
+class NoiseVolume:
+    """
+    A precomputed, tileable 3D block of simplex noise.
+
+    The volume holds size**3 float32 samples spaced scale noise units apart, so it tiles
+    every size * scale units along each axis.  Volumes are generated once per set of
+    parameters, saved as .npy files under data/cache, and memory-mapped from there, so
+    presets share one copy and restarts skip the generation step.  Use NoiseVolume.get()
+    rather than creating volumes directly.
+    """
+
+    _volumes = {}
+
+    @classmethod
+    def get(cls, seed=0, scale=0.25, octaves=1, persistence=0.5, size=64):
+        key = (seed, scale, octaves, persistence, size)
+        volume = cls._volumes.get(key, None)
+        if volume is None:
+            volume = cls(seed, scale, octaves, persistence, size)
+            cls._volumes[key] = volume
+        return volume
+
+    def __init__(self, seed, scale, octaves, persistence, size):
+        self.scale = float(scale)
+        self.size = size
+        self.period = size * self.scale
+
+        cache_dir = os.path.join(os.getcwd(), "data", "cache")
+        filename = "noise-%d-%g-%d-%g-%d.npy" % (seed, scale, octaves, persistence, size)
+        path = os.path.join(cache_dir, filename)
+
+        if not os.path.exists(path):
+            log.info("Generating noise volume %s" % filename)
+            data = self._generate(seed, octaves, persistence)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # Write to a temporary name so a partial file is never picked up
+            temp_path = path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                np.save(f, data)
+            os.rename(temp_path, path)
+
+        self._data = np.load(path, mmap_mode='r')
+
+    def _generate(self, seed, octaves, persistence):
+        """
+        Makes the noise tile by blending it with copies of itself shifted by one period
+        along each axis, weighted so that opposite faces of the volume match.  The blend is
+        renormalized so the contrast stays even across the volume.
+        """
+        origin = np.random.RandomState(seed).uniform(0.0, 256.0, 3)
+        coords = np.arange(self.size) * self.scale
+        weights = (1.0 - coords / self.period, coords / self.period)
+        norm = np.sqrt(weights[0] ** 2 + weights[1] ** 2)
+        data = np.zeros((self.size, self.size, self.size), dtype=np.float32)
+
+        x, y = np.meshgrid(coords, coords, indexing='ij')
+        for k, z in enumerate(coords):
+            layer = np.zeros((self.size, self.size), dtype=np.float64)
+            for dx in (0, 1):
+                for dy in (0, 1):
+                    for dz in (0, 1):
+                        weight = np.outer(weights[dx], weights[dy]) * weights[dz][k]
+                        layer += weight * snoise3(origin[0] + x - dx * self.period,
+                                                  origin[1] + y - dy * self.period,
+                                                  origin[2] + z - dz * self.period,
+                                                  octaves, persistence)
+            layer /= np.outer(norm, norm) * norm[k]
+            data[:, :, k] = np.clip(layer, -1.0, 1.0)
+
+        return data
+
+    def sample(self, x, y, z):
+        """
+        Returns the noise at the given coordinates (in noise units, as for snoise3), using
+        trilinear interpolation and wrapping around the volume
+        """
+        x, y, z = np.broadcast_arrays(np.asarray(x, dtype=np.float64) / self.scale,
+                                      np.asarray(y, dtype=np.float64) / self.scale,
+                                      np.asarray(z, dtype=np.float64) / self.scale)
+        x0 = np.floor(x)
+        y0 = np.floor(y)
+        z0 = np.floor(z)
+        fx = x - x0
+        fy = y - y0
+        fz = z - z0
+
+        size = self.size
+        i0 = x0.astype(np.int_) % size
+        j0 = y0.astype(np.int_) % size
+        k0 = z0.astype(np.int_) % size
+        i1 = (i0 + 1) % size
+        j1 = (j0 + 1) % size
+        k1 = (k0 + 1) % size
+
+        data = self._data
+        c00 = data[i0, j0, k0] * (1.0 - fx) + data[i1, j0, k0] * fx
+        c10 = data[i0, j1, k0] * (1.0 - fx) + data[i1, j1, k0] * fx
+        c01 = data[i0, j0, k1] * (1.0 - fx) + data[i1, j0, k1] * fx
+        c11 = data[i0, j1, k1] * (1.0 - fx) + data[i1, j1, k1] * fx
+
+        c0 = c00 * (1.0 - fy) + c10 * fy
+        c1 = c01 * (1.0 - fy) + c11 * fy
+
+        return c0 * (1.0 - fz) + c1 * fz
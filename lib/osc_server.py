@@ -5,6 +5,8 @@ import time
 import os
 from PySide import QtCore, QtNetwork
 
+from lib.profiling import SECTION_TICK, SECTION_DRAW, SECTION_NAMES
+
 log = logging.getLogger("firemix.lib.osc_server")
 
 def restricted_range_float_handler(path, min_value, max_value):
@@ -120,6 +122,35 @@ class OscServer(liblo.ServerThread):
         for layer in self.mixer._layers:
             layer.set_transition_duration(value)
 
+    @no_arg_handler('/firemix/profile/reset')
+    def profile_reset(self):
+        for layer in self.mixer._layers:
+            self.mixer.profiler.reset(layer.playlist().get())
+
+    @liblo.make_method('/firemix/profile/report', '')
+    def profile_report(self, path, args, types, src):
+        """
+        Replies with one /firemix/profile/preset message per profiled preset, most expensive
+        first: layer, preset, ticks, mean tick ms, mean draw ms, worst tick ms.
+        """
+        for layer in self.mixer._layers:
+            for preset, profile in self.mixer.profiler.rank(layer.playlist().get()):
+                self.send(src, '/firemix/profile/preset', layer.name, preset.get_name(),
+                          int(profile.counts[SECTION_TICK]),
+                          float(profile.mean(SECTION_TICK)),
+                          float(profile.mean(SECTION_DRAW)),
+                          float(profile.worst[SECTION_TICK]))
+
+    @liblo.make_method('/firemix/profile/slow_frames', '')
+    def profile_slow_frames(self, path, args, types, src):
+        """
+        Replies with one /firemix/profile/slow_frame message per recorded slow frame, oldest
+        first: time, name, section, ms.
+        """
+        for frame in self.mixer.profiler.slow_frames():
+            self.send(src, '/firemix/profile/slow_frame', float(frame['time']), str(frame['name']),
+                      SECTION_NAMES[frame['section']], float(frame['ms']))
+
     @no_arg_handler('/firemix/toggle_pause')
     def toggle_pause(self):
         self.mixer.pause(not self.mixer.is_paused())
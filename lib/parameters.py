@@ -1,6 +1,6 @@
 import ast
 import numpy
-from lib.wibbler import Wibbler
+from lib.modulation import parse_modulator, MODULATOR_WIBBLER
 
 class Parameter:
     """
@@ -10,14 +10,11 @@ class Parameter:
         if not isinstance(name, str):
             raise ValueError("Parameter name must be a string.")
         self._name = name
+        self._attribute_name = name.replace('-', '_')
         self._value = 0
         self._valueString = None
         self._parent = parent        
-        self._wibbler = None
-
-    def tick(self, dt):
-        if self._wibbler:
-            self._value = self._wibbler.update(dt, self._value)
+        self._modulator = None
 
     def __repr__(self):
         return self._name
@@ -25,6 +22,13 @@ class Parameter:
     def get(self):
         return self._value
 
+    def is_animated(self):
+        """
+        Returns True if the value of this parameter is driven by a modulator
+        (see lib/modulation.py) and changes on its own every tick
+        """
+        return self._modulator is not None
+
     def get_as_str(self):
         return self._valueString
 
@@ -33,10 +37,11 @@ class Parameter:
 
     def set(self, value):
         if self.validate(value):
-            self._wibbler = None
+            self._modulator = None
             self._value = value
             self._valueString = str(value)
             if self._parent is not None:
+                self._parent._update_parameter(self)
                 self._parent.parameter_changed(self)
             return True
         else:
@@ -48,13 +53,19 @@ class Parameter:
             cval = self._cast_from_str(valueString)
         except ValueError:
             try:
-                value = ast.literal_eval(valueString)
-                if len(value) == 3:
-                    self._wibbler = Wibbler(value)
-                    self._value = numpy.random.random() * (self._wibbler._max - self._wibbler._min) + self._wibbler._min
-                    self._valueString = valueString
-                    return True
-                return False
+                modulator = parse_modulator(ast.literal_eval(valueString))
+                if modulator is None:
+                    return False
+                kind, vmin, vmax = modulator[:3]
+                self._modulator = modulator
+                if kind == MODULATOR_WIBBLER:
+                    self._value = numpy.random.random() * (vmax - vmin) + vmin
+                else:
+                    self._value = vmin
+                self._valueString = valueString
+                if self._parent is not None:
+                    self._parent._update_parameter(self)
+                return True
             except:
                 return False
 
@@ -79,6 +90,20 @@ class Parameter:
         self._parent = parent
 
 
+class ParameterSnapshot(object):
+    """
+    Attribute-access view of a preset's parameter values.
+
+    Parameter names are converted to attribute names by replacing '-' with '_', so the
+    value of the 'wave1-speed' parameter is available as wave1_speed.  Presets keep this up
+    to date as parameters are set and once per tick for animated parameters, so it can be
+    read freely from draw() instead of calling parameter(name).get().
+    """
+
+    def update(self, parameter):
+        setattr(self, parameter._attribute_name, parameter._value)
+
+
 class BoolParameter(Parameter):
     """
     Parameter holding a boolean value
@@ -0,0 +1,94 @@
+import numpy as np
+
+
+class Particles:
+    """
+    Round particles (filled discs or expanding rings) drawn onto the pixels of a scene.
+
+    Particles are slots in parallel numpy arrays (position, radius and a color ticker);
+    inactive slots are reused.  Drawing looks up the pixels that each particle covers in
+    the scene's SpatialGrid, so the cost depends on how many pixels are lit rather than
+    on the size of the scene times the number of particles.
+    """
+
+    def __init__(self, scene, capacity=16):
+        self._grid = scene.get_pixel_grid()
+        self.num_pixels = len(self._grid)
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        old_capacity = len(getattr(self, 'active', []))
+
+        def grow(name, dtype):
+            new = np.zeros(capacity, dtype=dtype)
+            if old_capacity > 0:
+                new[:old_capacity] = getattr(self, name)
+            setattr(self, name, new)
+
+        grow('active', bool)
+        grow('x', np.float64)
+        grow('y', np.float64)
+        grow('radius', np.float64)
+        grow('color', np.float64)
+
+    def reset(self):
+        self.active[:] = False
+
+    def __len__(self):
+        return np.count_nonzero(self.active)
+
+    def slots(self):
+        return np.flatnonzero(self.active)
+
+    def spawn(self, x, y, radius=0.0, color=0.0):
+        """
+        Creates a particle and returns its slot
+        """
+        free = np.flatnonzero(~self.active)
+        if len(free) == 0:
+            self._allocate(2 * len(self.active))
+            free = np.flatnonzero(~self.active)
+
+        slot = free[0]
+        self.active[slot] = True
+        self.x[slot] = x
+        self.y[slot] = y
+        self.radius[slot] = radius
+        self.color[slot] = color
+        return slot
+
+    def kill(self, slots):
+        self.active[slots] = False
+
+    def covered(self, slots, inner, outer):
+        """
+        Returns (owners, pixels) listing every pixel whose distance d from a particle is
+        within inner < d < outer (per-slot arrays), where owners holds the particle each
+        pixel belongs to.  A pixel covered by several particles is listed once for each.
+        """
+        centers = np.column_stack((self.x[slots], self.y[slots]))
+        owners, pixels, distances = self._grid.annuli(centers, inner, outer)
+        return np.asarray(slots, dtype=np.int_)[owners], pixels
+
+    def draw_rings(self, slots, width, hues, luminances, slot_hues, luminance=0.5):
+        """
+        Lights the pixels less than width from the edge of each particle.  slot_hues (one
+        per slot, or a single value) are added, so overlapping particles mix.
+        """
+        radius = self.radius[slots]
+        self._draw(slots, radius - width, radius + width, hues, luminances, slot_hues, luminance)
+
+    def draw_discs(self, slots, hues, luminances, slot_hues, luminance=0.5):
+        """
+        Lights the pixels inside each particle.  Hues are added, so overlapping particles mix.
+        """
+        self._draw(slots, np.full(len(slots), -1.0), self.radius[slots], hues, luminances,
+                   slot_hues, luminance)
+
+    def _draw(self, slots, inner, outer, hues, luminances, slot_hues, luminance):
+        owners, pixels = self.covered(slots, inner, outer)
+        # Hues are indexed by slot, so map owner slots to their position in slots
+        lookup = np.zeros(len(self.active), dtype=np.int_)
+        lookup[slots] = np.arange(len(slots))
+        np.add.at(hues, pixels, (np.zeros(len(slots)) + slot_hues)[lookup[owners]])
+        luminances[pixels] = luminance
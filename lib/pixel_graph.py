@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class PixelGraph:
+    """
+    Compressed sparse row (CSR) adjacency between the pixels of a scene.
+
+    The neighbors of the pixel at buffer index i are indices[indptr[i]:indptr[i + 1]], and
+    lengths holds the distance (in scene units) along each of those edges.  The operators
+    below work on per-pixel numpy arrays, so graph effects need no per-pixel Python calls.
+    """
+
+    def __init__(self, indptr, indices, lengths):
+        self.indptr = indptr
+        self.indices = indices
+        self.lengths = lengths
+        self.num_pixels = len(indptr) - 1
+        self.degree = np.diff(indptr)
+        # Source pixel of each edge, so that edge i runs from rows[i] to indices[i]
+        self.rows = np.repeat(np.arange(self.num_pixels), self.degree)
+
+    @classmethod
+    def from_edges(cls, num_pixels, sources, targets, lengths):
+        """
+        Builds a graph from parallel edge arrays.  Edges from the same pixel keep their
+        relative order.
+        """
+        order = np.argsort(sources, kind='mergesort')
+        indptr = np.zeros(num_pixels + 1, dtype=np.int_)
+        np.cumsum(np.bincount(sources, minlength=num_pixels), out=indptr[1:])
+        return cls(indptr, np.asarray(targets, dtype=np.int_)[order],
+                   np.asarray(lengths, dtype=np.float32)[order])
+
+    def __len__(self):
+        return self.num_pixels
+
+    def neighbors(self, index):
+        return self.indices[self.indptr[index]:self.indptr[index + 1]]
+
+    def edge_lengths(self, index):
+        return self.lengths[self.indptr[index]:self.indptr[index + 1]]
+
+    def neighbor_sum(self, values, weights=None):
+        """
+        Returns, for every pixel, the sum of values over its neighbors.  If weights (one per
+        edge, for example a function of lengths) is given, each term is scaled by it.
+        """
+        gathered = values[self.indices]
+        if weights is not None:
+            gathered = gathered * weights
+        return np.bincount(self.rows, weights=gathered, minlength=self.num_pixels)
+
+    def neighbor_max(self, values, empty=0.0):
+        """
+        Returns, for every pixel, the largest of values over its neighbors.  Pixels with no
+        neighbors get empty.
+        """
+        result = np.full(self.num_pixels, empty, dtype=np.result_type(values, empty))
+        if len(self.indices) > 0:
+            result[self.degree > 0] = np.maximum.reduceat(values[self.indices],
+                                                          self.indptr[:-1][self.degree > 0])
+        return result
+
+    def neighbor_count(self, mask):
+        """
+        Returns, for every pixel, how many of its neighbors are set in mask
+        """
+        return np.bincount(self.rows, weights=mask[self.indices],
+                           minlength=self.num_pixels).astype(np.int_)
+
+    def neighbors_of(self, mask):
+        """
+        Returns a mask of the pixels adjacent to any pixel set in mask
+        """
+        adjacent = np.zeros(self.num_pixels, dtype=bool)
+        adjacent[self.indices[mask[self.rows]]] = True
+        return adjacent
+
+    def diffuse(self, values, rate, steps=1):
+        """
+        Returns values after the given number of explicit diffusion steps, in which each
+        pixel moves towards its neighbors by rate times the difference.  Keep rate below
+        1 / max(degree) for a stable result.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        for i in xrange(steps):
+            values = values + rate * (self.neighbor_sum(values) - self.degree * values)
+        return values
+
+    def k_hop_mask(self, mask, k):
+        """
+        Returns a mask of the pixels within k edges of any pixel set in mask
+        """
+        reached = np.array(mask, dtype=bool)
+        frontier = reached
+        for i in xrange(k):
+            frontier = self.neighbors_of(frontier) & ~reached
+            if not frontier.any():
+                break
+            reached |= frontier
+        return reached
@@ -0,0 +1,114 @@
+import numpy as np
+
+
+class PixelStateMachine:
+    """
+    Per-pixel state for cellular-automaton style RawPresets.
+
+    Every pixel in the buffer has a state code and the time at which it entered that state,
+    held in numpy arrays indexed by buffer index.  Presets express their rules as array
+    operations on these (masks of pixels in a state, ages, random draws and neighbor
+    queries on the scene's PixelGraph) rather than looping over lists of addresses, so
+    each frame is O(pixels).
+
+    State 0 is the initial state of every pixel.
+    """
+
+    def __init__(self, scene, seed=None):
+        self._graph = scene.get_pixel_graph()
+        self.degree = self._graph.degree
+        self.random = np.random.RandomState(seed)
+        self.reset()
+
+    def reset(self):
+        num_pixels = len(self.degree)
+        self.state = np.zeros(num_pixels, dtype=np.int8)
+        self.entered = np.zeros(num_pixels, dtype=np.float64)
+        self.time = 0.0
+
+    def __len__(self):
+        return len(self.state)
+
+    def advance(self, dt):
+        self.time += dt
+
+    def in_state(self, state):
+        """
+        Returns a mask of the pixels in the given state
+        """
+        return self.state == state
+
+    def where(self, state):
+        """
+        Returns the buffer indices of the pixels in the given state
+        """
+        return np.flatnonzero(self.state == state)
+
+    def count(self, state):
+        return np.count_nonzero(self.state == state)
+
+    def set_state(self, pixels, state):
+        """
+        Moves pixels (a mask or an array of indices) into state, starting their clocks
+        """
+        self.state[pixels] = state
+        self.entered[pixels] = self.time
+
+    def age(self, pixels=None):
+        """
+        Returns the time each of the given pixels (or every pixel) has spent in its current state
+        """
+        if pixels is None:
+            return self.time - self.entered
+        return self.time - self.entered[pixels]
+
+    def progress(self, pixels, duration):
+        """
+        Returns the progress (0 to 1) of the given pixels through a state lasting duration
+        """
+        if duration <= 0:
+            return np.ones(len(self.entered[pixels]))
+        return np.clip(self.age(pixels) / duration, 0.0, 1.0)
+
+    def chance(self, probability, mask=None):
+        """
+        Returns a mask that is set for each pixel (within mask, if given) with the given probability
+        """
+        hits = self.random.random_sample(len(self.state)) < probability
+        if mask is not None:
+            hits &= mask
+        return hits
+
+    def pick(self, mask, count):
+        """
+        Returns a mask of at most count pixels chosen at random from mask
+        """
+        candidates = np.flatnonzero(mask)
+        picked = np.zeros(len(self.state), dtype=bool)
+        if count >= len(candidates):
+            picked[candidates] = True
+        elif count > 0:
+            picked[self.random.choice(candidates, count, replace=False)] = True
+        return picked
+
+    def neighbor_count(self, mask):
+        """
+        Returns, for every pixel, how many of its neighbors are set in mask
+        """
+        return self._graph.neighbor_count(mask)
+
+    def neighbors_of(self, mask):
+        """
+        Returns a mask of the pixels adjacent to any pixel set in mask
+        """
+        return self._graph.neighbors_of(mask)
+
+    def spread(self, sources, targets, limit=None):
+        """
+        Returns a mask of the pixels in targets that are adjacent to a source.  If limit is
+        given, at most that many are chosen at random.
+        """
+        reached = self.neighbors_of(sources) & targets
+        if limit is not None:
+            reached = self.pick(reached, max(0, limit))
+        return reached
@@ -46,7 +46,7 @@ class Playlist(JSONDict):
         self._loader = PresetLoader()
         self._preset_classes = self._loader.load()
         self._playlist_data = self.data.get('playlist', [])
-        self._playlist = []
+        self._clear_presets()
 
         self._active_index = 0
         self._next_index = 0
@@ -60,7 +60,7 @@ class Playlist(JSONDict):
 
     def generate_playlist(self):
         if len(self._playlist_data) == 0:
-            self._playlist = []
+            self._clear_presets()
 
         for entry in self._playlist_data:
             if entry['classname'] in self._preset_classes:
@@ -274,6 +274,7 @@ class Playlist(JSONDict):
         assert len(pl) == 1
 
         self._playlist.remove(pl[0][1])
+        pl[0][1].clear_parameters()
 
         self._next_index = self._next_index % len(self._playlist)
         self._active_index = self._active_index % len(self._playlist)
@@ -291,8 +292,17 @@ class Playlist(JSONDict):
             new.parameter(name).set_from_str(param.get_as_str())
         self._notifier.playlist_changed.emit()
 
-    def clear_playlist(self):
+    def _clear_presets(self):
+        """
+        Drops every preset instance.  Their parameters are taken out of the mixer's
+        ModulationEngine, which would otherwise keep them (and the presets) alive.
+        """
+        for inst in getattr(self, '_playlist', []):
+            inst.clear_parameters()
         self._playlist = []
+
+    def clear_playlist(self):
+        self._clear_presets()
         self._active_index = 0
         self._next_index = 0
         self._notifier.playlist_changed.emit()
@@ -312,7 +322,7 @@ class Playlist(JSONDict):
         for cn in self._preset_classes:
             name = cn + "-1"
             inst = self._preset_classes[cn](self._app.mixer, name=name)
-            inst.setup()
+            inst._reset()
             self._playlist.append(inst)
         self._notifier.playlist_changed.emit()
 
@@ -1,9 +1,11 @@
 import unittest
-import time
+import random
 import logging
 import numpy as np
 
-from lib.commands import SetAll, SetStrand, SetFixture, SetPixel, render_command_list
+from lib.parameters import ParameterSnapshot
+from lib.commands import CommandBuffer
+from lib.basic_tickers import LIGHT_OPCODES, FadeGroup, compile_tickers
 
 log = logging.getLogger("firemix.lib.preset")
 
@@ -11,13 +13,36 @@ log = logging.getLogger("firemix.lib.preset")
 class Preset:
     """Base Preset.  Does nothing."""
 
+    # Presets whose output at each pixel depends only on the pixel's location, the time,
+    # onsets, features and parameter values (and not on other pixels or random state) can
+    # set this, so that the mixer may render them on several processes at once (see
+    # lib/shard_renderer.py).  They must be RawPresets.
+    shardable = False
+
+    # Attributes of a shardable preset that change from frame to frame (its animation
+    # state).  They are copied back from the shards after each frame, so that the preset can
+    # carry on from the same state if it has to be rendered by the mixer again.
+    shard_state = ()
+
+    # The color space of the buffer returned by draw_to_buffer(): 'HLS', or 'RGB' for RGB
+    # colors in [0..1].  Presets that generate RGB can output it directly, and the layers
+    # and the mixer only convert it when it has to be blended with HLS content.  Presets
+    # may change it from frame to frame; it is read after each draw.
+    color_space = 'HLS'
+
     def __init__(self, mixer, name=""):
         self._mixer = mixer
-        self._commands = []
+        self._commands = CommandBuffer()
         self._tickers = []
+        self._ticker_plan = None
         self._ticks = 0
         self._elapsed_time = 0
+        self._reset_count = 0
+        self._seed = None
+        self.random = np.random.RandomState()
         self._parameters = {}
+        self._active_parameters = []
+        self.params = ParameterSnapshot()
         self._instance_name = name
         self.setup()
 
@@ -38,10 +63,24 @@ class Preset:
         """
         pass
 
-    def _reset(self):
-        self._commands = []
+    def _reset(self, seed=None):
+        if seed is None:
+            seed = random.randint(0, 2 ** 31 - 1)
+        self._reset_count += 1
+        self._seed = seed
+        self.seed(seed)
+        self._commands.clear()
         self.reset()
 
+    def seed(self, seed):
+        """
+        Called with a new seed each time the preset is about to start playing, before
+        reset().  Presets should make their random choices with self.random, so that nodes
+        following a conductor (see lib/node_sync.py) make the same ones.  Override this to
+        also seed any other random state the preset keeps.
+        """
+        self.random.seed(seed)
+
     def setup(self):
         """
         Override this method to initialize your tickers.
@@ -68,12 +107,40 @@ class Preset:
         """
         parameter.set_parent(self)
         self._parameters[str(parameter)] = parameter
+        self._update_parameter(parameter)
+
+    def _update_parameter(self, parameter):
+        """
+        Called by a parameter when its value is set, to keep self.params, the list of
+        animated parameters and the mixer's modulation engine up to date.
+        """
+        # Parameter.__cmp__ compares values, so match parameters by identity here
+        active = [p for p in self._active_parameters if p is not parameter]
+        if parameter.is_animated():
+            active.append(parameter)
+            self._mixer.modulation.add(parameter)
+        else:
+            self._mixer.modulation.remove(parameter)
+        self._active_parameters = active
+        self.params.update(parameter)
+
+    def _tick_parameters(self, dt):
+        """
+        Refreshes the values of animated parameters in self.params.  The values
+        themselves are stepped by the mixer's ModulationEngine.
+        """
+        for parameter in self._active_parameters:
+            self.params.update(parameter)
 
     def get_parameters(self):
         return self._parameters
 
     def clear_parameters(self):
-        self._parameters = []
+        for parameter in self._active_parameters:
+            self._mixer.modulation.remove(parameter)
+        self._parameters = {}
+        self._active_parameters = []
+        self.params = ParameterSnapshot()
 
     def parameter(self, key):
         return self._parameters.get(key, None)
@@ -112,30 +179,40 @@ class Preset:
         The optional priority arguments is used to determine the order in which
         tickers are run. High priorities are run after lower priorities, allowing
         them to override the lower-priority tickers.
+
+        Chains of speed(), offset() and fade() tickers are compiled into groups
+        that are evaluated with numpy (see basic_tickers.compile_tickers).
         """
         self._tickers.append((ticker, priority))
         # Resort the list here rather than at each tick
         self._tickers = sorted(self._tickers, key=lambda x: x[1])
+        self._ticker_plan = None
         return ticker
 
     def remove_ticker(self, ticker):
         for (t, p) in self._tickers:
             if t == ticker:
                 self._tickers.remove((t, p))
+        self._ticker_plan = None
 
     def clear_tickers(self):
         self._tickers = []
+        self._ticker_plan = None
 
     def tick(self, dt):
-        if self._mixer._enable_profiling:
-            start = time.time()
-
-        for parameter in self._parameters.values():
-            parameter.tick(dt)
+        self._tick_parameters(dt)
 
         # Assume that self._tickers is already sorted via add_ticker()
-        for ticker, priority in self._tickers:
+        if self._ticker_plan is None:
+            self._ticker_plan = compile_tickers(self._tickers)
 
+        for step in self._ticker_plan:
+
+            if isinstance(step, FadeGroup):
+                step.emit(self._commands, self._elapsed_time)
+                continue
+
+            ticker, priority = step
             for lights, color in ticker(self._ticks, self._elapsed_time):
 
                 if lights is not None:
@@ -144,41 +221,44 @@ class Preset:
                         lights = [lights]
 
                     for light in lights:
-                        if len(light) == 0:
-                            self.add_command(SetAll(color, priority))
-                        elif len(light) == 1:
-                            self.add_command(SetStrand(light[0], color, priority))
-                        elif len(light) == 2:
-                            self.add_command(SetFixture(light[0], light[1], color, priority))
-                        elif len(light) == 3:
-                            self.add_command(SetPixel(light[0], light[1], light[2], color, priority))
+                        n = len(light)
+                        if n > 3:
+                            continue
+                        self._commands.append(LIGHT_OPCODES[n],
+                                              light[0] if n > 0 else -1,
+                                              light[1] if n > 1 else -1,
+                                              light[2] if n > 2 else -1,
+                                              color, priority)
 
         self._ticks += 1
         self._elapsed_time += dt
-        if self._mixer._enable_profiling:
-            tick_time = 1000.0 * (time.time() - start)
-            if tick_time > 30.0:
-                log.info("%s slow frame: %d ms" % (self.__class__, tick_time))
 
     def draw_to_buffer(self, buffer):
-        commands = self.get_commands()
-        render_command_list(self.scene(), commands, buffer)
+        culled = self._commands.render(buffer)
+        if self._mixer._enable_profiling:
+            self._mixer.profiler.profile_for(self).record_culled(culled, len(self._commands))
         return buffer
 
+    def get_color_space(self):
+        return self.color_space
+
     def tick_rate(self):
         return self._mixer.get_tick_rate()
 
     def clear_commands(self):
-        self._commands = []
+        self._commands.clear()
 
     def get_commands(self):
+        return self._commands.get_commands()
+
+    def get_command_buffer(self):
         return self._commands
 
     def get_commands_packed(self):
-        return [cmd.pack() for cmd in self._commands]
+        return self._commands.pack()
 
     def add_command(self, cmd):
-        self._commands.append(cmd)
+        self._commands.add_command(cmd)
 
     def _convert_color(self, color):
         if (type(color[0]) == float) or (type(color[1]) == float) or (type(color[2]) == float) or (type(color[1]) ==np.float32):
@@ -193,6 +273,13 @@ class Preset:
         """Called when the mixer receives a new feature report."""
         return
 
+    def get_sub_presets(self):
+        """
+        Override this to return the other presets that this preset ticks and draws itself,
+        so that they count as playing while it does
+        """
+        return []
+
 
 class TestPreset(unittest.TestCase):
 
@@ -0,0 +1,158 @@
+import logging
+import time
+import numpy as np
+
+log = logging.getLogger("firemix.lib.profiling")
+
+SECTION_TICK = 0
+SECTION_DRAW = 1
+SECTION_FEATURE = 2
+SECTION_TRANSITION = 3
+
+SECTION_NAMES = ('tick', 'draw', 'on_feature', 'transition')
+
+SLOW_FRAME_DTYPE = np.dtype([('time', np.float64),
+                             ('section', np.int8),
+                             ('ms', np.float32),
+                             ('name', 'S64')])
+
+
+class Profile:
+    """
+    Timing statistics for one preset or transition instance.
+
+    The most recent durations of each section are kept in a fixed-size ring buffer,
+    alongside call counts, cumulative totals and the worst time seen.  All times are in ms.
+    For command-based presets, the number of commands drawn and culled (see
+    cull_occluded_commands) is counted as well.
+    """
+
+    def __init__(self, history=128):
+        self._history = np.zeros((len(SECTION_NAMES), history), dtype=np.float32)
+        self._position = np.zeros(len(SECTION_NAMES), dtype=np.int_)
+        self.counts = np.zeros(len(SECTION_NAMES), dtype=np.int64)
+        self.totals = np.zeros(len(SECTION_NAMES), dtype=np.float64)
+        self.worst = np.zeros(len(SECTION_NAMES), dtype=np.float32)
+        self.commands = 0
+        self.culled_commands = 0
+
+    def reset(self):
+        self._history[:] = 0.0
+        self._position[:] = 0
+        self.counts[:] = 0
+        self.totals[:] = 0.0
+        self.worst[:] = 0.0
+        self.commands = 0
+        self.culled_commands = 0
+
+    def record(self, section, ms):
+        position = self._position[section]
+        self._history[section, position] = ms
+        self._position[section] = (position + 1) % self._history.shape[1]
+        self.counts[section] += 1
+        self.totals[section] += ms
+        if ms > self.worst[section]:
+            self.worst[section] = ms
+
+    def record_culled(self, culled, commands):
+        self.commands += commands
+        self.culled_commands += culled
+
+    def recent(self, section):
+        """
+        Returns the durations held in the ring buffer for a section, oldest first
+        """
+        history = self._history.shape[1]
+        count = min(self.counts[section], history)
+        return np.roll(self._history[section], -self._position[section])[history - count:]
+
+    def mean(self, section):
+        if self.counts[section] == 0:
+            return 0.0
+        return self.totals[section] / self.counts[section]
+
+    def recent_mean(self, section):
+        recent = self.recent(section)
+        return float(recent.mean()) if len(recent) > 0 else 0.0
+
+    def cost(self):
+        """
+        Average time spent per frame (tick plus draw), used to rank presets
+        """
+        return self.mean(SECTION_TICK) + self.mean(SECTION_DRAW)
+
+
+class Profiler:
+    """
+    Times calls into presets and transitions.
+
+    Each instance gets its own Profile, created on first use.  Any call that takes longer
+    than slow_frame_ms is also added to a shared ring buffer of slow frames (and logged
+    if log_slow_frames is set).
+    """
+
+    def __init__(self, slow_frame_ms=30.0, history=128, slow_frame_history=256, log_slow_frames=False):
+        self.slow_frame_ms = slow_frame_ms
+        self.log_slow_frames = log_slow_frames
+        self._history = history
+        self._slow_frames = np.zeros(slow_frame_history, dtype=SLOW_FRAME_DTYPE)
+        self._slow_frame_position = 0
+        self._slow_frame_count = 0
+
+    def profile_for(self, owner):
+        profile = getattr(owner, '_profile', None)
+        if profile is None:
+            profile = Profile(self._history)
+            owner._profile = profile
+        return profile
+
+    def run(self, owner, section, function, *args):
+        """
+        Calls function(*args), recording its duration against owner, and returns its result
+        """
+        start = time.time()
+        result = function(*args)
+        ms = 1000.0 * (time.time() - start)
+
+        self.profile_for(owner).record(section, ms)
+        if ms > self.slow_frame_ms:
+            self._record_slow_frame(owner, section, ms)
+        return result
+
+    def _record_slow_frame(self, owner, section, ms):
+        name = repr(owner)
+        self._slow_frames[self._slow_frame_position] = (time.time(), section, ms, name[:64])
+        self._slow_frame_position = (self._slow_frame_position + 1) % len(self._slow_frames)
+        self._slow_frame_count += 1
+        if self.log_slow_frames:
+            log.info("%s slow %s: %d ms" % (name, SECTION_NAMES[section], ms))
+
+    def slow_frames(self):
+        """
+        Returns the slow frame records held in the ring buffer, oldest first
+        """
+        count = min(self._slow_frame_count, len(self._slow_frames))
+        return np.roll(self._slow_frames, -self._slow_frame_position)[len(self._slow_frames) - count:]
+
+    def clear_slow_frames(self):
+        self._slow_frame_position = 0
+        self._slow_frame_count = 0
+
+    def rank(self, owners):
+        """
+        Returns (owner, profile) pairs for the given presets, most expensive first.
+        Presets that have never been run are left out.
+        """
+        ranked = []
+        for owner in owners:
+            profile = getattr(owner, '_profile', None)
+            if profile is not None and profile.counts[SECTION_TICK] > 0:
+                ranked.append((owner, profile))
+        return sorted(ranked, key=lambda x: x[1].cost(), reverse=True)
+
+    def reset(self, owners):
+        for owner in owners:
+            profile = getattr(owner, '_profile', None)
+            if profile is not None:
+                profile.reset()
+        self.clear_slow_frames()
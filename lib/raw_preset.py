@@ -17,15 +17,18 @@ class RawPreset(Preset):
     _pixel_buffer = None
     _indices = None
     _max_strand, _max_fixture, _max_pixel = (0, 0, 0)
+    _defer_writes = False
+    _pending_indices = None
+    _pending_colors = None
 
     def __init__(self, mixer, name):
         Preset.__init__(self, mixer, name)
         self.init_pixels()
 
-    def _reset(self):
+    def _reset(self, seed=None):
         self.init_pixels()
         log.info("%s raw_preset _reset()" % self.__class__.__name__)
-        Preset._reset(self)
+        Preset._reset(self, seed)
 
     def init_pixels(self):
         """
@@ -33,6 +36,8 @@ class RawPreset(Preset):
         """
         (self._max_strand, self._max_fixture, self._max_pixel) = self.scene().get_matrix_extents()
         self._pixel_buffer = BufferUtils.create_buffer()
+        self._pending_indices = []
+        self._pending_colors = []
 
     def draw(self, dt):
         """
@@ -49,7 +54,11 @@ class RawPreset(Preset):
         return self._pixel_buffer[address]
 
     def setPixelHLS(self, index, color):
-        self._pixel_buffer[index] = color
+        if self._defer_writes:
+            self._pending_indices.append(np.asarray([index]))
+            self._pending_colors.append(np.asarray([color], dtype=np.float32))
+        else:
+            self._pixel_buffer[index] = color
         
     def setPixelRGB(self, index, color):
         self.setPixelHLS(index, colorsys.rgb_to_hls(*color))
@@ -60,6 +69,49 @@ class RawPreset(Preset):
 
         self.setPixelHLS(index, hls)
 
+    def set_pixels(self, indices, colors):
+        """
+        Writes HLS colors to the pixels at the given buffer indices in one assignment.
+        colors is either an (n, 3) array matching indices, or a single color for all of them.
+        """
+        if self._defer_writes:
+            indices = np.asarray(indices, dtype=np.int_).ravel()
+            colors = np.asarray(colors, dtype=np.float32)
+            if colors.ndim == 1:
+                colors = np.tile(colors, (len(indices), 1))
+            self._pending_indices.append(indices)
+            self._pending_colors.append(colors)
+        else:
+            self._pixel_buffer[indices] = colors
+
+    def set_pixels_fade(self, indices, fader, progress_array):
+        """
+        Writes colors from a ColorFade to the given pixels.  progress_array holds one
+        progress value (from 0 to the fader's number of steps) per pixel.
+        """
+        self.set_pixels(indices, fader.get_colors(progress_array))
+
+    def defer_writes(self, defer=True):
+        """
+        In deferred mode, pixel writes made during draw() are collected and applied to
+        the buffer in a single assignment once draw() returns.  Later writes to the same
+        pixel take precedence over earlier ones.
+        """
+        self._defer_writes = defer
+
+    def _flush_writes(self):
+        if len(self._pending_indices) == 0:
+            return
+
+        indices = np.concatenate(self._pending_indices)
+        colors = np.concatenate(self._pending_colors)
+        self._pending_indices = []
+        self._pending_colors = []
+
+        # Keep only the last write to each pixel
+        indices, last = np.unique(indices[::-1], return_index=True)
+        self._pixel_buffer[indices] = colors[::-1][last]
+
     def setAllHLS(self, hues, luminances, saturations):
         """
         Sets the entire buffer, assuming an input list.
@@ -79,11 +131,13 @@ class RawPreset(Preset):
         Unlike tick() in Preset, this method applies pixel_behavior to all pixels.
         """
 
-        for parameter in self._parameters.values():
-            parameter.tick(dt)
-        
+        self._tick_parameters(dt)
+
         self.draw(dt)
 
+        if self._defer_writes:
+            self._flush_writes()
+
         self._ticks += 1
 
     def draw_to_buffer(self, buffer):
@@ -1,11 +1,15 @@
 import os
 import math
+import unittest
 import logging
 import numpy as np
 
 from lib.json_dict import JSONDict
 from lib.fixture import Fixture
-from lib.buffer_utils import BufferUtils
+from lib.address_model import AddressModel
+from lib.pixel_graph import PixelGraph
+from lib.spatial_grid import SpatialGrid
+from lib.scene_compiler import SceneCompiler
 
 log = logging.getLogger("firemix.lib.scene")
 
@@ -21,39 +25,79 @@ class Scene(JSONDict):
         JSONDict.__init__(self, 'scene', self._filepath, False)
 
         self._fixtures = None
-        self._fixture_dict = {}
+        self._address_model = None
         self._fixture_hierarchy = None
         self._colliding_fixtures_cache = {}
-        self._pixel_neighbors_cache = {}
+        self._pixel_graph = None
+        self._pixel_grid = None
+        self._endpoint_grid = None
         self._pixel_locations_cache = {}
-        self._pixel_distance_cache = {}
         self._intersection_points = None
         self._all_pixels = None
         self._all_pixel_locations = None
         self._all_pixels_raw = None
+        self._bounding_box = None
+        self._compiled_tables = None
+
+    def get_compiled_tables(self):
+        """
+        Returns the tables saved by SceneCompiler for this scene, or None if it has not
+        been compiled yet
+        """
+        if self._compiled_tables is None:
+            self._compiled_tables = SceneCompiler.load(self) or {}
+        return self._compiled_tables or None
 
     def warmup(self):
         """
-        Warms up caches
+        Warms up caches.  If the scene has been compiled, they are loaded from the compiled
+        tables; otherwise they are computed and the scene is compiled for the next boot.
         """
         log.info("Warming up scene caches...")
+        tables = self.get_compiled_tables()
+        if tables is not None:
+            self._load_compiled_tables(tables)
+            log.info("Done")
+            return
+
+        self.get_endpoint_grid()
         fh = self.fixture_hierarchy()
         for strand in fh:
             for fixture in fh[strand]:
                 self.get_colliding_fixtures(strand, fixture)
-                for pixel in range(self.fixture(strand, fixture).pixels):
-                    index = BufferUtils.logical_to_index((strand, fixture, pixel))
-                    neighbors = self.get_pixel_neighbors(index)
+                start, end = self.get_address_model().fixture_extents(strand, fixture)
+                for index in xrange(start, end):
                     self.get_pixel_location(index)
-                    for neighbor in neighbors:
-                        self.get_pixel_distance(index, neighbor)
+        self.get_pixel_grid()
+        self.get_pixel_graph()
         self.get_fixture_bounding_box()
         self.get_intersection_points()
         self.get_all_pixels_logical()
         #self.get_all_pixels()
         #self.get_all_pixel_locations()
+
+        tables = SceneCompiler.compile(self)
+        try:
+            SceneCompiler.save(self, tables)
+        except (IOError, OSError) as e:
+            log.warn("Could not save compiled scene: %s" % e)
+        self._compiled_tables = tables
         log.info("Done")
 
+    def _load_compiled_tables(self, tables):
+        # Same rows as get_all_pixels(), which leaves out the unused end of the buffer
+        self._all_pixel_locations = tables["locations"][:self.get_address_model().num_pixels]
+        self._pixel_graph = PixelGraph(tables["graph_indptr"], tables["graph_indices"],
+                                       tables["graph_lengths"])
+        self._bounding_box = tuple(tables["bounding_box"].tolist())
+        self._intersection_points = [tuple(p) for p in tables["intersection_points"].tolist()]
+
+        indptr = tables["colliding_indptr"]
+        colliding = [tuple(c) for c in tables["colliding"].tolist()]
+        for i, (strand, address) in enumerate(tables["fixture_keys"].tolist()):
+            for row, loc in ((2 * i, 'start'), (2 * i + 1, 'end')):
+                self._colliding_fixtures_cache[(strand, address, loc)] = colliding[indptr[row]:indptr[row + 1]]
+
     def extents(self):
         """
         Returns the (x, y) extents of the scene.  Useful for determining
@@ -94,13 +138,16 @@ class Scene(JSONDict):
         """
         Returns a reference to a given fixture
         """
-        fix = self._fixture_dict.get((strand, address), None)
-        if fix is None:
-            for f in self.fixtures():
-                if f.strand == strand and f.address == address:
-                    fix = f
-                    self._fixture_dict[(strand, address)] = f
-        return fix
+        i = self.get_address_model().fixture_index(strand, address)
+        return self.fixtures()[i] if i >= 0 else None
+
+    def get_address_model(self):
+        """
+        Returns the AddressModel that lays out this scene's pixels in frame buffers
+        """
+        if self._address_model is None:
+            self._address_model = AddressModel(self.fixtures())
+        return self._address_model
 
     def fixture_hierarchy(self):
         """
@@ -155,60 +202,110 @@ class Scene(JSONDict):
 
         if colliding is None:
             colliding = []
-            r2 = pow(radius, 2)
+            fixtures = self.fixtures()
+            grid = self.get_endpoint_grid()
             x1, y1 = center
-            for tf in self.fixtures():
-                # Match start point
-                x2, y2 = tf.pos1
-                if pow(x2 - x1, 2) + pow(y2 - y1, 2) <= r2:
-                    #print tf, "collides with", strand, address
-                    colliding.append((tf.strand, tf.address, 0))
+            candidates = grid.bbox(x1 - radius, y1 - radius, x1 + radius, y1 + radius)
+            dx, dy = (grid.points[candidates] - (x1, y1)).T
+            hits = np.sort(candidates[dx * dx + dy * dy <= radius * radius])
+
+            # Endpoint 2i is the start of fixture i and 2i + 1 its end.  A fixture whose
+            # start matches is not checked for a match at its end.
+            previous = -1
+            for endpoint in hits:
+                if endpoint // 2 == previous:
                     continue
-                    # Match end point
-                x2, y2 = tf.pos2
-                if pow(x2 - x1, 2) + pow(y2 - y1, 2) <= r2:
-                    #print tf, "collides with", strand, address, "backwards"
-                    colliding.append((tf.strand, tf.address, tf.pixels - 1))
+                previous = endpoint // 2
+                tf = fixtures[previous]
+                colliding.append((tf.strand, tf.address, 0 if endpoint % 2 == 0 else tf.pixels - 1))
 
             self._colliding_fixtures_cache[(strand, address, loc)] = colliding
 
         return colliding
 
-    def get_pixel_neighbors(self, index):
+    def get_pixel_graph(self):
         """
-        Returns a list of pixel addresses that are adjacent to the given address.
+        Returns the PixelGraph (CSR adjacency) connecting every pixel in the scene to its neighbors
         """
+        if self._pixel_graph is None:
+            self._pixel_graph = self._build_pixel_graph()
+        return self._pixel_graph
 
-        neighbors = self._pixel_neighbors_cache.get(index, None)
+    def get_endpoint_grid(self):
+        """
+        Returns a SpatialGrid over the endpoints of every fixture in the scene.  Point 2i is
+        pos1 of fixtures()[i] and point 2i + 1 is its pos2.
+        """
+        if self._endpoint_grid is None:
+            endpoints = [pos for f in self.fixtures() for pos in (f.pos1, f.pos2)]
+            self._endpoint_grid = SpatialGrid(endpoints, cell_size=50)
+        return self._endpoint_grid
 
-        if neighbors is None:
-            neighbors = []
-            strand, address, pixel = BufferUtils.index_to_logical(index)
-            f = self.fixture(strand, address)
-            neighbors = [BufferUtils.logical_to_index((strand, address, p)) for p in f.pixel_neighbors(pixel)]
+    def get_pixel_grid(self):
+        """
+        Returns a SpatialGrid over the locations of every pixel in the scene, indexed like
+        get_all_pixel_locations()
+        """
+        if self._pixel_grid is None:
+            self._pixel_grid = SpatialGrid(self.get_all_pixel_locations())
+        return self._pixel_grid
+
+    def _build_pixel_graph(self):
+        """
+        Neighboring pixels along a fixture are adjacent, and the first and last pixel of each
+        fixture are also adjacent to the endpoints of any fixtures that collide with it.
+        """
+        model = self.get_address_model()
+        sources = []
+        targets = []
+        for f in self.fixtures():
+            start, end = model.fixture_extents(f.strand, f.address)
+            if f.pixels > 1:
+                # Pixels before and after, in that order
+                sources.append(np.arange(start + 1, end))
+                targets.append(np.arange(start, end - 1))
+                sources.append(np.arange(start, end - 1))
+                targets.append(np.arange(start + 1, end))
+
+            ends = [(start, 'start')]
+            if f.pixels > 1:
+                ends.append((end - 1, 'end'))
+            for index, loc in ends:
+                colliding = [model.index(*n) for n in self.get_colliding_fixtures(f.strand, f.address, loc)]
+                sources.append(np.repeat(index, len(colliding)))
+                targets.append(np.asarray(colliding, dtype=np.int_))
 
-            if (pixel == 0) or (pixel == f.pixels - 1):
-                # If this pixel is on the end of a fixture, consider the neighboring fixtures
-                loc = 'end'
-                if pixel == 0:
-                    loc = 'start'
+        sources = np.concatenate(sources).astype(np.int_) if sources else np.zeros(0, dtype=np.int_)
+        targets = np.concatenate(targets).astype(np.int_) if targets else np.zeros(0, dtype=np.int_)
 
-                logical_neighbors = self.get_colliding_fixtures(strand, address, loc)
-                neighbors += [BufferUtils.logical_to_index(n) for n in logical_neighbors]
+        # The buffer can be longer than the scene has pixels; the unused indices get no edges
+        num_pixels = model.buffer_length
+        locations = np.zeros((num_pixels, 2), dtype=np.float64)
+        for f in self.fixtures():
+            start, end = model.fixture_extents(f.strand, f.address)
+            locations[start:end] = [self.get_pixel_location(index) for index in xrange(start, end)]
+        lengths = np.hypot(*(locations[targets] - locations[sources]).T)
 
-            self._pixel_neighbors_cache[index] = neighbors
+        return PixelGraph.from_edges(num_pixels, sources, targets, lengths)
 
-        return neighbors
+    def get_pixel_neighbors(self, index):
+        """
+        Returns a list of pixel addresses that are adjacent to the given address.
+        """
+        return self.get_pixel_graph().neighbors(index).tolist()
 
     def get_pixel_location(self, index):
         """
         Returns a given pixel's location in scene coordinates.
         """
+        if self._compiled_tables:
+            return tuple(self._compiled_tables["locations"][index].tolist())
+
         loc = self._pixel_locations_cache.get(index, None)
 
         if loc is None:
 
-            strand, address, pixel = BufferUtils.index_to_logical(index)
+            strand, address, pixel = self.get_address_model().logical(index)
             f = self.fixture(strand, address)
 
             if pixel == 0:
@@ -230,14 +327,7 @@ class Scene(JSONDict):
         """
         Calculates the distance (in scene coordinate units) between two pixels
         """
-        dist = self._pixel_distance_cache.get((first, second), None)
-        if dist is None:
-            first_loc = self.get_pixel_location(first)
-            second_loc = self.get_pixel_location(second)
-            dist = self.get_point_distance(first_loc, second_loc)
-            self._pixel_distance_cache[(first, second)] = dist
-            self._pixel_distance_cache[(second, first)] = dist
-        return dist
+        return self.get_point_distance(self.get_pixel_location(first), self.get_pixel_location(second))
 
     def get_point_distance(self, first, second):
         return math.fabs(math.sqrt(math.pow(second[0] - first[0], 2) + math.pow(second[1] - first[1], 2)))
@@ -259,12 +349,8 @@ class Scene(JSONDict):
         Returns a list of all pixels in buffer address format (strand, offset)
         """
         if self._all_pixels_raw is None:
-            all_pixels = []
-            for s, a, p in self.get_all_pixels_logical():
-                #pxs.append(BufferUtils.get_buffer_address((s, a, p), scene=self))
-                all_pixels.append(BufferUtils.logical_to_index((s, a, p), scene=self))
-            all_pixels = sorted(all_pixels)
-            self._all_pixels_raw = all_pixels
+            # Pixels are packed at the front of the buffer in address order
+            self._all_pixels_raw = range(self.get_address_model().num_pixels)
 
         return self._all_pixels_raw
 
@@ -287,6 +373,9 @@ class Scene(JSONDict):
         Returns the bounding box containing all fixtures in the scene
         Return value is a tuple of (xmin, ymin, xmax, ymax)
         """
+        if self._bounding_box is not None:
+            return self._bounding_box
+
         xmin = 999999
         xmax = -999999
         ymin = 999999
@@ -295,8 +384,9 @@ class Scene(JSONDict):
         fh = self.fixture_hierarchy()
         for strand in fh:
             for fixture in fh[strand]:
-                for pixel in range(self.fixture(strand, fixture).pixels):
-                    x, y = self.get_pixel_location(BufferUtils.logical_to_index((strand, fixture, pixel)))
+                start, end = self.get_address_model().fixture_extents(strand, fixture)
+                for index in xrange(start, end):
+                    x, y = self.get_pixel_location(index)
                     if x < xmin:
                         xmin = x
                     if x > xmax:
@@ -306,15 +396,16 @@ class Scene(JSONDict):
                     if y > ymax:
                         ymax = y
 
-        return (xmin, ymin, xmax, ymax)
+        self._bounding_box = (xmin, ymin, xmax, ymax)
+        return self._bounding_box
 
     def get_intersection_points(self, threshold=50):
         """
         Returns a list of points in scene coordinates that represent the average location of
         each intersection of two or more fixture endpoints.
 
-        For each fixture endpoint, all other endpoints are compared to see if they fall within a certain distance
-        of the given endpoint.  This loop generates a list of groups.  Then, the average location of each
+        For each fixture endpoint, the endpoint grid is queried for other endpoints that fall within a certain
+        distance of the given endpoint.  This loop generates a list of groups.  Then, the average location of each
         group is calculated and returned.
         """
         if self._intersection_points is None:
@@ -324,19 +415,19 @@ class Scene(JSONDict):
                 endpoints.append(f.pos1)
                 endpoints.append(f.pos2)
 
+            # Starting from the last endpoint, each ungrouped endpoint collects the ungrouped
+            # endpoints near it into a new group
+            grid = self.get_endpoint_grid()
+            grouped = np.zeros(len(endpoints), dtype=bool)
             groups = []
-            while len(endpoints) > 0:
-                endpoint = endpoints.pop()
-                group = [endpoint]
-                to_remove = []
-                for other in endpoints:
-                    dx, dy = (other[0] - endpoint[0], other[1] - endpoint[1])
-                    dist = math.fabs(math.sqrt(math.pow(dx, 2) + math.pow(dy, 2)))
-                    if (dist < threshold):
-                        group.append(other)
-                        to_remove.append(other)
-                endpoints = [e for e in endpoints if e not in to_remove]
-                groups.append(group)
+            for i in reversed(xrange(len(endpoints))):
+                if grouped[i]:
+                    continue
+                grouped[i] = True
+                members = grid.radius(endpoints[i], threshold)
+                members = np.sort(members[~grouped[members]])
+                grouped[members] = True
+                groups.append([endpoints[i]] + [endpoints[j] for j in members])
 
             centroids = []
             for group in groups:
@@ -349,4 +440,44 @@ class Scene(JSONDict):
                 centroids.append((tx / num_points, ty / num_points))
             self._intersection_points = centroids
 
-        return self._intersection_points
\ No newline at end of file
+        return self._intersection_points
+
+class TestScene(unittest.TestCase):
+
+    class _App:
+        class args:
+            scene = "demo"
+
+    def load_scene(self, pixels=None):
+        """
+        Loads the demo scene, optionally with the first fixture cut to the given number of
+        pixels so that the fixtures are not all the same length
+        """
+        scene = Scene(self._App())
+        if pixels is not None:
+            scene.data["fixtures"][0]["pixels"] = pixels
+        return scene
+
+    def check_pixel_graph(self, scene):
+        model = scene.get_address_model()
+        graph = scene.get_pixel_graph()
+        self.assertEqual(len(graph), model.buffer_length)
+        self.assertFalse(graph.degree[model.num_pixels:].any())
+        self.assertTrue((graph.indices < model.num_pixels).all())
+
+        for f in scene.fixtures():
+            start, end = model.fixture_extents(f.strand, f.address)
+            for index in xrange(start + 1, end - 1):
+                neighbors = graph.neighbors(index).tolist()
+                self.assertEqual(neighbors, [index - 1, index + 1])
+                expected = [scene.get_pixel_distance(index, n) for n in neighbors]
+                np.testing.assert_allclose(graph.edge_lengths(index), expected, rtol=1e-5)
+
+    def test_pixel_graph(self):
+        self.check_pixel_graph(self.load_scene())
+
+    def test_pixel_graph_ragged(self):
+        scene = self.load_scene(pixels=16)
+        model = scene.get_address_model()
+        self.assertLess(model.num_pixels, model.buffer_length)
+        self.check_pixel_graph(scene)
@@ -0,0 +1,112 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+
+log = logging.getLogger("firemix.lib.scene_compiler")
+
+# Bump this when the compiled tables change, so that old files are ignored
+COMPILER_VERSION = 1
+
+
+class SceneCompiler:
+    """
+    Saves the tables that Scene.warmup() derives from a scene's
+    fixtures in a single .npz file, so that later boots load them instead of walking
+    every pixel in Python.
+
+    Files live in data/cache/scenes and are keyed by a hash of the scene geometry (the
+    fixtures, extents and center), so editing other scene settings does not force a
+    recompile.  The tables are:
+
+        fixture_keys        (strand, address) of each fixture, in Scene.fixtures() order
+        locations           (x, y) of each buffer index
+        graph_*             the PixelGraph arrays (indptr, indices, lengths)
+        colliding_*         the colliding fixtures at the start (row 2i) and end (row 2i + 1)
+                            of each fixture, in CSR form
+        bounding_box        (xmin, ymin, xmax, ymax)
+        intersection_points (x, y) of each intersection
+    """
+
+    @classmethod
+    def cache_path(cls, scene):
+        geometry = json.dumps({"fixtures": scene.data.get("fixtures", []),
+                               "extents": scene.data.get("extents", None),
+                               "center": scene.data.get("center", None)}, sort_keys=True)
+        digest = hashlib.sha1(geometry).hexdigest()
+        name = os.path.splitext(os.path.basename(scene.filename))[0]
+        filename = "%s-%s-%d.npz" % (name, digest, COMPILER_VERSION)
+        return os.path.join(os.getcwd(), "data", "cache", "scenes", filename)
+
+    @classmethod
+    def load(cls, scene):
+        """
+        Returns the compiled tables for the scene as a dict of arrays, or None if it has
+        not been compiled yet
+        """
+        path = cls.cache_path(scene)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                tables = dict((key, data[key]) for key in data.files)
+        except Exception as e:
+            log.warn("Could not load compiled scene %s: %s" % (path, e))
+            return None
+        log.info("Loaded compiled scene from %s" % path)
+        return tables
+
+    @classmethod
+    def compile(cls, scene):
+        """
+        Returns the tables for a scene whose caches are warmed up
+        """
+        fixtures = scene.fixtures()
+        model = scene.get_address_model()
+        num_pixels = model.buffer_length
+
+        fixture_keys = np.array([(f.strand, f.address) for f in fixtures], dtype=np.int_).reshape(-1, 2)
+
+        # Buffers can be longer than the scene has pixels; unused indices are left at 0
+        locations = np.zeros((num_pixels, 2), dtype=np.float64)
+        for f in fixtures:
+            start, end = model.fixture_extents(f.strand, f.address)
+            locations[start:end] = [scene.get_pixel_location(index) for index in xrange(start, end)]
+
+        colliding = []
+        colliding_counts = []
+        for f in fixtures:
+            for loc in ('start', 'end'):
+                addresses = scene.get_colliding_fixtures(f.strand, f.address, loc)
+                colliding.extend(addresses)
+                colliding_counts.append(len(addresses))
+        colliding_indptr = np.zeros(len(colliding_counts) + 1, dtype=np.int_)
+        np.cumsum(colliding_counts, out=colliding_indptr[1:])
+
+        graph = scene.get_pixel_graph()
+
+        return {
+            "fixture_keys": fixture_keys,
+            "locations": locations,
+            "graph_indptr": graph.indptr,
+            "graph_indices": graph.indices,
+            "graph_lengths": graph.lengths,
+            "colliding_indptr": colliding_indptr,
+            "colliding": np.array(colliding, dtype=np.int_).reshape(-1, 3),
+            "bounding_box": np.array(scene.get_fixture_bounding_box(), dtype=np.float64),
+            "intersection_points": np.array(scene.get_intersection_points(), dtype=np.float64).reshape(-1, 2),
+        }
+
+    @classmethod
+    def save(cls, scene, tables):
+        path = cls.cache_path(scene)
+        cache_dir = os.path.dirname(path)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # Write to a temporary name so a partial file is never picked up
+        temp_path = path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **tables)
+        os.rename(temp_path, path)
+        log.info("Compiled scene to %s" % path)
@@ -0,0 +1,275 @@
+import ctypes
+import logging
+import multiprocessing
+import numpy as np
+
+from lib.scene import Scene
+from lib.buffer_utils import BufferUtils
+from lib.audio_emitter import AudioEmitter
+from lib.modulation import ModulationEngine
+
+log = logging.getLogger("firemix.lib.shard_renderer")
+
+# Seconds to wait for a shard to finish a frame before giving up on sharding
+SHARD_TIMEOUT = 5.0
+
+
+class ShardScene(Scene):
+    """
+    The part of a scene on strands first_strand up to (but not including) last_strand.
+
+    Pixel indices start at the first pixel of first_strand, which is index start of the
+    full scene's buffers.  The center and bounding box are those of the full scene, so
+    presets see the same geometry as they do in the mixer.  Strands outside the range are
+    disabled in the strand settings, and the scene is never saved over the full one.
+    """
+
+    def __init__(self, scene, first_strand, last_strand):
+        Scene.__init__(self, scene._app)
+        self.data = dict(scene.data)
+        self.data["fixtures"] = [fd for fd in scene.data["fixtures"]
+                                 if first_strand <= fd.get("strand", 0) < last_strand]
+        self.data["strand-settings"] = [dict(settings, enabled=(settings.get("enabled", False) and
+                                                                first_strand <= strand < last_strand))
+                                        for strand, settings in enumerate(scene.get_strand_settings())]
+        self.data["center"] = list(scene.center_point())
+        self._scene_bounding_box = scene.get_fixture_bounding_box()
+
+    def get_fixture_bounding_box(self):
+        return self._scene_bounding_box
+
+    def save(self):
+        log.warn("Not saving the scene, since only strands of it are loaded")
+
+
+class ShardMixer:
+    """
+    Stands in for the Mixer in a shard process.  Presets see the shard's scene, and the
+    onset flag, clock and features of the frame the shard is rendering.
+    """
+
+    def __init__(self, scene, tick_rate):
+        self._scene = scene
+        self._tick_rate = tick_rate
+        self._enable_profiling = False
+        self._onset = False
+        self._audio_emitters_by_group = {}
+        self.modulation = ModulationEngine()
+        self.frame_number = 0
+        self.clock = 0.0
+
+    def scene(self):
+        return self._scene
+
+    def get_tick_rate(self):
+        return self._tick_rate
+
+    def is_paused(self):
+        return False
+
+    def is_onset(self):
+        return self._onset
+
+    def layer_by_name(self, name):
+        return None
+
+    def audio_emitter(self, group):
+        audio_emitter = self._audio_emitters_by_group.get(group, None)
+        if audio_emitter is None:
+            audio_emitter = AudioEmitter(group)
+            self._audio_emitters_by_group[group] = audio_emitter
+            cx, cy = self._scene.center_point()
+            audio_emitter.set_target_position((cx, cy, 0))
+        return audio_emitter
+
+    def feature_received(self, feature):
+        self.audio_emitter(feature['group']).on_feature_update(feature['feature'], feature)
+
+
+def _run_shard(scene, first_strand, last_strand, tick_rate, frame_array, start, end, connection):
+    """
+    Main loop of a shard process.  Each message from the mixer is a frame to render (see
+    ShardRenderer.render), answered with (frame number, error, state) once the shard's
+    pixels of the frame have been written, where state holds the preset's shard_state
+    attributes; or None to exit.
+    """
+    shard_scene = ShardScene(scene, first_strand, last_strand)
+    shard_scene.warmup()
+    BufferUtils.init(shard_scene)
+    mixer = ShardMixer(shard_scene, tick_rate)
+    frame = np.frombuffer(frame_array, dtype=np.float32).reshape(-1, 3)
+    buffer = BufferUtils.create_buffer()
+    presets = {}
+
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if message is None:
+            return
+
+        (frame_number, clock, dt, onset, features, preset_class, name, reset_count,
+         parameters) = message
+        try:
+            mixer.frame_number = frame_number
+            mixer.clock = clock
+            mixer._onset = onset
+
+            # Presets are created the first time they are rendered, and reset along with
+            # their counterparts in the mixer
+            preset, seen_resets = presets.get(name, (None, None))
+            if preset is None or preset.__class__ is not preset_class:
+                preset = preset_class(mixer, name=name)
+                preset._reset()
+            elif seen_resets != reset_count:
+                preset._reset()
+            presets[name] = (preset, reset_count)
+
+            for key, value in parameters.iteritems():
+                parameter = preset.parameter(key)
+                if parameter is not None and parameter.get() != value:
+                    parameter.set(value)
+
+            for feature in features:
+                mixer.feature_received(feature)
+                preset.on_feature(feature)
+
+            preset.clear_commands()
+            preset.tick(dt)
+            output = preset.draw_to_buffer(buffer)
+            frame[start:end] = output[:end - start]
+            state = dict((key, getattr(preset, key)) for key in ('_ticks',) + preset.shard_state)
+            connection.send((frame_number, None, state))
+        except Exception as e:
+            log.exception("Shard %d-%d failed to render %s" % (first_strand, last_strand, name))
+            connection.send((frame_number, repr(e), None))
+
+
+class ShardRenderer:
+    """
+    Renders presets on several processes, each handling the pixels of a range of strands.
+
+    The mixer's pixel buffer is split into ranges of whole strands holding about the same
+    number of pixels.  Each shard process keeps its own instances of the presets it has
+    rendered, built against a ShardScene, and writes its pixels into a frame buffer in
+    shared memory.  Frames carry the mixer's virtual clock, dt, onset flag, the features
+    received since the last frame and the preset's parameter values, so every shard steps
+    its presets in lockstep with the others.  The mixer's own instance of a preset is not
+    ticked while it is sharded; instead its shard_state attributes are copied back from the
+    shards after each frame, so it picks up where they left off if sharding stops.
+
+    Only presets that are pure per-pixel functions can be rendered this way; see
+    Preset.shardable.
+    """
+
+    def __init__(self, scene, num_shards, tick_rate):
+        model = scene.get_address_model()
+        self._frame_array = multiprocessing.RawArray(ctypes.c_float, int(model.buffer_length) * 3)
+        self.frame = np.frombuffer(self._frame_array, dtype=np.float32).reshape(-1, 3)
+        self._features = []
+        self._frame_features = []
+        self.frame_number = 0
+        self.clock = 0.0
+        self._running = True
+
+        self._shards = []
+        strands = self.strand_ranges(model, num_shards)
+        for first, last in strands:
+            start, end = int(model.strand_offsets[first]), int(model.strand_offsets[last])
+            connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_run_shard, name="shard-%d-%d" % (first, last),
+                                              args=(scene, first, last, tick_rate, self._frame_array,
+                                                    start, end, child_connection))
+            process.daemon = True
+            process.start()
+            self._shards.append((process, connection))
+        log.info("Rendering on %d shards (strands %s)" % (len(self._shards), strands))
+
+    @staticmethod
+    def strand_ranges(model, num_shards):
+        """
+        Returns (first, last) strand ranges splitting the model's pixels into at most
+        num_shards parts of about the same size.  Empty ranges are left out.
+        """
+        offsets = model.strand_offsets
+        targets = model.num_pixels * np.arange(1, num_shards) / float(num_shards)
+        bounds = np.concatenate(([0], np.searchsorted(offsets, targets), [len(offsets) - 1]))
+        bounds = np.unique(bounds)
+        return [(int(first), int(last)) for first, last in zip(bounds[:-1], bounds[1:])
+                if offsets[last] > offsets[first]]
+
+    def is_running(self):
+        return self._running
+
+    def advance(self, dt):
+        """
+        Advances the virtual clock.  Called by the mixer once per tick.  The features received
+        since the last tick go to every preset rendered in this frame.
+        """
+        self.frame_number += 1
+        self.clock += dt
+        self._frame_features = self._features
+        self._features = []
+
+    def feature_received(self, feature):
+        self._features.append(feature)
+
+    def render(self, preset, dt, onset):
+        """
+        Ticks preset on every shard and copies the assembled frame into the preset's pixel
+        buffer.  Returns False if sharding is stopped or a shard failed, in which case the
+        caller should tick the preset itself.
+        """
+        if not self._running:
+            return False
+
+        parameters = dict((key, parameter.get()) for key, parameter in preset.get_parameters().iteritems())
+        message = (self.frame_number, self.clock, dt, onset, self._frame_features, preset.__class__,
+                   preset.get_name(), preset._reset_count, parameters)
+
+        for process, connection in self._shards:
+            try:
+                connection.send(message)
+            except (IOError, OSError) as e:
+                log.error("Shard %s is gone (%s); rendering without shards" % (process.name, e))
+                self.stop()
+                return False
+
+        shard_state = None
+        for process, connection in self._shards:
+            try:
+                if not connection.poll(SHARD_TIMEOUT):
+                    log.error("Shard %s timed out; rendering without shards" % process.name)
+                    self.stop()
+                    return False
+                frame_number, error, state = connection.recv()
+            except (EOFError, IOError, OSError) as e:
+                log.error("Shard %s is gone (%s); rendering without shards" % (process.name, e))
+                self.stop()
+                return False
+            if error is not None or frame_number != self.frame_number:
+                log.error("Shard %s failed (%s); rendering without shards" % (process.name, error))
+                self.stop()
+                return False
+            if shard_state is None:
+                shard_state = state
+
+        for key, value in shard_state.iteritems():
+            setattr(preset, key, value)
+        np.copyto(preset.get_buffer(), self.frame)
+        return True
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        for process, connection in self._shards:
+            try:
+                connection.send(None)
+            except (IOError, OSError):
+                pass
+        for process, connection in self._shards:
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,107 @@
+"""
+Vectorized 3D simplex noise.
+
+This is the algorithm in ext/simplexnoise.py (Stefan Gustavson's, via Eliot Eshelman),
+evaluated over whole numpy arrays of coordinates at once.  Cells are located with floor()
+rather than int(), so the field is also continuous across negative coordinates.
+"""
+
+import numpy as np
+
+from ext.simplexnoise import SimplexNoiseTools
+
+_PERM = np.asarray(SimplexNoiseTools._perm, dtype=np.int_)
+_GRAD3 = np.asarray(SimplexNoiseTools._grad3, dtype=np.float64)
+
+_F3 = 1.0 / 3.0
+_G3 = 1.0 / 6.0
+
+
+def _corner(gi, x, y, z):
+    t = 0.6 - x * x - y * y - z * z
+    g = _GRAD3[gi]
+    n = t * t * t * t * (g[..., 0] * x + g[..., 1] * y + g[..., 2] * z)
+    return np.where(t < 0, 0.0, n)
+
+
+def raw_noise_3d(x, y, z):
+    """
+    3D raw simplex noise of broadcastable coordinate arrays, in the range [-1, 1]
+    """
+    x, y, z = np.broadcast_arrays(np.asarray(x, dtype=np.float64),
+                                  np.asarray(y, dtype=np.float64),
+                                  np.asarray(z, dtype=np.float64))
+
+    # Skew the input space to determine which simplex cell we're in
+    s = (x + y + z) * _F3
+    i = np.floor(x + s)
+    j = np.floor(y + s)
+    k = np.floor(z + s)
+
+    # Unskew the cell origin back to (x, y, z) space
+    t = (i + j + k) * _G3
+    x0 = x - (i - t)
+    y0 = y - (j - t)
+    z0 = z - (k - t)
+
+    # Determine which of the six tetrahedra we are in.  The second corner is offset by one
+    # along the largest coordinate, and the third along the two largest.
+    x_ge_y = x0 >= y0
+    y_ge_z = y0 >= z0
+    x_ge_z = x0 >= z0
+
+    i1 = (x_ge_y & x_ge_z).astype(np.int_)
+    j1 = (~x_ge_y & y_ge_z).astype(np.int_)
+    k1 = 1 - i1 - j1
+    i2 = (x_ge_y | (y_ge_z & x_ge_z)).astype(np.int_)
+    j2 = (~x_ge_y | y_ge_z).astype(np.int_)
+    k2 = 2 - i2 - j2
+
+    x1 = x0 - i1 + _G3
+    y1 = y0 - j1 + _G3
+    z1 = z0 - k1 + _G3
+    x2 = x0 - i2 + 2.0 * _G3
+    y2 = y0 - j2 + 2.0 * _G3
+    z2 = z0 - k2 + 2.0 * _G3
+    x3 = x0 - 1.0 + 3.0 * _G3
+    y3 = y0 - 1.0 + 3.0 * _G3
+    z3 = z0 - 1.0 + 3.0 * _G3
+
+    # Hashed gradient indices of the four corners
+    ii = i.astype(np.int_) & 255
+    jj = j.astype(np.int_) & 255
+    kk = k.astype(np.int_) & 255
+    gi0 = _PERM[ii + _PERM[jj + _PERM[kk]]] % 12
+    gi1 = _PERM[ii + i1 + _PERM[jj + j1 + _PERM[kk + k1]]] % 12
+    gi2 = _PERM[ii + i2 + _PERM[jj + j2 + _PERM[kk + k2]]] % 12
+    gi3 = _PERM[ii + 1 + _PERM[jj + 1 + _PERM[kk + 1]]] % 12
+
+    # Sum the corner contributions, scaled to stay just inside [-1, 1]
+    return 32.0 * (_corner(gi0, x0, y0, z0) + _corner(gi1, x1, y1, z1) +
+                   _corner(gi2, x2, y2, z2) + _corner(gi3, x3, y3, z3))
+
+
+def snoise3(x, y, z, octaves=1, persistence=0.5, lacunarity=2.0):
+    """
+    Multi-octave 3D simplex noise over arrays, in the range [-1, 1].  Each octave is
+    lacunarity times the frequency and persistence times the amplitude of the previous one.
+    The arguments follow snoise3 from the noise package, so calls can be switched directly.
+    """
+    if octaves == 1:
+        return raw_noise_3d(x, y, z)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+
+    total = 0.0
+    frequency = 1.0
+    amplitude = 1.0
+    max_amplitude = 0.0
+    for i in xrange(octaves):
+        total = total + raw_noise_3d(x * frequency, y * frequency, z * frequency) * amplitude
+        max_amplitude += amplitude
+        frequency *= lacunarity
+        amplitude *= persistence
+
+    return total / max_amplitude
@@ -0,0 +1,166 @@
+import numpy as np
+
+
+class SpatialGrid:
+    """
+    A uniform grid over a set of 2D points, for finding the points near a location without
+    measuring the distance to all of them.
+
+    Points are bucketed into square cells of cell_size scene units.  The point indices of
+    cell c are order[cell_indptr[c]:cell_indptr[c + 1]], with cells numbered row-major
+    (c = cx * shape[1] + cy).  Queries first select the cells that can overlap the query
+    shape and then test only the points in those cells.
+    """
+
+    def __init__(self, points, cell_size=None):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        num_points = len(self.points)
+
+        if num_points > 0:
+            self.origin = self.points.min(axis=0)
+            span = self.points.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            span = np.zeros(2)
+
+        if cell_size is None:
+            # About four points per cell if the points were spread evenly
+            area = max(span[0], 1.0) * max(span[1], 1.0)
+            cell_size = 2.0 * np.sqrt(area / max(num_points, 1))
+        self.cell_size = float(cell_size)
+
+        self.shape = (np.floor(span / self.cell_size).astype(np.int_) + 1)
+        cx, cy = self._cell_coords(self.points)
+        cells = cx * self.shape[1] + cy
+
+        self.order = np.argsort(cells, kind='mergesort')
+        self.cell_indptr = np.zeros(self.shape[0] * self.shape[1] + 1, dtype=np.int_)
+        np.cumsum(np.bincount(cells, minlength=self.shape[0] * self.shape[1]),
+                  out=self.cell_indptr[1:])
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell_coords(self, points):
+        coords = np.floor((points - self.origin) / self.cell_size).astype(np.int_)
+        return coords[:, 0], coords[:, 1]
+
+    def _points_in_cells(self, cells):
+        """
+        Returns (positions, points): for every point in the given cells, its position in
+        cells and its index
+        """
+        starts = self.cell_indptr[cells]
+        counts = self.cell_indptr[cells + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return np.repeat(np.arange(len(cells)), counts), self.order[offsets]
+
+    def annuli(self, centers, inner, outer):
+        """
+        Runs many annulus queries at once.  centers is an (n, 2) array and inner and outer
+        are length-n arrays (or single values).  Returns (owners, points, distances) listing
+        every point within inner < d < outer of a center, where owners holds the query each
+        point belongs to.
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        inner = np.zeros(len(centers)) + inner
+        outer = np.zeros(len(centers)) + outer
+        cell = self.cell_size
+
+        # The columns of cells overlapping each query's bounding box
+        first = np.maximum(np.floor((centers[:, 0] - outer - self.origin[0]) / cell), 0).astype(np.int_)
+        last = np.minimum(np.floor((centers[:, 0] + outer - self.origin[0]) / cell),
+                          self.shape[0] - 1).astype(np.int_)
+        counts = np.maximum(last - first + 1, 0)
+        queries = np.repeat(np.arange(len(centers)), counts)
+        columns = (first[queries] + np.arange(counts.sum()) -
+                   np.repeat(np.cumsum(counts) - counts, counts))
+
+        # Within a column, the annulus covers at most two runs of rows: the outer circle
+        # minus the part that is inside the inner circle across the whole column
+        x, y = centers[queries].T
+        x0 = self.origin[0] + columns * cell
+        near = np.maximum(np.maximum(x0 - x, x - x0 - cell), 0.0)
+        far = np.maximum(np.abs(x - x0), np.abs(x - x0 - cell))
+        reach = np.sqrt(np.maximum(outer[queries] ** 2 - near ** 2, 0.0))
+        hole = np.where(inner[queries] > 0, np.sqrt(np.maximum(inner[queries] ** 2 - far ** 2, 0.0)), 0.0)
+        reach[near >= outer[queries]] = np.nan
+
+        def row(v):
+            return np.floor((v - self.origin[1]) / cell)
+
+        below = (np.maximum(row(y - reach), 0), np.minimum(row(y - hole), self.shape[1] - 1))
+        above = (np.maximum(np.maximum(row(y + hole), below[1] + 1), 0),
+                 np.minimum(row(y + reach), self.shape[1] - 1))
+        run_start = np.concatenate((below[0], above[0]))
+        run_end = np.concatenate((below[1], above[1]))
+        # Columns out of reach have NaN bounds, and so no rows
+        run_counts = np.nan_to_num(np.maximum(run_end - run_start + 1, 0)).astype(np.int_)
+        run_start = np.nan_to_num(run_start).astype(np.int_)
+        run_queries = np.concatenate((queries, queries))
+        run_columns = np.concatenate((columns, columns))
+
+        # One row per (query, cell) pair
+        cell_queries = np.repeat(run_queries, run_counts)
+        rows = (np.repeat(run_start, run_counts) + np.arange(run_counts.sum()) -
+                np.repeat(np.cumsum(run_counts) - run_counts, run_counts))
+        cells = np.repeat(run_columns, run_counts) * self.shape[1] + rows
+
+        positions, points = self._points_in_cells(cells)
+        owners = cell_queries[positions]
+        distances = np.hypot(*(self.points[points] - centers[owners]).T)
+        hits = (distances > inner[owners]) & (distances < outer[owners])
+        return owners[hits], points[hits], distances[hits]
+
+    def annulus(self, center, inner, outer):
+        """
+        Returns the indices of the points whose distance d from center satisfies
+        inner < d < outer, and those distances.  Cells that lie entirely inside the inner
+        circle are skipped without testing their points.
+        """
+        owners, points, distances = self.annuli([center], inner, outer)
+        return points, distances
+
+    def radius(self, center, radius):
+        """
+        Returns the indices of the points closer than radius to center
+        """
+        return self.annulus(center, -1.0, radius)[0]
+
+    def bbox(self, xmin, ymin, xmax, ymax):
+        """
+        Returns the indices of the points inside a bounding box (including its edges)
+        """
+        lo = np.floor((np.array([xmin, ymin]) - self.origin) / self.cell_size)
+        hi = np.floor((np.array([xmax, ymax]) - self.origin) / self.cell_size)
+        lo = np.maximum(lo, 0).astype(np.int_)
+        hi = np.minimum(hi, self.shape - 1).astype(np.int_)
+        if (hi < lo).any():
+            return np.zeros(0, dtype=np.int_)
+
+        cx, cy = np.meshgrid(np.arange(lo[0], hi[0] + 1), np.arange(lo[1], hi[1] + 1), indexing='ij')
+        points = self._points_in_cells((cx * self.shape[1] + cy).ravel())[1]
+        x, y = self.points[points].T
+        return points[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)]
+
+    def nearest(self, center, k=1):
+        """
+        Returns the indices of the k points nearest to center, nearest first
+        """
+        center = np.asarray(center, dtype=np.float64)
+        k = min(k, len(self.points))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int_)
+
+        # Widen the search until it holds k points; those are then the k nearest
+        corner = self.origin + self.shape * self.cell_size
+        farthest = np.hypot(*np.maximum(np.abs(center - self.origin), np.abs(center - corner)))
+        radius = self.cell_size
+        while True:
+            points, distances = self.annulus(center, -1.0, radius)
+            if len(points) >= k or radius > farthest:
+                break
+            radius *= 2.0
+
+        order = np.argsort(distances, kind='mergesort')[:k]
+        return points[order]
@@ -8,6 +8,10 @@ class Transition:
     Given two numpy arrays and a progress (0 to 1.0), it produces one output array.
     """
 
+    # The color spaces (see Preset.color_space) the transition can blend in.  Presets that
+    # do not share one of them are converted to HLS before the transition sees them.
+    color_spaces = ('HLS',)
+
     def __init__(self, app):
         self._app = app
 
@@ -8,6 +8,9 @@ class FixtureStep(Transition):
     """
     """
 
+    # Switches whole fixtures from start to end, in either color space
+    color_spaces = ('HLS', 'RGB')
+
     def __init__(self, app):
         Transition.__init__(self, app)
 
@@ -19,7 +22,6 @@ class FixtureStep(Transition):
         buffer_size = BufferUtils.get_buffer_size()
         self.mask = np.tile(False, (buffer_size, 3))
 
-        np.random.seed()
         self.rand_index = np.arange(len(self.fixtures))
         np.random.shuffle(self.rand_index)
 
@@ -8,6 +8,8 @@ class FixtureStrobe(Transition):
     """
     """
 
+    color_spaces = ('HLS', 'RGB')
+
     def __init__(self, app):
         Transition.__init__(self, app)
         self._strobing = []
@@ -23,7 +25,6 @@ class FixtureStrobe(Transition):
         buffer_size = BufferUtils.get_buffer_size()
         self.mask = np.tile(False, (buffer_size, 3))
 
-        np.random.seed()
         self.rand_index = np.arange(len(self.fixtures))
         np.random.shuffle(self.rand_index)
 
@@ -8,6 +8,9 @@ class Fuzz(Transition):
     """
     """
 
+    # Pixels switch from start to end with their colors untouched
+    color_spaces = ('HLS', 'RGB')
+
     def __init__(self, app):
         Transition.__init__(self, app)
 
@@ -19,7 +22,6 @@ class Fuzz(Transition):
         self.mask = np.tile(False, (self.buffer_size, 3))
 
         num_elements = np.ndarray.flatten(self.mask).size / 3
-        np.random.seed()
         self.rand_index = np.arange(num_elements)
         np.random.shuffle(self.rand_index)
 
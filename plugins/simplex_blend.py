@@ -1,9 +1,10 @@
 import numpy as np
 from math import fabs
-from noise import snoise3
 
 from lib.transition import Transition
 from lib.buffer_utils import BufferUtils
+from lib.simplex import snoise3
+from lib.noise_volume import NoiseVolume
 
 
 class SimplexBlend(Transition):
@@ -11,6 +12,9 @@ class SimplexBlend(Transition):
     Blends using a simplex noise mask
     """
 
+    # A linear mix, which is as valid in RGB as in HLS
+    color_spaces = ('HLS', 'RGB')
+
     def __init__(self, app):
         Transition.__init__(self, app)
 
@@ -21,11 +25,18 @@ class SimplexBlend(Transition):
         buffer_size = BufferUtils.get_buffer_size()
         self.frame = np.tile(0.0, (buffer_size, 3))
         self.pixel_locations = self._app.scene.get_all_pixel_locations()
+        if self._app.settings.get('mixer').get('noise-cache', False):
+            self.noise = NoiseVolume.get().sample
+        else:
+            self.noise = snoise3
 
     def get(self, start, end, progress):
-        for pixel, loc in enumerate(self.pixel_locations):
-            blend = (1.0 + snoise3(0.01 * loc[0], 0.01 * loc[1], progress, 1, 0.5, 0.5)) / 2.0
-            self.frame[pixel] = blend * start[pixel] + ((1.0 - blend) * end[pixel])
+        blend = (1.0 + self.noise(0.01 * self.pixel_locations[:, 0], 0.01 * self.pixel_locations[:, 1],
+                                  progress)) / 2.0
+        # The buffers may be longer than the scene's pixel list; the rest of the frame stays black
+        blend = blend[:, np.newaxis]
+        n = len(blend)
+        self.frame[:n] = blend * start[:n] + ((1.0 - blend) * end[:n])
 
         # Mix = 1.0 when progress = 0.5, 0.0 at either extreme
         mix = 1.0 - fabs(2.0 * (progress - 0.5))
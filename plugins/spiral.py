@@ -11,6 +11,9 @@ class Spiral(Transition):
     Spiral wipe
     """
 
+    # Only masks pixels, so RGB presets need no conversion
+    color_spaces = ('HLS', 'RGB')
+
     def __init__(self, app):
         Transition.__init__(self, app)
         self.revolutions = 3
@@ -5,17 +5,19 @@ from collections import defaultdict
 from lib.raw_preset import RawPreset
 from lib.parameters import StringParameter, FloatParameter, HLSParameter, IntParameter
 from lib.color_fade import ColorFade
+from lib.particles import Particles
 
 class PositionPulser(RawPreset):
     class AudioEmitterPulser(object):
-        def __init__(self, audio_emitter, fade_colors, fade_steps):
+        def __init__(self, audio_emitter, slot):
             self.audio_emitter = audio_emitter
-            self._fader = ColorFade(fade_colors, fade_steps)
+            # The pulser's disc in self._particles
+            self.slot = slot
             self.value = 0.0
-            self.color = 0
 
     def setup(self):
         self.audio_emitter_pulsers = {}
+        self._particles = Particles(self.scene())
         self.add_parameter(StringParameter('feature', 'vumeter'))
         self.feature = self.parameter('feature').get()
         self.add_parameter(FloatParameter('scale', 10.0))
@@ -23,51 +25,48 @@ class PositionPulser(RawPreset):
         self.add_parameter(HLSParameter('color-end', (1.0, 0.5, 1.0)))
         self.add_parameter(IntParameter('color-steps', 256))
         self.add_parameter(FloatParameter('color-speed', 10.0))
+        self._setup_colors()
 
     def parameter_changed(self, parameter):
         self.feature = self.parameter('feature').get()
+        self._setup_colors()
+
+    def _setup_colors(self):
+        fade_colors = [self.parameter('color-start').get(),
+                       self.parameter('color-end').get(),
+                       self.parameter('color-start').get()]
+        self._fader = ColorFade.get(fade_colors, self.parameter('color-steps').get())
 
     def reset(self):
-        self.pixel_locations = self.scene().get_all_pixel_locations()
+        pass
 
     def draw(self, dt):
-        x, y = self.pixel_locations.T
-
-        # Make a blank color canvas for additive mixing.
-        hues = np.zeros(x.shape, float)
+        particles = self._particles
 
-        # Make every pixel dark.
-        luminances = np.zeros(x.shape, float)
+        # Make a blank color canvas for additive mixing, with every pixel dark.
+        hues = np.zeros(particles.num_pixels, float)
+        luminances = np.zeros(particles.num_pixels, float)
 
+        # Each pulser is a disc of radius scale * feature-value, following its emitter.
         scale = self.parameter('scale').get()
-        color_speed = self.parameter('color-speed').get()
+        slots = []
         for _, pulser in self.audio_emitter_pulsers.iteritems():
             position = pulser.audio_emitter.position()
 
             if not position:
                 continue
 
-            pulser_x, pulser_y, _ = position
-
-            # For every pixel, get the vector between the pixel and this pulser.
-            dx, dy = (self.pixel_locations - (pulser_x, pulser_y)).T
+            particles.x[pulser.slot], particles.y[pulser.slot], _ = position
+            particles.radius[pulser.slot] = pulser.value * scale
+            slots.append(pulser.slot)
 
-            # And make a column vector of the distances between every pixel and
-            # this pulser.
-            pixel_distances = np.sqrt(np.square(dx) + np.square(dy))
+        # Color them with a color from the fader, and illuminate them.
+        slots = np.asarray(slots, dtype=np.int_)
+        particles.draw_discs(slots, hues, luminances,
+                             self._fader.get_colors_wrapped(particles.color[slots])[:, 0])
 
-            # Select all pixels less than scale * feature-value from the pulser.
-            selector = pixel_distances < pulser.value * scale
-
-            # Color them with a color from the fader. Add the color so that
-            # overlapping colors mix.
-            hues[selector] += pulser._fader.get_color_wrapped(pulser.color)[0]
-
-            # and illuminate them.
-            luminances[selector] = 0.5
-
-            # Increment the pulser's color ticker by the color-speed parameter.
-            pulser.color += color_speed * dt
+        # Increment the pulsers' color tickers by the color-speed parameter.
+        particles.color[slots] += self.parameter('color-speed').get() * dt
 
         self.setAllHLS(hues, luminances, 1)
 
@@ -80,12 +79,8 @@ class PositionPulser(RawPreset):
 
         pulser = self.audio_emitter_pulsers.get(group, None)
         if pulser is None:
-            fade_colors = [self.parameter('color-start').get(),
-                           self.parameter('color-end').get(),
-                           self.parameter('color-start').get()]
-            color_steps = self.parameter('color-steps').get()
             pulser = PositionPulser.AudioEmitterPulser(
-                audio_emitter, fade_colors, color_steps)
+                audio_emitter, self._particles.spawn(0.0, 0.0))
             self.audio_emitter_pulsers[group] = pulser
         pulser.value = feature['value']
 
@@ -93,16 +88,8 @@ class PositionDonutParticles(RawPreset):
     """Emits 'donut' particles from positions of AudioEmitters when the
     specified feature parameter goes high."""
 
-    class DonutParticle(object):
-        def __init__(self, position, fade_colors, fade_steps):
-            self.position = position
-            self.distance = 0
-            self.color = 0
-            self._fader = ColorFade(fade_colors, fade_steps)
-            self.alive = True
-
     def setup(self):
-        self.particles = []
+        self._particles = Particles(self.scene())
         self.max_distance = 0
         self.feature_value_triggered = defaultdict(lambda: False)
         self.add_parameter(StringParameter('feature', 'beat'))
@@ -112,53 +99,41 @@ class PositionDonutParticles(RawPreset):
         self.add_parameter(HLSParameter('color-end', (1.0, 0.5, 1.0)))
         self.add_parameter(IntParameter('color-steps', 256))
         self.add_parameter(FloatParameter('color-speed', 10.0))
+        self._setup_colors()
 
     def parameter_changed(self, parameter):
         self.feature = self.parameter('feature').get()
+        self._setup_colors()
+
+    def _setup_colors(self):
+        fade_colors = [self.parameter('color-start').get(),
+                       self.parameter('color-end').get(),
+                       self.parameter('color-start').get()]
+        self._fader = ColorFade.get(fade_colors, self.parameter('color-steps').get())
 
     def reset(self):
-        self.pixel_locations = self.scene().get_all_pixel_locations()
         extent_x, extent_y = self.scene().extents()
         self.max_distance = math.sqrt(extent_x ** 2 + extent_y ** 2)
 
     def draw(self, dt):
-        x, y = self.pixel_locations.T
-
-        hues = np.zeros(x.shape, float)
-        luminances = np.zeros(x.shape, float)
-
-        speed = self.parameter('speed').get()
-        width = self.parameter('width').get()
-        color_speed = self.parameter('color-speed').get()
-        for particle in self.particles:
-            particle_x, particle_y, _ = particle.position
-            particle.distance += dt * speed
-
-            # For every pixel, get the vector between the pixel and this particle.
-            dx, dy = (self.pixel_locations - (particle_x, particle_y)).T
-
-            # And make a column vector of the distances between every pixel and
-            # this particle.
-            pixel_distances = np.sqrt(np.square(dx) + np.square(dy))
+        particles = self._particles
 
-            # Select all pixels less than width distance from current location
-            # of the particle's width.
-            selector = np.abs(pixel_distances - particle.distance) < width
+        hues = np.zeros(particles.num_pixels, float)
+        luminances = np.zeros(particles.num_pixels, float)
 
-            # Color them with a color from the fader. Add the color so that
-            # overlapping colors mix.
-            hues[selector] += particle._fader.get_color_wrapped(particle.color)[0]
+        # Each particle is a ring that grows outward from where it was emitted.
+        slots = particles.slots()
+        particles.radius[slots] += dt * self.parameter('speed').get()
 
-            # and illuminate them.
-            luminances[selector] = 0.5
+        # Color the pixels less than width from each ring with a color from the fader,
+        # and illuminate them.
+        particles.draw_rings(slots, self.parameter('width').get(), hues, luminances,
+                             self._fader.get_colors_wrapped(particles.color[slots])[:, 0])
 
-            # Increment the pulser's color ticker by the color-speed parameter.
-            particle.color += color_speed * dt
+        # Increment the particles' color tickers by the color-speed parameter.
+        particles.color[slots] += self.parameter('color-speed').get() * dt
 
-            if particle.distance > self.max_distance:
-                particle.alive = False
-
-        self.particles = filter(lambda particle: particle.alive, self.particles)
+        particles.kill(slots[particles.radius[slots] > self.max_distance])
 
         self.setAllHLS(hues, luminances, 1)
 
@@ -183,11 +158,5 @@ class PositionDonutParticles(RawPreset):
         if position is None:
             return
 
-        fade_colors = [self.parameter('color-start').get(),
-                       self.parameter('color-end').get(),
-                       self.parameter('color-start').get()]
-        color_steps = self.parameter('color-steps').get()
-
-        self.particles.append(PositionDonutParticles.DonutParticle(
-            position, fade_colors, color_steps))
+        self._particles.spawn(position[0], position[1])
         self.feature_value_triggered[group] = True
@@ -1,4 +1,5 @@
 from lib.buffer_utils import BufferUtils
+from lib.colors import convert_color_space
 from lib.raw_preset import RawPreset
 from lib.parameters import FloatParameter, HLSParameter, StringParameter
 
@@ -34,6 +35,15 @@ class CombinePresets(RawPreset):
     def reset(self):
         self.parameter_changed(None)
 
+    def get_sub_presets(self):
+        layer = self.layer()
+        if layer is None:
+            return []
+
+        presets = (layer._playlist.get_preset_by_name(self.parameter('first-preset').get()),
+                   layer._playlist.get_preset_by_name(self.parameter('second-preset').get()))
+        return [preset for preset in presets if preset is not None]
+
     def draw(self, dt):
         layer = self.layer()
         if layer is None:
@@ -53,6 +63,14 @@ class CombinePresets(RawPreset):
             preset1_buffer = preset1.draw_to_buffer(self._preset1_buffer)
             preset2_buffer = preset2.draw_to_buffer(self._preset2_buffer)
 
+            # Blended as in Layer.render_presets
+            color_space = preset1.get_color_space()
+            if color_space != preset2.get_color_space() or color_space not in self._transition.color_spaces:
+                preset1_buffer = convert_color_space(preset1_buffer, preset1.get_color_space(), 'HLS')
+                preset2_buffer = convert_color_space(preset2_buffer, preset2.get_color_space(), 'HLS')
+                color_space = 'HLS'
+            self.color_space = color_space
+
             self._pixel_buffer = self._transition.get(
                 preset1_buffer, preset2_buffer,
                 self.parameter('transition-progress').get())
@@ -1,10 +1,11 @@
 import colorsys
-import random
+import numpy as np
 
 from lib.raw_preset import RawPreset
 from lib.colors import uint8_to_float, float_to_uint8
 from lib.buffer_utils import BufferUtils
 from lib.color_fade import ColorFade
+from lib.agent_engine import AgentEngine
 from lib.parameters import FloatParameter, IntParameter, HLSParameter
 
 
@@ -12,6 +13,11 @@ class Dragons(RawPreset):
     """
     Dragons spawn randomly and travel.  At vertices, dragons can reproduce.
     If two dragons collide, both die.
+
+    A dragon reaches a vertex whenever its next step would leave its fixture, whether it
+    has moved yet or not.  Its first child may spawn on any branch of the vertex, which
+    includes fixtures at the same address on other strands.  All random choices are drawn
+    from the AgentEngine's random state.
     """
 
     # Configurable parameters
@@ -21,26 +27,16 @@ class Dragons(RawPreset):
     _explode_color = (1.0, 1.0, 1.0)
     _fader_steps = 256
 
-    # Internal parameters
-    class Dragon:
-        def __init__(self, loc, dir, lifetime):
-            self.loc = loc
-            self.dir = dir
-            self.lifetime = lifetime
-            self.growing = True
-            self.alive = False
-            self.moving = False
-            self.growth = 0
-
-        def __repr__(self):
-            ds = 'Fwd' if self.dir == 1 else 'Rev'
-            return "Dragon (%d, %d, %d) %s: %0.2f" % (self.loc[0], self.loc[1], self.loc[2], ds, self.lifetime)
+    # Dragon states
+    GROWING, ALIVE, MOVING = range(3)
+
+    # Tail kinds
+    TAIL, EXPLOSION = range(2)
 
     def setup(self):
-        self._dragons = []
-        self._tails = []
+        self._dragons = AgentEngine(self.scene())
+        self._clear_tails()
         self.init_pixels()
-        random.seed()
         self._current_time = 0
         self.add_parameter(FloatParameter('growth-time', 2.0))        
         self.add_parameter(FloatParameter('birth-rate', 0.4))
@@ -52,120 +48,125 @@ class Dragons(RawPreset):
         self.add_parameter(HLSParameter('tail-color', self._tail_color))
         self.add_parameter(HLSParameter('explode-color', self._explode_color))
         self._setup_colors()
+        self.defer_writes()
+
+    def seed(self, seed):
+        RawPreset.seed(self, seed)
+        self._dragons.random.seed(seed)
 
     def _setup_colors(self):
         self._alive_color = self.parameter('alive-color').get()
         self._dead_color = self.parameter('dead-color').get()
         self._tail_color = self.parameter('tail-color').get()
         self._explode_color = self.parameter('explode-color').get()
-        self._growth_fader = ColorFade([(0., 0., 0.), self._alive_color], self._fader_steps)
-        self._tail_fader = ColorFade([self._alive_color, self._tail_color, (0., 0., 0.)], self._fader_steps)
-        self._explode_fader = ColorFade([self._explode_color, (0., 0., 0.)], self._fader_steps)
+        self._growth_fader = ColorFade.get([(0., 0., 0.), self._alive_color], self._fader_steps)
+        self._tail_fader = ColorFade.get([self._alive_color, self._tail_color, (0., 0., 0.)], self._fader_steps)
+        self._explode_fader = ColorFade.get([self._explode_color, (0., 0., 0.)], self._fader_steps)
 
     def parameter_changed(self, parameter):
         self._setup_colors()
 
+    def _clear_tails(self):
+        self._tail_pixels = np.zeros(0, dtype=np.int_)
+        self._tail_times = np.zeros(0, dtype=np.float64)
+        self._tail_kinds = np.zeros(0, dtype=np.int8)
+
+    def _add_tails(self, pixels, kind):
+        self._tail_pixels = np.concatenate((self._tail_pixels, pixels))
+        self._tail_times = np.concatenate((self._tail_times, np.repeat(self._current_time, len(pixels))))
+        self._tail_kinds = np.concatenate((self._tail_kinds, np.repeat(np.int8(kind), len(pixels))))
+
     def draw(self, dt):
 
         self._current_time += dt
+        dragons = self._dragons
+        pop_limit = self.parameter('pop-limit').get()
+        birth_rate = self.parameter('birth-rate').get()
         
         # Spontaneous birth: Rare after startup
-        if (len(self._dragons) < self.parameter('pop-limit').get()) and random.random() < self.parameter('birth-rate').get():
-            address = BufferUtils.logical_to_index((random.randint(0, self._max_strand - 1),
-                        random.randint(0, self._max_fixture - 1),
+        if (len(dragons) < pop_limit) and dragons.random.random_sample() < birth_rate:
+            address = BufferUtils.logical_to_index((dragons.random.randint(0, self._max_strand),
+                        dragons.random.randint(0, self._max_fixture),
                         0))
-            if address not in [d.loc for d in self._dragons]:
-                self._dragons.append(self.Dragon(address, 1, self._current_time))
-
-        growth_rate = self.parameter('growth-rate').get()
-        
-        # Dragon life cycle
-        for dragon in self._dragons:
-            # Fade in
-            if dragon.growing:
-                p = (self._current_time - dragon.lifetime) / self.parameter('growth-time').get()
-                if (p > 1):
-                    p = 1.0
-                color = self._growth_fader.get_color(p * self._fader_steps)
-                if p >= 1.0:
-                    dragon.growing = False
-                    dragon.alive = True
-                    dragon.lifetime = self._current_time
-
-                self.setPixelHLS(dragon.loc, color)
-
-            # Alive - can move or die
-            if dragon.alive:
-
-                dragon.growth += dt * growth_rate
-                for times in range(int(dragon.growth)):
-                    s, f, p = BufferUtils.index_to_logical(dragon.loc)
-                    self.setPixelHLS(dragon.loc, (0, 0, 0))
-
-                    if random.random() < dragon.growth:
-                        dragon.growth -= 1
-                    
-                        # At a vertex: optionally spawn new dragons
-                        if dragon.moving and (p == 0 or p == (self.scene().fixture(s, f).pixels - 1)):
-                            neighbors = self.scene().get_pixel_neighbors(dragon.loc)
-                            neighbors = [BufferUtils.index_to_logical(n) for n in neighbors]
-                            random.shuffle(neighbors)
-
-                            # Kill dragons that reach the end of a fixture
-                            dragon.moving = False
-                            if dragon in self._dragons:
-                                self._dragons.remove(dragon)
-                                
-                            # Iterate over candidate pixels that aren't on the current fixture
-                            num_children = 0
-                            for candidate in [n for n in neighbors if n[1] != f]:
-                                child_index = BufferUtils.logical_to_index(candidate)
-                                if num_children == 0:
-                                    # Spawn at least one new dragon to replace the old one.  This first one skips the growth.
-                                    dir = 1 if candidate[2] == 0 else -1
-                                    child = self.Dragon(child_index, dir, self._current_time)
-                                    child.growing = False
-                                    child.alive = True
-                                    child.moving = False
-                                    self._dragons.append(child)
-                                    num_children += 1
-                                elif (len(self._dragons) < self.parameter('pop-limit').get()):
-                                    # Randomly spawn new dragons
-                                    if random.random() < self.parameter('birth-rate').get():
-                                        dir = 1 if candidate[2] == 0 else -1
-                                        child = self.Dragon(child_index, dir, self._current_time)
-                                        child.moving = False
-
-                                        self._dragons.append(child)
-                                        num_children += 1
-                            break;
-                        else:
-                            # Move dragons along the fixture
-                            self._tails.append((dragon.loc, self._current_time, self._tail_fader))
-                            new_address = BufferUtils.logical_to_index((s, f, p + dragon.dir))
-                            dragon.loc = new_address
-                            dragon.moving = True
-                            self.setPixelHLS(new_address, self._alive_color)
-
-                    # Kill dragons that run into each other
-                    if dragon in self._dragons:
-                        colliding = [d for d in self._dragons if d != dragon and d.loc == dragon.loc]
-                        if len(colliding) > 0:
-                            #print "collision between", dragon, "and", colliding[0]
-                            self._dragons.remove(dragon)
-                            self._dragons.remove(colliding[0])
-                            self._tails.append((dragon.loc, self._current_time, self._explode_fader))
-                            neighbors = self.scene().get_pixel_neighbors(dragon.loc)
-                            for neighbor in neighbors:
-                                self._tails.append((neighbor, self._current_time, self._explode_fader))
-                            break
+            if not dragons.occupied(address):
+                dragons.spawn(address, 1, self.GROWING, self._current_time)
+
+        # Fade in
+        growing = dragons.slots(self.GROWING)
+        progress = np.minimum((self._current_time - dragons.born[growing]) / self.parameter('growth-time').get(), 1.0)
+        self.set_pixels_fade(dragons.position[growing], self._growth_fader, progress * self._fader_steps)
+        grown = growing[progress >= 1.0]
+        dragons.state[grown] = self.ALIVE
+        dragons.born[grown] = self._current_time
+
+        # Alive - can move or die
+        walkers = np.flatnonzero(dragons.active & (dragons.state != self.GROWING))
+        dragons.accumulator[walkers] += dt * self.parameter('growth-rate').get()
+        steps = np.floor(dragons.accumulator[walkers]).astype(np.int_)
+        dragons.accumulator[walkers] -= steps
+
+        # Dragons born during the loop can take the slot of one that died, so rather than
+        # checking dragons.active, walkers are struck off as they die.  New dragons first
+        # move on the next frame.
+        moving = np.ones(len(walkers), dtype=bool)
+
+        for step in xrange(steps.max() if len(steps) > 0 else 0):
+            slots = walkers[(steps > step) & moving]
+            if len(slots) == 0:
+                break
+
+            self.set_pixels(dragons.position[slots], (0, 0, 0))
+            next_positions = dragons.next_positions(slots)
+            at_vertex = next_positions < 0
+
+            # At a vertex: the dragon dies, and spawns at least one new dragon (which skips
+            # the growth) on a random branch.  Other branches may randomly spawn new dragons.
+            if at_vertex.any():
+                dying = slots[at_vertex]
+                dragons.kill(dying)
+                moving &= dragons.active[walkers]
+                owners, pixels, directions = dragons.branches(dying)
+                order = np.lexsort((dragons.random.random_sample(len(owners)), owners))
+                owners, pixels, directions = owners[order], pixels[order], directions[order]
+
+                first = np.ones(len(owners), dtype=bool)
+                first[1:] = owners[1:] != owners[:-1]
+                dragons.spawn(pixels[first], directions[first], self.ALIVE, self._current_time)
+
+                extra = np.flatnonzero(~first & (dragons.random.random_sample(len(owners)) < birth_rate))
+                extra = extra[:max(0, pop_limit - len(dragons))]
+                dragons.spawn(pixels[extra], directions[extra], self.GROWING, self._current_time)
+
+            # Move dragons along the fixture
+            movers = slots[~at_vertex]
+            self._add_tails(dragons.position[movers], self.TAIL)
+            dragons.position[movers] = next_positions[~at_vertex]
+            dragons.state[movers] = self.MOVING
+            self.set_pixels(dragons.position[movers], self._alive_color)
+
+            # Kill dragons that run into each other
+            crashes = np.unique(dragons.position[movers[dragons.collisions(movers)]])
+            if len(crashes) > 0:
+                crashed = np.zeros(dragons.num_pixels, dtype=bool)
+                crashed[crashes] = True
+                dragons.kill(np.flatnonzero(dragons.active & crashed[dragons.position]))
+                moving &= dragons.active[walkers]
+                explosion = crashed | self.scene().get_pixel_graph().neighbors_of(crashed)
+                self._add_tails(np.flatnonzero(explosion), self.EXPLOSION)
 
         # Draw tails
-        for loc, time, fader in self._tails:
-            if (self._current_time - time) > self.parameter('tail-persist').get():
-                if (loc, time, fader) in self._tails:
-                    self._tails.remove((loc, time, fader))
-                self.setPixelHLS(loc, (0, 0, 0))
-            else:
-                progress = (self._current_time - time) / self.parameter('tail-persist').get()
-                self.setPixelHLS(loc, fader.get_color(progress * self._fader_steps))
\ No newline at end of file
+        if len(self._tail_pixels) > 0:
+            tail_persist = self.parameter('tail-persist').get()
+            ages = self._current_time - self._tail_times
+            progress = ages / tail_persist * self._fader_steps
+
+            colors = np.where((self._tail_kinds == self.TAIL)[:, np.newaxis],
+                              self._tail_fader.get_colors(progress),
+                              self._explode_fader.get_colors(progress))
+            expired = ages > tail_persist
+            colors[expired] = (0, 0, 0)
+            self.set_pixels(self._tail_pixels, colors)
+
+            self._tail_pixels = self._tail_pixels[~expired]
+            self._tail_times = self._tail_times[~expired]
+            self._tail_kinds = self._tail_kinds[~expired]
@@ -1,33 +1,31 @@
 import colorsys
-import random
+import numpy as np
 
 from lib.raw_preset import RawPreset
 from lib.colors import uint8_to_float, float_to_uint8
 from lib.buffer_utils import BufferUtils
 from lib.color_fade import ColorFade
+from lib.pixel_state_machine import PixelStateMachine
 from lib.parameters import FloatParameter, IntParameter, HLSParameter
 
 
 class Fungus(RawPreset):
     """
     Spreading fungus
-    Illustrates use of Scene.get_pixel_neighbors.
+    Illustrates use of PixelStateMachine and the scene's PixelGraph.
 
     Fungal pixels go through three stages:  Growing, Dying, and then Fading Out.
     """
 
-    _growing = []
-    _alive = []
-    _dying = []
-    _fading_out = []
+    EMPTY, GROWING, ALIVE, DYING, FADING_OUT = range(5)
+
     _fader_steps = 256
 
     # Configurable parameters
     _spontaneous_birth_probability = 0.0001
 
     # Internal parameters
-    _time = {}
-    _population = 0
+    _cells = None
     _fader = None
     
     _growth_time = 0.6    
@@ -45,8 +43,7 @@ class Fungus(RawPreset):
     _black_color = (0.0, 0.0, 1.0)
 
     def setup(self):
-        self._population = 0
-        self._time = {}
+        self._cells = PixelStateMachine(self.scene())
         self.add_parameter(FloatParameter('growth-time', self._growth_time))
         self.add_parameter(FloatParameter('life-time', self._life_time))
         self.add_parameter(FloatParameter('isolated-life-time', self._isolated_life_time))
@@ -61,17 +58,16 @@ class Fungus(RawPreset):
         self.add_parameter(HLSParameter('dead-color', self._dead_color))
         self.add_parameter(HLSParameter('black-color', self._black_color))
         self.parameter_changed(None)
+        self.defer_writes()
 
     def reset(self):
-        self._current_time = 0
-        self._growing = []
-        self._alive = []
-        self._dying = []
-        self._fading_out = []
-        self._population = 0
-        self._time = {}
+        self._cells.reset()
         self.parameter_changed(None)
 
+    def seed(self, seed):
+        RawPreset.seed(self, seed)
+        self._cells.random.seed(seed)
+
     def parameter_changed(self, parameter):
         self._setup_colors()
         self._growth_time = self.parameter('growth-time').get()
@@ -90,114 +86,65 @@ class Fungus(RawPreset):
         self._dead_color = self.parameter('dead-color').get()
         self._black_color = self.parameter('black-color').get()
         fade_colors = [self._black_color, self._alive_color, self._dead_color, self._black_color]
-        self._fader = ColorFade(fade_colors, self._fader_steps)
+        self._fader = ColorFade.get(fade_colors, self._fader_steps)
 
     def draw(self, dt):
-
-        self._current_time += dt
+        cells = self._cells
+        cells.advance(dt)
         self._mass_destruction_countdown -= dt
-    
+
+        population = cells.count(self.GROWING) + cells.count(self.ALIVE)
+        empty = cells.in_state(self.EMPTY)
+
         # Ensure that empty displays start up with some seeds
-        p_birth = (1.0 - self._spontaneous_birth_probability) if self._population > 5 else 0.5
+        p_birth = (1.0 - self._spontaneous_birth_probability) if population > 5 else 0.5
 
         # Spontaneous birth: Rare after startup
-        if (self._population < self._population_limit) and random.random() > p_birth:
-            address = BufferUtils.logical_to_index((random.randint(0, self._max_strand - 1),
-                                                    random.randint(0, self._max_fixture - 1),
-                                                    random.randint(0, self._max_pixel - 1)))
-            if address not in (self._growing + self._alive + self._dying + self._fading_out):
-                self._growing.append(address)
-                self._time[address] = self._current_time
-                self._population += 1
+        if (population < self._population_limit) and cells.random.random_sample() > p_birth:
+            address = BufferUtils.logical_to_index((cells.random.randint(0, self._max_strand),
+                                                    cells.random.randint(0, self._max_fixture),
+                                                    cells.random.randint(0, self._max_pixel)))
+            if empty[address]:
+                cells.set_state(address, self.GROWING)
+                empty[address] = False
+                population += 1
 
         # Color growth
-        for address in self._growing:
-            neighbors = self.scene().get_pixel_neighbors(address)
-            p, color = self._get_next_color(address, self._growth_time, self._current_time)
-            if p >= 1.0:
-                self._growing.remove(address)
-                self._alive.append(address)
-                self._time[address] = self._current_time
-            self.setPixelHLS(address, color)
-
-            # Spread
-            if (self._population < self._population_limit) and (random.random() < self._spread_rate * dt):
-                for spread in neighbors:
-                    if spread not in (self._growing + self._alive + self._dying + self._fading_out):
-                        self._growing.append(spread)
-                        self._time[spread] = self._current_time
-                        self._population += 1
+        growing = cells.in_state(self.GROWING)
+        alive = cells.in_state(self.ALIVE)
+        indices = np.flatnonzero(growing)
+        progress = cells.progress(indices, self._growth_time)
+        self.set_pixels_fade(indices, self._fader, progress / 3.0 * self._fader_steps)
+        cells.set_state(indices[progress >= 1.0], self.ALIVE)
 
         # Lifetime
-        for address in self._alive:
-            neighbors = self.scene().get_pixel_neighbors(address)
-            live_neighbors = [i for i in neighbors if i in self._alive]
-            lt = self._life_time
-            if len(neighbors) < 2:
-                lt = self._isolated_life_time
-
-            if len(live_neighbors) < 2 and ((self._current_time - self._time[address]) / lt) >= 1.0:
-                self._alive.remove(address)
-                self._dying.append(address)
-                self._time[address] = self._current_time
-                self._population -= 1
-
-            self.setPixelHLS(address, self._alive_color)
-
-            # Spread
-            if (self._population < self._population_limit) and random.random() < self._birth_rate * dt:
-                for spread in neighbors:
-                    if spread not in (self._growing + self._alive + self._dying + self._fading_out):
-                        self._growing.append(spread)
-                        self._time[spread] = self._current_time
-                        self._population += 1
+        self.set_pixels(np.flatnonzero(alive), self._alive_color)
+        lifetime = np.where(cells.degree < 2, self._isolated_life_time, self._life_time)
+        dead = alive & (cells.neighbor_count(alive) < 2) & (cells.age() >= lifetime)
+        cells.set_state(dead, self.DYING)
+        population -= np.count_nonzero(dead)
+
+        # Spread from growing and living pixels into empty neighbors
+        sources = cells.chance(self._spread_rate * dt, growing) | cells.chance(self._birth_rate * dt, alive)
+        spread = cells.spread(sources, empty, self._population_limit - population)
+        cells.set_state(spread, self.GROWING)
+        population += np.count_nonzero(spread)
 
         # Color decay
-        for address in self._dying:
-            p, color = self._get_next_color(address, self._death_time, self._current_time)
-            if p >= 1.0:
-                self._dying.remove(address)
-                self._fading_out.append(address)
-                self._time[address] = self._current_time
-            self.setPixelHLS(address, color)
+        indices = cells.where(self.DYING)
+        progress = cells.progress(indices, self._death_time)
+        self.set_pixels_fade(indices, self._fader, (progress + 1.0) / 3.0 * self._fader_steps)
+        cells.set_state(indices[progress >= 1.0], self.FADING_OUT)
 
         # Fade out
-        for address in self._fading_out:
-            p, color = self._get_next_color(address, self._fade_out_time, self._current_time)
-            if p >= 1.0:
-                self._fading_out.remove(address)
-            self.setPixelHLS(address, color)
+        indices = cells.where(self.FADING_OUT)
+        progress = cells.progress(indices, self._fade_out_time)
+        self.set_pixels_fade(indices, self._fader, (progress + 2.0) / 3.0 * self._fader_steps)
+        cells.state[indices[progress >= 1.0]] = self.EMPTY
 
         # Mass destruction
-        if (self._population == self._population_limit) or \
-                (self._population > self._mass_destruction_threshold and self._mass_destruction_countdown <= 0):
-            for i in self._alive:
-                if random.random() > 0.95:
-                    self._alive.remove(i)
-                    self._dying.append(i)
-                    self._population -= 1
-            for i in self._growing:
-                if random.random() > 0.85:
-                    self._growing.remove(i)
-                    self._dying.append(i)
-                    self._population -= 1
+        if (population == self._population_limit) or \
+                (population > self._mass_destruction_threshold and self._mass_destruction_countdown <= 0):
+            destroyed = cells.chance(0.05, cells.in_state(self.ALIVE)) | cells.chance(0.15, cells.in_state(self.GROWING))
+            cells.set_state(destroyed, self.DYING)
             self._mass_destruction_countdown = self.parameter('mass-destruction-time').get()
-
-    def _get_next_color(self, address, time_target, current_time):
-        """
-        Returns the next color for a pixel, given the pixel's current state
-        """
-        progress = (current_time - self._time[address]) / time_target
-
-        if progress > 1.0:
-            progress = 1.0
-        elif current_time == self._time[address]:
-            progress = 0.0
-
-        idx = progress / 3.0
-        if time_target == self._death_time:
-            idx += (1.0 / 3.0)
-        elif time_target == self._fade_out_time:
-            idx += (2.0 / 3.0)
-
-        return (progress, self._fader.get_color(idx * self._fader_steps))
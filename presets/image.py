@@ -1,14 +1,19 @@
-import random
 import math
 import numpy as np
-from lib.colors import hls_blend
-from PySide.QtGui import QPixmap
+from lib.colors import hls_blend, rgb_to_hls
 
 from lib.raw_preset import RawPreset
 from lib.parameters import FloatParameter, StringParameter
-from lib.colors import rgb_to_hls
+from lib.image_assets import ImageAssets
 
 class ImagePreset(RawPreset):
+    """
+    Maps an image onto the scene.  Images are sampled in RGB, which is output as is unless
+    hue rotation, the beat luminance boost or ghosting has to be applied in HLS.
+    """
+
+    color_space = 'RGB'
+
     def setup(self):
         self.add_parameter(FloatParameter('speed-rotation', 0.1))
         self.add_parameter(FloatParameter('speed-hue', 0.0))
@@ -24,8 +29,6 @@ class ImagePreset(RawPreset):
         self.add_parameter(FloatParameter('beat-lum-time', 0.05))
 
         self.pixel_locations = self.scene().get_all_pixel_locations()
-        self.hue_inner = random.random() + 100
-        self._center_rotation = random.random()
         self.angle = 0
         self.lum_boost = 0
         self.hue_offset = 0
@@ -33,32 +36,55 @@ class ImagePreset(RawPreset):
         self.image = None
         self._buffer = None
 
+        # Typical distance between neighboring pixels, to choose the mip level to sample
+        lengths = self.scene().get_pixel_graph().lengths
+        self._pixel_spacing = float(np.median(lengths)) if len(lengths) > 0 else 1.0
+
         self.parameter_changed(None)
 
     def parameter_changed(self, parameter):
         if self.imagename != self.parameter('image-file').get():
-            self.pixmap = QPixmap(self.parameter('image-file').get())
             self.imagename = self.parameter('image-file').get()
-            image = self.pixmap.toImage()
-            if image:
-                #image = image.convertToFormat(QImage.Format_ARGB32)
-                self.image = np.frombuffer(image.bits(), dtype=np.uint8)
-                self.image = self.image.reshape(self.pixmap.height(), self.pixmap.width(), 4).T
-
-                self.image = np.asarray((self.image[2],self.image[1],self.image[0])).T
-
-                self.image = rgb_to_hls(self.image)
-                #print self.image
-
-                print "image", self.parameter('image-file').get(), "loaded:", self.image.shape
+            # Loaded in the background; draw() waits until the image is ready
+            self.image = self.load_image(self.imagename) if self.imagename else None
 
         self.lastFrame = None
 
+    def load_image(self, name):
+        return ImageAssets.get(name)
+
     def reset(self):
-        pass
+        self.hue_inner = self.random.random_sample() + 100
+        self._center_rotation = self.random.random_sample()
+
+    def texel_coordinates(self):
+        """
+        Returns the (x, y) image coordinates of every pixel, for the current rotation,
+        orbit, scale and center
+        """
+        orbitx = math.cos(self._center_rotation) * self.parameter('center-orbit-distance').get()
+        orbity = math.sin(self._center_rotation) * self.parameter('center-orbit-distance').get()
+
+        locations = np.copy(self.pixel_locations.T)
+        cx, cy = self.scene().center_point()
+        locations[0] -= cx + orbitx
+        locations[1] -= cy + orbity
+        rotMatrix = np.array([(math.cos(self.angle), -math.sin(self.angle)), (math.sin(self.angle),  math.cos(self.angle))])
+        x,y = rotMatrix.T.dot(locations)
+        x /= self.parameter('scale').get()
+        y /= self.parameter('scale').get()
+        x += self.image.width / 2 + self.parameter('center-x').get()
+        y += self.image.height / 2 + self.parameter('center-y').get()
+        return x, y
+
+    def sample_image(self, dt):
+        x, y = self.texel_coordinates()
+        scale = self.parameter('scale').get()
+        level = self.image.level_for(self._pixel_spacing / abs(scale)) if scale else 0
+        return self.image.sample(x, y, level, self.parameter('edge-mode').get())
 
     def draw(self, dt):
-        if self.pixmap:
+        if self.image is not None and self.image.ready:
             lum_boost = self.parameter('beat-lum-boost').get()
             if self._mixer.is_onset():
                 self.lum_boost += lum_boost
@@ -66,51 +92,24 @@ class ImagePreset(RawPreset):
             self.hue_offset += dt * self.parameter('speed-hue').get()
             self._center_rotation += dt * self.parameter('center-orbit-speed').get()
             self.angle += dt * self.parameter('speed-rotation').get()
-            orbitx = math.cos(self._center_rotation) * self.parameter('center-orbit-distance').get()
-            orbity = math.sin(self._center_rotation) * self.parameter('center-orbit-distance').get()
-
-            locations = np.copy(self.pixel_locations.T)
-            cx, cy = self.scene().center_point()
-            locations[0] -= cx + orbitx
-            locations[1] -= cy + orbity
-            rotMatrix = np.array([(math.cos(self.angle), -math.sin(self.angle)), (math.sin(self.angle),  math.cos(self.angle))])
-            x,y = rotMatrix.T.dot(locations)
-            x /= self.parameter('scale').get()
-            y /= self.parameter('scale').get()
-            x += self.pixmap.width() / 2 + self.parameter('center-x').get()
-            y += self.pixmap.height() / 2 + self.parameter('center-y').get()
-            x = np.int_(x)
-            y = np.int_(y)
-
-            edge_mode = self.parameter('edge-mode').get()
-            if edge_mode == "clamp":
-                np.clip(x, 0, self.pixmap.width() - 1, x)
-                np.clip(y, 0, self.pixmap.height() - 1, y)
-            elif edge_mode == "tile":
-                np.mod(np.abs(x), self.pixmap.width(), x)
-                np.mod(np.abs(y), self.pixmap.height(), y)
-            elif edge_mode == "mirror":
-                np.mod(np.abs(x), self.pixmap.width() * 2 - 1, x)
-                np.mod(np.abs(y), self.pixmap.height() * 2 - 1, y)
-                np.abs(x - (self.pixmap.width() - 1), x)
-                np.abs(y - (self.pixmap.height() - 1), y)
-            else:
-                print "Unknown image preset edge mode (clamp, tile, or mirror)."
-
-            locations = np.asarray([x,y]).T
-
-            colors = self.image[locations.T[1], locations.T[0]]
-
-            colors.T[0] += self.hue_offset
-            colors.T[1] += self.lum_boost
 
+            colors = self.sample_image(dt)
             ghost = self.parameter('ghost').get()
-            if abs(ghost) > 0:
-                if self.lastFrame != None:
-                    if self._buffer is None:
-                        self._buffer = np.empty_like(self.lastFrame)
-                    colors = hls_blend(colors, self.lastFrame, self._buffer, ghost, "add", 1.0, 0.1)
-                self.lastFrame = colors
+
+            if self.hue_offset or self.lum_boost or abs(ghost) > 0:
+                colors = rgb_to_hls(colors, colors, 1.0)
+                colors.T[0] += self.hue_offset
+                colors.T[1] += self.lum_boost
+
+                if abs(ghost) > 0:
+                    if self.lastFrame != None:
+                        if self._buffer is None:
+                            self._buffer = np.empty_like(self.lastFrame)
+                        colors = hls_blend(colors, self.lastFrame, self._buffer, ghost, "add", 1.0, 0.1)
+                    self.lastFrame = colors
+                self.color_space = 'HLS'
+            else:
+                self.color_space = 'RGB'
 
             lum_time = self.parameter('beat-lum-time').get()
             if lum_time and self.lum_boost:
@@ -120,3 +119,35 @@ class ImagePreset(RawPreset):
                     self.lum_boost = min(0, self.lum_boost - lum_boost * dt / lum_time)
 
             self._pixel_buffer = colors
+
+
+class ImageSequencePreset(ImagePreset):
+    """
+    Plays a directory of frames (named by image-file) through the same mapping as
+    ImagePreset.  The pixel to texel mapping is only recomputed when it changes, so while
+    the image holds still each frame is a single gather from the memory-mapped frames.
+    """
+
+    def setup(self):
+        self.add_parameter(FloatParameter('frame-rate', 30.0))
+        self._frame_time = 0.0
+        self._mapping = None
+        self._texels = None
+        ImagePreset.setup(self)
+
+    def load_image(self, name):
+        self._frame_time = 0.0
+        return ImageAssets.get_sequence(name)
+
+    def sample_image(self, dt):
+        orbit = self.parameter('center-orbit-distance').get()
+        mapping = (self.image, self.angle, self._center_rotation if orbit else 0.0, orbit,
+                   self.parameter('scale').get(), self.parameter('center-x').get(),
+                   self.parameter('center-y').get(), self.parameter('edge-mode').get())
+        if mapping != self._mapping:
+            x, y = self.texel_coordinates()
+            self._texels = self.image.texels(x, y, 0, self.parameter('edge-mode').get())
+            self._mapping = mapping
+
+        self._frame_time += dt * self.parameter('frame-rate').get()
+        return self.image.sample_frame(int(self._frame_time), self._texels)
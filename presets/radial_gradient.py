@@ -1,5 +1,4 @@
 import colorsys
-import random
 import math
 import numpy as np
 
@@ -25,10 +24,6 @@ class RadialGradient(RawPreset):
         self.add_parameter(FloatParameter('whiteout', 0.1))
         self.add_parameter(FloatParameter('luminance-speed', 0.01))
         self.add_parameter(FloatParameter('luminance-scale', 1.0))
-        self.hue_inner = random.random()
-        self.wave1_offset = random.random()
-        self.wave2_offset = random.random()
-        self.luminance_offset = random.random()
 
         cx, cy = self.scene().center_point()
 
@@ -42,25 +37,31 @@ class RadialGradient(RawPreset):
         
 
     def reset(self):
-        pass
+        self.hue_inner = self.random.random_sample()
+        self.wave1_offset = self.random.random_sample()
+        self.wave2_offset = self.random.random_sample()
+        self.luminance_offset = self.random.random_sample()
 
     def draw(self, dt):
+        params = self.params
         if self._mixer.is_onset():
-            self.hue_inner = math.fmod(self.hue_inner + self.parameter('hue-step').get(), 1.0)
-            self.luminance_offset += self.parameter('hue-step').get()
+            self.hue_inner = math.fmod(self.hue_inner + params.hue_step, 1.0)
+            self.luminance_offset += params.hue_step
 
-        self.hue_inner += dt * self.parameter('speed').get()
-        self.wave1_offset += self.parameter('wave1-speed').get() * dt
-        self.wave2_offset += self.parameter('wave2-speed').get() * dt
-        self.luminance_offset += self.parameter('luminance-speed').get() * dt
+        self.hue_inner += dt * params.speed
+        self.wave1_offset += params.wave1_speed * dt
+        self.wave2_offset += params.wave2_speed * dt
+        self.luminance_offset += params.luminance_speed * dt
 
         luminance_table = []
         luminance = 0.0
+        blackout = params.blackout * self._luminance_steps
+        whiteout = params.whiteout * self._luminance_steps
         for input in range(self._luminance_steps):
-            if input > self.parameter('blackout').get() * self._luminance_steps:
+            if input > blackout:
                 luminance -= 0.01
                 luminance = clip(0, luminance, 1.0)
-            elif input < self.parameter('whiteout').get() * self._luminance_steps:
+            elif input < whiteout:
                 luminance += 0.1
                 luminance = clip(0, luminance, 1.0)
             else:
@@ -69,18 +70,12 @@ class RadialGradient(RawPreset):
             luminance_table.append(luminance)
         luminance_table = np.asarray(luminance_table)
 
-        wave1_period = self.parameter('wave1-period').get()
-        wave1_amplitude = self.parameter('wave1-amplitude').get()
-        wave2_period = self.parameter('wave2-period').get()
-        wave2_amplitude = self.parameter('wave2-amplitude').get()
-        luminance_scale = self.parameter('luminance-scale').get()
-
-        wave1 = np.abs(np.cos(self.wave1_offset + self.pixel_angles * wave1_period) * wave1_amplitude)
-        wave2 = np.abs(np.cos(self.wave2_offset + self.pixel_angles * wave2_period) * wave2_amplitude)
+        wave1 = np.abs(np.cos(self.wave1_offset + self.pixel_angles * params.wave1_period) * params.wave1_amplitude)
+        wave2 = np.abs(np.cos(self.wave2_offset + self.pixel_angles * params.wave2_period) * params.wave2_amplitude)
         hues = self.pixel_distances + wave1 + wave2
-        luminance_indices = np.mod(np.abs(np.int_((self.luminance_offset + hues * luminance_scale) * self._luminance_steps)), self._luminance_steps)
+        luminance_indices = np.mod(np.abs(np.int_((self.luminance_offset + hues * params.luminance_scale) * self._luminance_steps)), self._luminance_steps)
         luminances = luminance_table[luminance_indices]
-        hues = np.fmod(self.hue_inner + hues * self.parameter('hue-width').get(), 1.0)
+        hues = np.fmod(self.hue_inner + hues * params.hue_width, 1.0)
 
         self.setAllHLS(hues, luminances, 1.0)
 
@@ -1,12 +1,13 @@
-from noise import snoise3
 import numpy as np
 import ast
 
 from lib.color_fade import ColorFade
 from lib.raw_preset import RawPreset
-from lib.parameters import FloatParameter, IntParameter, StringParameter
+from lib.parameters import FloatParameter, IntParameter, StringParameter, BoolParameter
 import math
 from lib.colors import clip
+from lib.simplex import snoise3
+from lib.noise_volume import NoiseVolume
 
 class SimplexNoise(RawPreset):
     """
@@ -14,7 +15,9 @@ class SimplexNoise(RawPreset):
     """
 
     _luminance_steps = 256
-    
+    shardable = True
+    shard_state = ('_offset_x', '_offset_y', '_offset_z')
+
     def setup(self):
         self.add_parameter(FloatParameter('hue-min', 0.0))
         self.add_parameter(FloatParameter('hue-max', 3.0))
@@ -29,6 +32,7 @@ class SimplexNoise(RawPreset):
         self.add_parameter(FloatParameter('beat-lum-boost', 0.05))
         self.add_parameter(FloatParameter('beat-lum-time', 0.1))
         self.add_parameter(FloatParameter('beat-color-boost', 0.0))
+        self.add_parameter(BoolParameter('noise-cache', False))
         self._offset_x = 0
         self._offset_y = 0
         self._offset_z = 0
@@ -51,7 +55,7 @@ class SimplexNoise(RawPreset):
         self.scale = self.parameter('scale').get() / 100.0
         self.luminance_scale = self.parameter('luminance-scale').get() / 100.0
         fade_colors = ast.literal_eval(self.parameter('luminance-map').get())
-        self.lum_fader = ColorFade(fade_colors, self._luminance_steps)
+        self.lum_fader = ColorFade.get(fade_colors, self._luminance_steps)
 
     def draw(self, dt):
         if self._mixer.is_onset():
@@ -69,14 +73,14 @@ class SimplexNoise(RawPreset):
         x *= self.parameter('stretch').get()
         x += self._offset_x
         y += self._offset_y
-        locations = np.asarray([x,y]).T
 
-        hues = np.asarray([snoise3(self.scale * location[0], \
-                                   self.scale * location[1], \
-                                   self._offset_z, 1, 0.5, 0.5) for location in locations])
+        # The cached volume is sampled rather than evaluated, at a small cost in detail
+        noise = NoiseVolume.get().sample if self.parameter('noise-cache').get() else snoise3
+
+        hues = noise(self.scale * x, self.scale * y, self._offset_z)
         hues = (1.0 + hues) / 2
         hues = self.hue_min + ((np.int_(hues * posterization) / float(posterization)) * (self.hue_max - self.hue_min))
-        brights = np.asarray([snoise3(self.luminance_scale * location[0], self.luminance_scale * location[1], self._offset_z, 1, 0.5, 0.5) for location in locations])
+        brights = noise(self.luminance_scale * x, self.luminance_scale * y, self._offset_z)
         brights = (1.0 + brights) / 2
         brights *= self._luminance_steps
         luminances = self.lum_fader.color_cache[np.int_(brights)].T[1]
@@ -1,6 +1,5 @@
 import numpy as np
 import colorsys
-import random
 import math
 
 from lib.raw_preset import RawPreset
@@ -29,7 +28,6 @@ class SpiralGradient(RawPreset):
         self.add_parameter(FloatParameter('center-speed', 0.0))
         self.hue_inner = 0
         self.color_offset = 0
-        self.wave_offset = random.random()
 
         self.center_offset_angle = 0
 
@@ -40,30 +38,32 @@ class SpiralGradient(RawPreset):
     def parameter_changed(self, parameter):
         fade_colors = [self.parameter('color-start').get(), self.parameter('color-end').get(), self.parameter('color-start').get()]
 
-        self._fader = ColorFade(fade_colors, self._fader_steps)
+        self._fader = ColorFade.get(fade_colors, self._fader_steps)
 
     def reset(self):
         self.locations = self.scene().get_all_pixel_locations()
+        self.wave_offset = self.random.random_sample()
 
     def draw(self, dt):
+        params = self.params
         if self._mixer.is_onset():
-            self.onset_speed_boost = self.parameter('onset-speed-boost').get()
+            self.onset_speed_boost = params.onset_speed_boost
 
-        self.center_offset_angle += dt * self.parameter('center-speed').get() * self.onset_speed_boost
-        self.hue_inner += dt * self.parameter('hue-speed').get() * self.onset_speed_boost
-        self.wave_offset += dt * self.parameter('wave-speed').get() * self.onset_speed_boost
-        self.color_offset += dt * self.parameter('speed').get() * self.onset_speed_boost
+        self.center_offset_angle += dt * params.center_speed * self.onset_speed_boost
+        self.hue_inner += dt * params.hue_speed * self.onset_speed_boost
+        self.wave_offset += dt * params.wave_speed * self.onset_speed_boost
+        self.color_offset += dt * params.speed * self.onset_speed_boost
 
-        self.onset_speed_boost = max(1, self.onset_speed_boost - self.parameter('onset-speed-decay').get())
+        self.onset_speed_boost = max(1, self.onset_speed_boost - params.onset_speed_decay)
 
-        wave_hue_period = 2 * math.pi * self.parameter('wave-hue-period').get()
-        wave_hue_width = self.parameter('wave-hue-width').get()
-        radius_hue_width = self.parameter('radius-hue-width').get()
-        angle_hue_width = self.parameter('angle-hue-width').get()
+        wave_hue_period = 2 * math.pi * params.wave_hue_period
+        wave_hue_width = params.wave_hue_width
+        radius_hue_width = params.radius_hue_width
+        angle_hue_width = params.angle_hue_width
 
         cx, cy = self.scene().center_point()
 
-        center_distance = self.parameter('center-distance').get()
+        center_distance = params.center_distance
         x,y = (self.locations - (cx + math.cos(self.center_offset_angle) * center_distance,
                                   cy + math.sin(self.center_offset_angle) * center_distance)).T
         self.pixel_distances = np.sqrt(np.square(x) + np.square(y))
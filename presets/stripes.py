@@ -1,5 +1,4 @@
 import colorsys
-import random
 import math
 import numpy as np
 import ast
@@ -22,9 +21,6 @@ class StripeGradient(RawPreset):
         self.add_parameter(StringParameter('color-gradient', "[(0,0,1), (0,0,1), (0,1,1), (0,1,1), (0,0,1)]"))
         self.add_parameter(FloatParameter('stripe-x-center', 0.5))
         self.add_parameter(FloatParameter('stripe-y-center', 0.5))
-        self.hue_inner = random.random() + 100
-        self._center_rotation = random.random()
-        self.stripe_angle = random.random()
 
         cx, cy = self.scene().center_point()
         self.locations = self.scene().get_all_pixel_locations()
@@ -39,10 +35,12 @@ class StripeGradient(RawPreset):
 
     def parameter_changed(self, parameter):
         fade_colors = ast.literal_eval(self.parameter('color-gradient').get())
-        self._fader = ColorFade(fade_colors, self.parameter('posterization').get())
+        self._fader = ColorFade.get(fade_colors, self.parameter('posterization').get())
     
     def reset(self):
-        pass
+        self.hue_inner = self.random.random_sample() + 100
+        self._center_rotation = self.random.random_sample()
+        self.stripe_angle = self.random.random_sample()
 
     def draw(self, dt):
         if self._mixer.is_onset():
@@ -5,9 +5,18 @@ import core.networking
 
 import lib.preset
 import lib.basic_tickers
+import lib.address_model
 import lib.color_fade
+import lib.commands
+import lib.node_sync
+import lib.scene
 
 
 if __name__ == "__main__":
-    suite = unittest.TestLoader().loadTestsFromModule(lib.color_fade)
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite([loader.loadTestsFromModule(lib.address_model),
+                                loader.loadTestsFromModule(lib.color_fade),
+                                loader.loadTestsFromModule(lib.commands),
+                                loader.loadTestsFromModule(lib.node_sync),
+                                loader.loadTestsFromModule(lib.scene)])
     unittest.TextTestRunner(verbosity=2).run(suite)
\ No newline at end of file
@@ -7,6 +7,8 @@ from ui.ui_firemix import Ui_FireMixMain
 from ui.dlg_add_preset import DlgAddPreset
 from ui.dlg_settings import DlgSettings
 
+from lib.profiling import SECTION_TICK, SECTION_DRAW, SECTION_NAMES
+
 class FireMixGUI(QtGui.QMainWindow, Ui_FireMixMain):
 
     def __init__(self, parent=None, app=None):
@@ -46,6 +48,7 @@ class FireMixGUI(QtGui.QMainWindow, Ui_FireMixMain):
 
         # Tools menu
         self.action_file_generate_default_playlist.triggered.connect(self.on_file_generate_default_playlist)
+        self.action_tools_preset_profile.triggered.connect(self.on_tools_preset_profile)
 
         # Preset list
         self.lst_presets.itemDoubleClicked.connect(self.on_preset_double_clicked)
@@ -148,13 +151,13 @@ class FireMixGUI(QtGui.QMainWindow, Ui_FireMixMain):
 
         active_preset = self._mixer.default_layer()._playlist.get_active_preset()
         if active_preset:
-            # Update wibblers
+            # Update modulated parameters
             for name, parameter in active_preset.get_parameters().iteritems():
-                if parameter._wibbler is not None:
+                if parameter.is_animated():
                     pval = parameter.get()
                     for i in range(self.tbl_preset_parameters.rowCount()):
                         if self.tbl_preset_parameters.item(i, 0).text() == name:
-                            # TODO: For now, all wibblers are float values.  Maybe they should be allowed to be others?
+                            # TODO: For now, all modulated parameters are float values.  Maybe they should be allowed to be others?
                             self.tbl_preset_parameters.item(i, 2).setText("= %0.2f" % pval)
                             self.tbl_preset_parameters.item(i, 2).setBackground(QtGui.QColor(200, 255, 255))
 
@@ -415,6 +418,32 @@ class FireMixGUI(QtGui.QMainWindow, Ui_FireMixMain):
             self._mixer.default_layer()._playlist.generate_default_playlist()
             self.update_playlist()
 
+    def on_tools_preset_profile(self):
+        profiler = self._mixer.profiler
+        presets = self._mixer.default_layer().playlist().get()
+
+        lines = ["%-32s %8s %9s %9s %9s %8s" % ("Preset", "Ticks", "Tick ms", "Draw ms", "Worst ms", "Culled")]
+        for preset, profile in profiler.rank(presets):
+            culled = (100.0 * profile.culled_commands / profile.commands) if profile.commands else 0.0
+            lines.append("%-32s %8d %9.2f %9.2f %9.2f %7.1f%%" % (
+                preset.get_name()[:32], profile.counts[SECTION_TICK], profile.mean(SECTION_TICK),
+                profile.mean(SECTION_DRAW), profile.worst[SECTION_TICK], culled))
+
+        slow_frames = ["%s  %-32s %-10s %6.1f ms" % (
+            time.strftime("%H:%M:%S", time.localtime(frame['time'])), frame['name'][:32],
+            SECTION_NAMES[frame['section']], frame['ms']) for frame in profiler.slow_frames()]
+
+        dlg = QtGui.QMessageBox(self)
+        dlg.setWindowTitle("FireMix - Preset Profile")
+        dlg.setText("Presets in the current playlist, most expensive first.")
+        dlg.setInformativeText("<pre>%s</pre>" % "\n".join(lines))
+        if len(slow_frames) > 0:
+            dlg.setDetailedText("\n".join(slow_frames))
+        dlg.setStandardButtons(QtGui.QMessageBox.Reset | QtGui.QMessageBox.Close)
+        dlg.setDefaultButton(QtGui.QMessageBox.Close)
+        if dlg.exec_() == QtGui.QMessageBox.Reset:
+            profiler.reset(presets)
+
     def on_edit_settings(self):
         DlgSettings(self).exec_()
 